@@ -7,6 +7,7 @@ class AppnproylogicoConfig(AppConfig):
     name = 'appnproylogico'
 
     def ready(self):
+        from . import signals
         try:
             args = set(sys.argv or [])
             if any(a in args for a in {'makemigrations','migrate','collectstatic','test'}):
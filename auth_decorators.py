@@ -1,8 +1,10 @@
+import hashlib
 from functools import wraps
 from django.shortcuts import redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from .roles import obtener_permisos_usuario, obtener_rol_usuario
+from .roles import cache_compartida, obtener_permisos_usuario, obtener_rol_usuario, permisos_cache_ttl
+from django.core.cache import cache
 from django.conf import settings
 from oauth2_provider.models import AccessToken
 from django.utils import timezone
@@ -65,24 +67,63 @@ def solo_admin(view_func):
     return _wrapped_view
 
 
+def clave_token(token: str) -> str:
+    return 'oauth_at_' + hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def invalidar_token(token: str):
+    if token:
+        cache.delete(clave_token(token))
+
+
+def _token_info(token: str, user) -> dict:
+    # Memo por request en el usuario + caché compartida de TTL corto (solo si la ven todos los workers:
+    # un token revocado debe dejar de valer en todos a la vez)
+    memo = getattr(user, '_oauth_memo', None)
+    if memo is None:
+        memo = {}
+        user._oauth_memo = memo
+    if token in memo:
+        return memo[token]
+    compartida = cache_compartida()
+    clave = clave_token(token)
+    info = cache.get(clave) if compartida else None
+    if info is None:
+        at = AccessToken.objects.select_related('application').filter(token=token).first()
+        ttl = permisos_cache_ttl()
+        if at:
+            app = at.application
+            info = {
+                'user_id': at.user_id,
+                'app': app.name if app else '',
+                'scope': (getattr(at, 'scope', '') or '').split(),
+                'expires': at.expires.timestamp(),
+            }
+            ttl = max(1, min(ttl, int(info['expires'] - timezone.now().timestamp())))
+        else:
+            info = {}
+        if compartida:
+            cache.set(clave, info, ttl)
+    memo[token] = info
+    return info
+
+
 def _verify_oauth(token: str, user, method: str | None = None) -> bool:
     if not token or not user:
         return False
     try:
-        at = AccessToken.objects.select_related('application', 'user').filter(token=token).first()
-        if not at:
+        info = _token_info(token, user)
+        if not info:
             return False
-        if at.expires < timezone.now():
+        if info['expires'] < timezone.now().timestamp():
             return False
-        if at.user_id != user.id:
+        if info['user_id'] != user.id:
             return False
-        app = at.application
-        if not app or app.name != 'ProyLogico First-Party':
+        if info['app'] != 'ProyLogico First-Party':
             return False
         # Scope check: GET requires 'read', POST requires 'write'
-        sc = (getattr(at, 'scope', '') or '')
         need = 'write' if (method or '').upper() == 'POST' else 'read'
-        if need not in sc.split():
+        if need not in info['scope']:
             return False
         return True
     except Exception:
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Usuario
+from ...services.asignacion_service import ASIGNACION_MAX_DESPACHOS, auto_asignar
+
+
+class Command(BaseCommand):
+    help = 'Asigna motoristas a los despachos PENDIENTE (húngaro o greedy con reparación)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Solo mostrar la propuesta, sin aplicarla')
+        parser.add_argument('--capacidad', type=int, default=None, help='Despachos en curso por motorista (default settings.ASIGNACION_CAPACIDAD)')
+        parser.add_argument('--limite', type=int, default=ASIGNACION_MAX_DESPACHOS, help='Máximo de despachos PENDIENTE a considerar')
+        parser.add_argument('--usuario', type=int, default=None, help='id de Usuario que firma los movimientos (default settings.ASIGNACION_USUARIO_SISTEMA)')
+
+    def handle(self, *args, **options):
+        aplicar = not options['dry_run']
+        usuario_id = options['usuario'] or getattr(settings, 'ASIGNACION_USUARIO_SISTEMA', '')
+        usuario = Usuario.objects.filter(id=usuario_id).first() if usuario_id else None
+        if usuario_id and usuario is None:
+            raise CommandError(f'No existe el Usuario {usuario_id}')
+        if aplicar and usuario is None:
+            raise CommandError('Indica --usuario o settings.ASIGNACION_USUARIO_SISTEMA para aplicar (o usa --dry-run)')
+        resumen = auto_asignar(usuario=usuario, aplicar=aplicar, capacidad=options['capacidad'], limite=max(1, options['limite']))
+        for p in resumen['propuestas']:
+            self.stdout.write(f"  {p['codigo']} -> motorista {p['motorista_id']} ({p['distancia_km']} km)")
+        self.stdout.write(self.style.SUCCESS(
+            f"{resumen['metodo']}: {len(resumen['propuestas'])} propuestas, {resumen['aplicados']} aplicadas, "
+            f"{len(resumen['sin_asignar'])} sin asignar; resuelto en {resumen['tiempo_ms']} ms"
+        ))
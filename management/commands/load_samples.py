@@ -1,10 +1,12 @@
 import json
 import pathlib
 from datetime import date, time
+from time import perf_counter
 from django.utils import timezone
 
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 
 from ...models import Localfarmacia, Moto, Motorista, Usuario, Rol, AsignacionMotoMotorista, AsignacionMotoristaFarmacia, Despacho
@@ -15,6 +17,8 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--dir', type=str, default=None, help='Directorio de datos (por defecto static/data)')
+        parser.add_argument('--bulk', action='store_true', help='Carga por lotes (bulk_create/bulk_update), para fixtures grandes')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tamaño de lote en modo --bulk')
 
     def handle(self, *args, **options):
         base = pathlib.Path(__file__).resolve().parents[3] / 'static' / 'data'
@@ -22,6 +26,10 @@ class Command(BaseCommand):
             base = pathlib.Path(options['dir']).resolve()
         self.stdout.write(self.style.NOTICE(f'Usando carpeta de datos: {base}'))
 
+        if options.get('bulk'):
+            self._run_bulk(base, max(1, options.get('batch_size') or 1000))
+            return
+
         # Ejecutar por lote para evitar que un error anule todo
         farmacias_c = self._load_farmacias(base)
         motos_c = self._load_motos(base)
@@ -56,24 +64,7 @@ class Command(BaseCommand):
                     continue
                 obj = Localfarmacia.objects.filter(local_id=lid).first()
                 now_dt = timezone.now()
-                defaults = {
-                    'local_nombre': d.get('local_nombre') or d.get('nombre') or f'Farmacia {lid}',
-                    'local_direccion': d.get('local_direccion') or d.get('direccion') or 'Por definir',
-                    'comuna_nombre': d.get('comuna_nombre') or d.get('comuna') or '',
-                    'localidad_nombre': d.get('localidad_nombre') or d.get('localidad') or '',
-                    'funcionamiento_hora_apertura': self._parse_time(d.get('funcionamiento_hora_apertura')) or time(9, 0),
-                    'funcionamiento_hora_cierre': self._parse_time(d.get('funcionamiento_hora_cierre')) or time(18, 0),
-                    'funcionamiento_dia': d.get('funcionamiento_dia') or 'lun-vie',
-                    'local_telefono': d.get('local_telefono') or '',
-                    'local_lat': self._parse_decimal(d.get('local_lat')),
-                    'local_lng': self._parse_decimal(d.get('local_lng')),
-                    'geolocalizacion_validada': bool(d.get('geolocalizacion_validada') or False),
-                    'fecha': self._parse_date(d.get('fecha') or d.get('fecha_actualizacion')) or date.today(),
-                    'activo': bool(d.get('activo') if d.get('activo') is not None else True),
-                    'fecha_creacion': now_dt,
-                    'fecha_modificacion': now_dt,
-                    'usuario_modificacion': None,
-                }
+                defaults = self._defaults_farmacia(d, lid, now_dt)
                 try:
                     if obj:
                         for k, v in defaults.items():
@@ -100,26 +91,7 @@ class Command(BaseCommand):
                     continue
                 obj = Moto.objects.filter(patente=pat).first()
                 now_dt = timezone.now()
-                defaults = {
-                    'propietario_nombre': d.get('propietario_nombre') or 'LOGICO SPA',
-                    'propietario_tipo_documento': d.get('propietario_tipo_documento') or 'RUT',
-                    'propietario_documento': d.get('propietario_documento') or f'RUT-{pat}',
-                    'anio': int(d.get('anio') or 2020),
-                    'cilindrada_cc': int(d.get('cilindrada_cc') or 150),
-                    'color': d.get('color') or 'NEGRO',
-                    'marca': d.get('marca') or 'GENERICA',
-                    'modelo': d.get('modelo') or 'STD',
-                    'tipo_combustible': (d.get('tipo_combustible') or 'GASOLINA').upper(),
-                    'fecha_inscripcion': self._parse_date(d.get('fecha_inscripcion')) or date(2020, 1, 1),
-                    'kilometraje_actual': int(d.get('kilometraje_actual') or 0),
-                    'activo': bool(d.get('activo') if d.get('activo') is not None else True),
-                    'estado': ('ACTIVO' if (d.get('activo') if d.get('activo') is not None else True) else 'INACTIVO'),
-                    'numero_motor': d.get('numero_motor') or f'MOTOR-{pat}',
-                    'numero_chasis': d.get('numero_chasis') or f'CHASIS-{pat}',
-                    'fecha_creacion': now_dt,
-                    'fecha_modificacion': now_dt,
-                    'usuario_modificacion': None,
-                }
+                defaults = self._defaults_moto(d, pat, now_dt)
                 try:
                     if obj:
                         for k, v in defaults.items():
@@ -136,40 +108,7 @@ class Command(BaseCommand):
                         pass
                     continue
         # Asegurar al menos 56 motos (3 inactivas)
-        try:
-            existentes = Moto.objects.count()
-            faltan = 56 - existentes
-            if faltan > 0:
-                now_dt = timezone.now()
-                nuevos = []
-                for i in range(faltan):
-                    idx = existentes + i + 1
-                    pat = f"PX{idx:04d}" if idx <= 9999 else f"PX{idx}"
-                    if Moto.objects.filter(patente=pat).exists():
-                        continue
-                    activa_flag = i < max(faltan - 3, 0)
-                    nuevos.append(Moto(
-                        patente=pat,
-                        marca='GENERICA', modelo='STD', tipo_combustible='GASOLINA',
-                        fecha_inscripcion=date(2020,1,1), kilometraje_actual=0, activo=activa_flag, estado=('ACTIVO' if activa_flag else 'INACTIVO'),
-                        numero_motor=f'MOTOR-{pat}', numero_chasis=f'CHASIS-{pat}',
-                        propietario_nombre='LOGICO SPA', propietario_tipo_documento='RUT', propietario_documento=f'RUT-{pat}',
-                        anio=2020, cilindrada_cc=150, color='NEGRO', fecha_creacion=now_dt, fecha_modificacion=now_dt,
-                        usuario_modificacion=None,
-                    ))
-                if nuevos:
-                    try:
-                        Moto.objects.bulk_create(nuevos, ignore_conflicts=True)
-                        count += len(nuevos)
-                    except Exception:
-                        for m in nuevos:
-                            try:
-                                m.save()
-                                count += 1
-                            except Exception:
-                                pass
-        except Exception:
-            pass
+        count += self._asegurar_motos_minimas()
         return count
 
     def _load_motoristas(self, base: pathlib.Path) -> int:
@@ -216,18 +155,7 @@ class Command(BaseCommand):
                     usuario.save()
                 mot = Motorista.objects.filter(usuario=usuario).first()
                 now_dt = timezone.now()
-                defaults = {
-                    'licencia_numero': d.get('licencia_numero') or f'L-{user.id}',
-                    'licencia_clase': d.get('licencia_clase') or 'A',
-                    'fecha_vencimiento_licencia': self._parse_date(d.get('fecha_vencimiento_licencia')) or date(2026, 1, 1),
-                    'emergencia_nombre': d.get('emergencia_nombre') or 'Contacto',
-                    'emergencia_telefono': d.get('emergencia_telefono') or '+56900000000',
-                    'emergencia_parentesco': d.get('emergencia_parentesco') or 'Otro',
-                    'total_entregas_completadas': int(d.get('total_entregas_completadas') or 0),
-                    'total_entregas_fallidas': int(d.get('total_entregas_fallidas') or 0),
-                    'activo': 1 if (d.get('activo') is None or d.get('activo')) else 0,
-                    'disponible_hoy': 1 if d.get('disponible_hoy') else 0,
-                }
+                defaults = self._defaults_motorista(d, user.id)
                 try:
                     if mot:
                         for k, v in defaults.items():
@@ -465,38 +393,8 @@ class Command(BaseCommand):
                     # Crear/actualizar despacho
                     obj = Despacho.objects.filter(codigo_despacho=codigo).first()
                     now_dt = timezone.now()
-                    defaults = {
-                        'farmacia_origen_local_id': (d.get('farmacia_origen_local_id') or 'F001'),
-                        'farmacia_destino_local_id': d.get('farmacia_destino_local_id') or None,
-                        'motorista': mot,
-                        'estado': (d.get('estado') or 'PENDIENTE').upper(),
-                        'tipo_despacho': (d.get('tipo_despacho') or 'DOMICILIO').upper(),
-                        'prioridad': (d.get('prioridad') or 'MEDIA').upper(),
-                        'cliente_nombre': d.get('cliente_nombre') or None,
-                        'cliente_telefono': d.get('cliente_telefono') or None,
-                        'destino_direccion': d.get('destino_direccion') or 'Por definir',
-                        'destino_referencia': d.get('destino_referencia') or None,
-                        'destino_lat': self._parse_decimal(d.get('destino_lat')),
-                        'destino_lng': self._parse_decimal(d.get('destino_lng')),
-                        'destino_geolocalizacion_validada': bool(d.get('destino_geolocalizacion_validada') or False),
-                        'tiene_receta_retenida': bool(d.get('tiene_receta_retenida') or False),
-                        'numero_receta': d.get('numero_receta') or None,
-                        'requiere_devolucion_receta': bool(d.get('requiere_devolucion_receta') or False),
-                        'receta_devuelta_farmacia': bool(d.get('receta_devuelta_farmacia') or False),
-                        'observaciones_receta': d.get('observaciones_receta') or None,
-                        'descripcion_productos': d.get('descripcion_productos') or 'Sin detalle',
-                        'valor_declarado': self._parse_decimal(d.get('valor_declarado')),
-                        'requiere_aprobacion_operadora': bool(d.get('requiere_aprobacion_operadora') or False),
-                        'aprobado_por_operadora': bool(d.get('aprobado_por_operadora') or False),
-                        'firma_digital': bool(d.get('firma_digital') or False),
-                        'hubo_incidencia': bool(d.get('hubo_incidencia') or False),
-                        'usuario_aprobador': None,
-                        'fecha_aprobacion': None,
-                        'fecha_registro': self._parse_datetime(d.get('fecha_registro')) or now_dt,
-                        'fecha_modificacion': now_dt,
-                        'usuario_registro': usuario_reg,
-                        'usuario_modificacion': usuario_reg,
-                    }
+                    defaults = self._defaults_despacho(d, now_dt)
+                    defaults.update(motorista=mot, usuario_registro=usuario_reg, usuario_modificacion=usuario_reg)
                     try:
                         if obj:
                             for k, v in defaults.items():
@@ -516,70 +414,6 @@ class Command(BaseCommand):
                     continue
         return count
 
-        # Generar datos sintéticos si hay pocos despachos
-        try:
-            total = Despacho.objects.count()
-            objetivo = 30
-            if total < objetivo:
-                farmacias = list(Localfarmacia.objects.all()[:5])
-                motoristas = list(Motorista.objects.all()[:10])
-                if not farmacias or not motoristas:
-                    return count
-                now_dt = timezone.now()
-                estados = ['PENDIENTE','EN_CAMINO','ENTREGADO','FALLIDO','ANULADO']
-                tipos = ['DOMICILIO','REENVIO_RECETA','INTERCAMBIO','ERROR_DESPACHO']
-                prioridad = ['ALTA','MEDIA','BAJA']
-                gen = 0
-                for i in range(objetivo - total):
-                    f = farmacias[i % len(farmacias)]
-                    m = motoristas[i % len(motoristas)]
-                    est = estados[i % len(estados)]
-                    t = tipos[i % len(tipos)]
-                    pr = prioridad[i % len(prioridad)]
-                    codigo = f"DSP-{now_dt.strftime('%Y%m%d')}-{i:04d}"
-                    try:
-                        if not Despacho.objects.filter(codigo_despacho=codigo).exists():
-                            obj = Despacho(
-                                codigo_despacho=codigo,
-                                numero_orden_farmacia=f"ORD-{i:05d}",
-                                farmacia_origen_local_id=f.local_id,
-                                farmacia_destino_local_id=farmacias[(i+1) % len(farmacias)].local_id if t == 'INTERCAMBIO' else None,
-                                motorista=m,
-                                estado=est,
-                                tipo_despacho=t,
-                                prioridad=pr,
-                                cliente_nombre=f"Cliente {i}",
-                                cliente_telefono='+56900000000',
-                                destino_direccion=f"Calle {i} #123",
-                                destino_referencia='Frente a plaza',
-                                destino_geolocalizacion_validada=False,
-                                tiene_receta_retenida=True if t == 'REENVIO_RECETA' else False,
-                                numero_receta=f"REC-{i:05d}" if t == 'REENVIO_RECETA' else None,
-                                requiere_devolucion_receta=True if t == 'REENVIO_RECETA' else False,
-                                receta_devuelta_farmacia=False,
-                                observaciones_receta=None,
-                                descripcion_productos='Demo productos',
-                                valor_declarado=10000 + (i * 100),
-                                requiere_aprobacion_operadora=False,
-                                aprobado_por_operadora=False,
-                                firma_digital=(est == 'ENTREGADO'),
-                                hubo_incidencia=(t == 'ERROR_DESPACHO'),
-                                usuario_aprobador=None,
-                                fecha_aprobacion=None,
-                                fecha_registro=now_dt,
-                                fecha_asignacion=now_dt,
-                                fecha_salida_farmacia=None,
-                                fecha_modificacion=now_dt,
-                                usuario_registro=Usuario.objects.order_by('id').first(),
-                                usuario_modificacion=Usuario.objects.order_by('id').first(),
-                            )
-                            obj.save()
-                            gen += 1
-                count += gen
-        except Exception:
-            pass
-        return count
-
     def _load_movimientos(self, base: pathlib.Path) -> int:
         count = 0
         for name, data in self._iter_files(base, 'movimientos'):
@@ -618,6 +452,523 @@ class Command(BaseCommand):
                     continue
         return count
 
+    def _defaults_farmacia(self, d, lid, now_dt):
+        return {
+            'local_nombre': d.get('local_nombre') or d.get('nombre') or f'Farmacia {lid}',
+            'local_direccion': d.get('local_direccion') or d.get('direccion') or 'Por definir',
+            'comuna_nombre': d.get('comuna_nombre') or d.get('comuna') or '',
+            'localidad_nombre': d.get('localidad_nombre') or d.get('localidad') or '',
+            'funcionamiento_hora_apertura': self._parse_time(d.get('funcionamiento_hora_apertura')) or time(9, 0),
+            'funcionamiento_hora_cierre': self._parse_time(d.get('funcionamiento_hora_cierre')) or time(18, 0),
+            'funcionamiento_dia': d.get('funcionamiento_dia') or 'lun-vie',
+            'local_telefono': d.get('local_telefono') or '',
+            'local_lat': self._parse_decimal(d.get('local_lat')),
+            'local_lng': self._parse_decimal(d.get('local_lng')),
+            'geolocalizacion_validada': bool(d.get('geolocalizacion_validada') or False),
+            'fecha': self._parse_date(d.get('fecha') or d.get('fecha_actualizacion')) or date.today(),
+            'activo': bool(d.get('activo') if d.get('activo') is not None else True),
+            'fecha_creacion': now_dt,
+            'fecha_modificacion': now_dt,
+            'usuario_modificacion': None,
+        }
+
+    def _defaults_moto(self, d, pat, now_dt):
+        return {
+            'propietario_nombre': d.get('propietario_nombre') or 'LOGICO SPA',
+            'propietario_tipo_documento': d.get('propietario_tipo_documento') or 'RUT',
+            'propietario_documento': d.get('propietario_documento') or f'RUT-{pat}',
+            'anio': int(d.get('anio') or 2020),
+            'cilindrada_cc': int(d.get('cilindrada_cc') or 150),
+            'color': d.get('color') or 'NEGRO',
+            'marca': d.get('marca') or 'GENERICA',
+            'modelo': d.get('modelo') or 'STD',
+            'tipo_combustible': (d.get('tipo_combustible') or 'GASOLINA').upper(),
+            'fecha_inscripcion': self._parse_date(d.get('fecha_inscripcion')) or date(2020, 1, 1),
+            'kilometraje_actual': int(d.get('kilometraje_actual') or 0),
+            'activo': bool(d.get('activo') if d.get('activo') is not None else True),
+            'estado': ('ACTIVO' if (d.get('activo') if d.get('activo') is not None else True) else 'INACTIVO'),
+            'numero_motor': d.get('numero_motor') or f'MOTOR-{pat}',
+            'numero_chasis': d.get('numero_chasis') or f'CHASIS-{pat}',
+            'fecha_creacion': now_dt,
+            'fecha_modificacion': now_dt,
+            'usuario_modificacion': None,
+        }
+
+    def _defaults_motorista(self, d, user_id):
+        return {
+            'licencia_numero': d.get('licencia_numero') or f'L-{user_id}',
+            'licencia_clase': d.get('licencia_clase') or 'A',
+            'fecha_vencimiento_licencia': self._parse_date(d.get('fecha_vencimiento_licencia')) or date(2026, 1, 1),
+            'emergencia_nombre': d.get('emergencia_nombre') or 'Contacto',
+            'emergencia_telefono': d.get('emergencia_telefono') or '+56900000000',
+            'emergencia_parentesco': d.get('emergencia_parentesco') or 'Otro',
+            'total_entregas_completadas': int(d.get('total_entregas_completadas') or 0),
+            'total_entregas_fallidas': int(d.get('total_entregas_fallidas') or 0),
+            'activo': 1 if (d.get('activo') is None or d.get('activo')) else 0,
+            'disponible_hoy': 1 if d.get('disponible_hoy') else 0,
+        }
+
+    def _defaults_despacho(self, d, now_dt):
+        return {
+            'farmacia_origen_local_id': (d.get('farmacia_origen_local_id') or 'F001'),
+            'farmacia_destino_local_id': d.get('farmacia_destino_local_id') or None,
+            'estado': (d.get('estado') or 'PENDIENTE').upper(),
+            'tipo_despacho': (d.get('tipo_despacho') or 'DOMICILIO').upper(),
+            'prioridad': (d.get('prioridad') or 'MEDIA').upper(),
+            'cliente_nombre': d.get('cliente_nombre') or None,
+            'cliente_telefono': d.get('cliente_telefono') or None,
+            'destino_direccion': d.get('destino_direccion') or 'Por definir',
+            'destino_referencia': d.get('destino_referencia') or None,
+            'destino_lat': self._parse_decimal(d.get('destino_lat')),
+            'destino_lng': self._parse_decimal(d.get('destino_lng')),
+            'destino_geolocalizacion_validada': bool(d.get('destino_geolocalizacion_validada') or False),
+            'tiene_receta_retenida': bool(d.get('tiene_receta_retenida') or False),
+            'numero_receta': d.get('numero_receta') or None,
+            'requiere_devolucion_receta': bool(d.get('requiere_devolucion_receta') or False),
+            'receta_devuelta_farmacia': bool(d.get('receta_devuelta_farmacia') or False),
+            'observaciones_receta': d.get('observaciones_receta') or None,
+            'descripcion_productos': d.get('descripcion_productos') or 'Sin detalle',
+            'valor_declarado': self._parse_decimal(d.get('valor_declarado')),
+            'requiere_aprobacion_operadora': bool(d.get('requiere_aprobacion_operadora') or False),
+            'aprobado_por_operadora': bool(d.get('aprobado_por_operadora') or False),
+            'firma_digital': bool(d.get('firma_digital') or False),
+            'hubo_incidencia': bool(d.get('hubo_incidencia') or False),
+            'usuario_aprobador': None,
+            'fecha_aprobacion': None,
+            'fecha_registro': self._parse_datetime(d.get('fecha_registro')) or now_dt,
+            'fecha_modificacion': now_dt,
+        }
+
+    def _asegurar_motos_minimas(self) -> int:
+        # Asegurar al menos 56 motos (3 inactivas)
+        creadas = 0
+        try:
+            existentes = Moto.objects.count()
+            faltan = 56 - existentes
+            if faltan > 0:
+                now_dt = timezone.now()
+                nuevos = []
+                for i in range(faltan):
+                    idx = existentes + i + 1
+                    pat = f"PX{idx:04d}" if idx <= 9999 else f"PX{idx}"
+                    if Moto.objects.filter(patente=pat).exists():
+                        continue
+                    activa_flag = i < max(faltan - 3, 0)
+                    nuevos.append(Moto(
+                        patente=pat,
+                        marca='GENERICA', modelo='STD', tipo_combustible='GASOLINA',
+                        fecha_inscripcion=date(2020,1,1), kilometraje_actual=0, activo=activa_flag, estado=('ACTIVO' if activa_flag else 'INACTIVO'),
+                        numero_motor=f'MOTOR-{pat}', numero_chasis=f'CHASIS-{pat}',
+                        propietario_nombre='LOGICO SPA', propietario_tipo_documento='RUT', propietario_documento=f'RUT-{pat}',
+                        anio=2020, cilindrada_cc=150, color='NEGRO', fecha_creacion=now_dt, fecha_modificacion=now_dt,
+                        usuario_modificacion=None,
+                    ))
+                if nuevos:
+                    try:
+                        Moto.objects.bulk_create(nuevos, ignore_conflicts=True)
+                        creadas += len(nuevos)
+                    except Exception:
+                        for m in nuevos:
+                            try:
+                                m.save()
+                                creadas += 1
+                            except Exception:
+                                pass
+        except Exception:
+            pass
+        return creadas
+
+    # --- Modo --bulk: mapas precargados + bulk_create/bulk_update, una transacción por archivo ---
+
+    def _run_bulk(self, base: pathlib.Path, batch: int):
+        # Claves cargadas, para refrescar índices y rutas al terminar
+        self._farmacias_bulk, self._codigos_bulk = set(), set()
+        etapas = [
+            ('Farmacias', self._bulk_farmacias),
+            ('Motos', self._bulk_motos),
+            ('Motoristas', self._bulk_motoristas),
+            ('Asignaciones Moto–Motorista', self._bulk_asignaciones_moto_motorista),
+            ('Asignaciones Motorista–Farmacia', self._bulk_asignaciones_motorista_farmacia),
+            ('Despachos', self._bulk_despachos),
+            ('Movimientos', self._bulk_movimientos),
+        ]
+        for entidad, loader in etapas:
+            inicio = perf_counter()
+            n = loader(base, batch)
+            seg = max(perf_counter() - inicio, 1e-6)
+            self.stdout.write(self.style.SUCCESS(f'{entidad}: {n} filas en {seg:.2f}s ({n / seg:.0f} filas/s)'))
+        self._refrescar_derivados(batch)
+
+    def _refrescar_derivados(self, batch: int):
+        """bulk_create/bulk_update no emiten post_save: lo que harían las señales, una vez al final."""
+        from ...repositories import invalidar_despachos_activos, invalidar_metricas_dashboard
+        from ...services.busqueda_service import indexar_despachos
+        from ...services.geo_service import invalidar_indice_geo
+        from ...services.rutas_service import planificar_motoristas
+        invalidar_despachos_activos()
+        invalidar_metricas_dashboard()
+        invalidar_indice_geo('farmacias')
+        invalidar_indice_geo('despachos')
+        ids, motoristas = set(), set()
+        codigos = list(self._codigos_bulk)
+        for i in range(0, len(codigos), batch):
+            for did, mid in Despacho.objects.filter(codigo_despacho__in=codigos[i:i + batch]).values_list('id', 'motorista_id'):
+                ids.add(did)
+                motoristas.add(mid)
+        # Un cambio de nombre de farmacia también cambia las filas de búsqueda de sus despachos
+        locales = list(self._farmacias_bulk)
+        for i in range(0, len(locales), batch):
+            ids.update(Despacho.objects.filter(farmacia_origen_local_id__in=locales[i:i + batch]).values_list('id', flat=True))
+        if ids:
+            indexar_despachos(sorted(ids))
+        if motoristas:
+            planificar_motoristas(motoristas)
+
+    def _bulk_archivos(self, base: pathlib.Path, prefix: str, procesar):
+        # Una transacción por archivo: si falla un lote se revierte solo ese archivo
+        count = 0
+        for name, data in self._iter_files(base, prefix):
+            try:
+                with transaction.atomic():
+                    count += procesar(data or [])
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f'Error cargando {name}: {e}'))
+        return count
+
+    def _rol(self, codigo, nombre, grupo, descripcion):
+        rol = Rol.objects.filter(codigo=codigo).first()
+        if not rol:
+            now = timezone.now()
+            rol = Rol(codigo=codigo, nombre=nombre, django_group_name=grupo, descripcion=descripcion, activo=1, fecha_creacion=now, fecha_modificacion=now)
+            rol.save()
+        return rol
+
+    def _usuario_registro(self):
+        usuario = Usuario.objects.order_by('id').first()
+        if usuario:
+            return usuario
+        # Crear operadora demo si no existe
+        user = User.objects.filter(username='operadora_demo').first()
+        if not user:
+            user = User.objects.create_user(username='operadora_demo', password='TempPass123!', first_name='Operadora', last_name='Demo')
+        rol_op = self._rol('operador', 'Operador', 'Operadores', 'Rol de operador')
+        usuario = Usuario.objects.filter(django_user_id=user.id).first()
+        if not usuario:
+            now = timezone.now()
+            usuario = Usuario(rol=rol_op, django_user_id=user.id, tipo_documento='DNI', documento_identidad=f'OP-{user.id}', nombre='Operadora', apellido='Demo', activo=1, fecha_creacion=now, fecha_modificacion=now)
+            usuario.save()
+        return usuario
+
+    def _bulk_usuarios_motorista(self, por_username: dict, batch: int) -> dict:
+        """username -> (nombre, apellido). Crea User/Usuario/Motorista faltantes y devuelve username -> motorista_id."""
+        if not por_username:
+            return {}
+        now = timezone.now()
+        users = dict(User.objects.filter(username__in=list(por_username)).values_list('username', 'id'))
+        faltan = [u for u in por_username if u not in users]
+        if faltan:
+            # Un solo hash para todas las cuentas demo: make_password por fila domina el tiempo de carga
+            pwd = make_password('TempPass123!')
+            User.objects.bulk_create(
+                [User(username=u, password=pwd, first_name=por_username[u][0], last_name=por_username[u][1], date_joined=now) for u in faltan],
+                batch_size=batch, ignore_conflicts=True,
+            )
+            users.update(User.objects.filter(username__in=faltan).values_list('username', 'id'))
+        rol = self._rol('motorista', 'Motorista', 'Motoristas', 'Rol de motorista')
+        usuarios = dict(Usuario.objects.filter(django_user_id__in=users.values()).values_list('django_user_id', 'id'))
+        nuevos = []
+        for uname, uid in users.items():
+            if uid not in usuarios:
+                nombre, apellido = por_username[uname]
+                nuevos.append(Usuario(rol=rol, django_user_id=uid, tipo_documento='DNI', documento_identidad=f'MOT-{uid}', nombre=nombre, apellido=apellido or 'Demo', activo=1, fecha_creacion=now, fecha_modificacion=now))
+        if nuevos:
+            Usuario.objects.bulk_create(nuevos, batch_size=batch)
+            usuarios = dict(Usuario.objects.filter(django_user_id__in=users.values()).values_list('django_user_id', 'id'))
+        mots = dict(Motorista.objects.filter(usuario_id__in=usuarios.values()).values_list('usuario_id', 'id'))
+        nuevos = [
+            Motorista(usuario_id=usu_id, licencia_numero=f'L-{uid}', licencia_clase='A', fecha_vencimiento_licencia=date(2026,1,1), emergencia_nombre='Contacto', emergencia_telefono='+56900000000', emergencia_parentesco='Otro', total_entregas_completadas=0, total_entregas_fallidas=0, activo=1, disponible_hoy=1, fecha_creacion=now, fecha_modificacion=now)
+            for uid, usu_id in usuarios.items() if usu_id not in mots
+        ]
+        if nuevos:
+            Motorista.objects.bulk_create(nuevos, batch_size=batch)
+            mots = dict(Motorista.objects.filter(usuario_id__in=usuarios.values()).values_list('usuario_id', 'id'))
+        return {uname: mots.get(usuarios.get(uid)) for uname, uid in users.items() if mots.get(usuarios.get(uid))}
+
+    def _bulk_motoristas_por_nombre(self, nombres: set, batch: int) -> dict:
+        """(nombre, apellido) -> motorista_id; reutiliza el User existente con ese nombre si lo hay."""
+        if not nombres:
+            return {}
+        res = {}
+        existentes = {}
+        for uid, uname, fn, ln in User.objects.filter(first_name__in={n for n, _ in nombres}).order_by('id').values_list('id', 'username', 'first_name', 'last_name'):
+            existentes.setdefault((fn, ln), (uid, uname))
+        if existentes:
+            usuarios = dict(Usuario.objects.filter(django_user_id__in=[uid for uid, _ in existentes.values()]).values_list('django_user_id', 'id'))
+            mots = dict(Motorista.objects.filter(usuario_id__in=usuarios.values()).values_list('usuario_id', 'id'))
+            for par in nombres:
+                mid = mots.get(usuarios.get((existentes.get(par) or (None, None))[0]))
+                if mid:
+                    res[par] = mid
+        por_username = {}
+        for n, a in nombres - set(res):
+            if (n, a) in existentes:
+                # User existente sin Usuario/Motorista: completar la cadena
+                uname = existentes[(n, a)][1]
+            else:
+                uname = f"mot_{n.lower()}_{a.lower().replace(' ','_')}" if a else f"mot_{n.lower()}"
+            por_username[uname] = (n, a)
+        creados = self._bulk_usuarios_motorista(por_username, batch)
+        for uname, mid in creados.items():
+            res[por_username[uname]] = mid
+        return res
+
+    def _bulk_upsert(self, model, clave, filas, campos, batch):
+        """filas: {clave: defaults}. Crea o actualiza según el mapa precargado clave -> pk."""
+        existentes = {}
+        claves = list(filas)
+        for i in range(0, len(claves), batch):
+            existentes.update(model.objects.filter(**{f'{clave}__in': claves[i:i + batch]}).values_list(clave, 'pk'))
+        crear, actualizar = [], []
+        for k, defaults in filas.items():
+            if k in existentes:
+                actualizar.append(model(pk=existentes[k], **{clave: k}, **defaults))
+            else:
+                crear.append(model(**{clave: k}, **defaults))
+        if crear:
+            model.objects.bulk_create(crear, batch_size=batch)
+        if actualizar:
+            model.objects.bulk_update(actualizar, campos, batch_size=batch)
+        return len(crear) + len(actualizar)
+
+    def _bulk_farmacias(self, base: pathlib.Path, batch: int) -> int:
+        def procesar(data):
+            now_dt = timezone.now()
+            filas = {}
+            for d in data:
+                lid = (d.get('local_id') or d.get('id') or '').strip()
+                if lid:
+                    filas[lid] = self._defaults_farmacia(d, lid, now_dt)
+            if not filas:
+                return 0
+            n = self._bulk_upsert(Localfarmacia, 'local_id', filas, list(next(iter(filas.values()))), batch)
+            self._farmacias_bulk.update(filas)
+            return n
+        return self._bulk_archivos(base, 'farmacias', procesar)
+
+    def _bulk_motos(self, base: pathlib.Path, batch: int) -> int:
+        def procesar(data):
+            now_dt = timezone.now()
+            filas = {}
+            for d in data:
+                pat = (str(d.get('patente') or '').upper()).strip()
+                if pat:
+                    filas[pat] = self._defaults_moto(d, pat, now_dt)
+            if not filas:
+                return 0
+            return self._bulk_upsert(Moto, 'patente', filas, list(next(iter(filas.values()))), batch)
+        count = self._bulk_archivos(base, 'motos', procesar)
+        return count + self._asegurar_motos_minimas()
+
+    def _bulk_motoristas(self, base: pathlib.Path, batch: int) -> int:
+        def procesar(data):
+            now_dt = timezone.now()
+            filas = {}
+            for d in data:
+                mid = d.get('id') or d.get('usuario_id') or None
+                nombre = d.get('nombre') or 'Motorista'
+                apellido = d.get('apellido') or str(mid or '')
+                filas[f"motorista{mid or ''}"] = (nombre, apellido, d)
+            if not filas:
+                return 0
+            mot_ids = self._bulk_usuarios_motorista({u: (n, a) for u, (n, a, _) in filas.items()}, batch)
+            user_ids = dict(User.objects.filter(username__in=list(mot_ids)).values_list('username', 'id'))
+            actualizar = []
+            for uname, mid in mot_ids.items():
+                defaults = self._defaults_motorista(filas[uname][2], user_ids[uname])
+                actualizar.append(Motorista(id=mid, fecha_modificacion=now_dt, **defaults))
+            campos = list(self._defaults_motorista({}, 0)) + ['fecha_modificacion']
+            Motorista.objects.bulk_update(actualizar, campos, batch_size=batch)
+            return len(actualizar)
+        return self._bulk_archivos(base, 'motoristas', procesar)
+
+    def _nombre_apellido(self, mot_nombre):
+        parts = mot_nombre.split()
+        return parts[0], (' '.join(parts[1:]) if len(parts) > 1 else 'Demo')
+
+    def _bulk_asignaciones_moto_motorista(self, base: pathlib.Path, batch: int) -> int:
+        def procesar(data):
+            filas = []
+            for d in data:
+                mot_nombre = str(d.get('motorista') or '').strip()
+                pat = (str(d.get('moto') or '').upper()).strip()
+                if mot_nombre and pat:
+                    filas.append((self._nombre_apellido(mot_nombre), pat, d))
+            if not filas:
+                return 0
+            # Asegurar motos
+            patentes = {pat for _, pat, _ in filas}
+            motos = dict(Moto.objects.filter(patente__in=patentes).values_list('patente', 'id'))
+            faltan = patentes - set(motos)
+            if faltan:
+                now_dt = timezone.now()
+                Moto.objects.bulk_create([
+                    Moto(
+                        patente=pat,
+                        marca='GENERICA', modelo='STD', tipo_combustible='BENCINA',
+                        fecha_inscripcion=date(2020,1,1), kilometraje_actual=0, activo=True,
+                        numero_motor=f'MOTOR-{pat}', numero_chasis=f'CHASIS-{pat}',
+                        propietario_nombre='LOGICO SPA', propietario_tipo_documento='RUT', propietario_documento=f'RUT-{pat}',
+                        anio=2020, cilindrada_cc=150, color='NEGRO', fecha_creacion=now_dt, fecha_modificacion=now_dt,
+                        usuario_modificacion=None,
+                    ) for pat in faltan
+                ], batch_size=batch)
+                motos = dict(Moto.objects.filter(patente__in=patentes).values_list('patente', 'id'))
+            mot_ids = self._bulk_motoristas_por_nombre({par for par, _, _ in filas}, batch)
+            existentes = {}
+            for aid, mid, moid, fa in AsignacionMotoMotorista.objects.filter(motorista_id__in=set(mot_ids.values())).values_list('id', 'motorista_id', 'moto_id', 'fecha_asignacion'):
+                existentes.setdefault((mid, moid, timezone.localtime(fa).date()), aid)
+            crear, actualizar = [], {}
+            for par, pat, d in filas:
+                mid, moid = mot_ids.get(par), motos.get(pat)
+                if not mid or not moid:
+                    continue
+                fecha_asig = self._parse_date(d.get('fecha_asignacion')) or date.today()
+                activa = 1 if d.get('activa') else 0
+                aid = existentes.get((mid, moid, fecha_asig))
+                if aid:
+                    actualizar[aid] = AsignacionMotoMotorista(id=aid, activa=activa)
+                else:
+                    crear.append(AsignacionMotoMotorista(motorista_id=mid, moto_id=moid, fecha_asignacion=timezone.make_aware(timezone.datetime.combine(fecha_asig, time(8,0))), activa=activa, kilometraje_inicio=0, observaciones=None))
+            AsignacionMotoMotorista.objects.bulk_create(crear, batch_size=batch)
+            AsignacionMotoMotorista.objects.bulk_update(list(actualizar.values()), ['activa'], batch_size=batch)
+            return len(crear) + len(actualizar)
+        return self._bulk_archivos(base, 'asignaciones_moto_motorista', procesar)
+
+    def _bulk_asignaciones_motorista_farmacia(self, base: pathlib.Path, batch: int) -> int:
+        def procesar(data):
+            filas = []
+            for d in data:
+                mot_nombre = str(d.get('motorista') or '').strip()
+                farm_str = str(d.get('farmacia') or '').strip()
+                if mot_nombre and farm_str:
+                    filas.append((self._nombre_apellido(mot_nombre), farm_str, d))
+            if not filas:
+                return 0
+            farmacias = list(Localfarmacia.objects.order_by('id').values_list('id', 'local_id', 'local_nombre'))
+            por_lid = {lid: fid for fid, lid, _ in farmacias}
+            farm_ids = {}
+            for _, farm_str, _ in filas:
+                if farm_str in farm_ids:
+                    continue
+                # Extraer local_id desde paréntesis: "Nombre (F001)"
+                local_id = farm_str.split('(')[-1].split(')')[0].strip() if ('(' in farm_str and ')' in farm_str) else None
+                nombre = farm_str.split('(')[0].strip()
+                fid = por_lid.get(local_id) if local_id else None
+                if not fid:
+                    fid = next((f for f, _, n in farmacias if nombre.lower() in (n or '').lower()), None)
+                if not fid:
+                    now_dt = timezone.now()
+                    nueva = Localfarmacia(local_id=local_id or f'F-{abs(hash(farm_str)) % 10000}', **self._defaults_farmacia({'local_nombre': nombre or 'Farmacia Demo'}, None, now_dt))
+                    nueva.save()
+                    fid = nueva.id
+                    farmacias.append((fid, nueva.local_id, nueva.local_nombre))
+                    por_lid[nueva.local_id] = fid
+                farm_ids[farm_str] = fid
+            mot_ids = self._bulk_motoristas_por_nombre({par for par, _, _ in filas}, batch)
+            ultimas = {}
+            for aid, mid, fid in AsignacionMotoristaFarmacia.objects.filter(motorista_id__in=set(mot_ids.values())).order_by('fecha_asignacion', 'id').values_list('id', 'motorista_id', 'farmacia_id'):
+                ultimas[(mid, fid)] = aid
+            crear, actualizar = [], {}
+            for par, farm_str, d in filas:
+                mid, fid = mot_ids.get(par), farm_ids.get(farm_str)
+                if not mid or not fid:
+                    continue
+                activa = 1 if d.get('activa') else 0
+                aid = ultimas.get((mid, fid))
+                if aid:
+                    actualizar[aid] = AsignacionMotoristaFarmacia(id=aid, activa=activa, fecha_desasignacion=None, observaciones=None)
+                else:
+                    fecha_asig_dt = self._parse_datetime(d.get('fecha_asignacion')) or timezone.now()
+                    crear.append(AsignacionMotoristaFarmacia(motorista_id=mid, farmacia_id=fid, fecha_asignacion=fecha_asig_dt, activa=activa, observaciones=None))
+            AsignacionMotoristaFarmacia.objects.bulk_create(crear, batch_size=batch)
+            AsignacionMotoristaFarmacia.objects.bulk_update(list(actualizar.values()), ['activa', 'fecha_desasignacion', 'observaciones'], batch_size=batch)
+            return len(crear) + len(actualizar)
+        return self._bulk_archivos(base, 'asignaciones_motorista_farmacia', procesar)
+
+    def _bulk_despachos(self, base: pathlib.Path, batch: int) -> int:
+        usuario_reg = self._usuario_registro()
+        mot_validos = set(Motorista.objects.values_list('id', flat=True))
+        mot_default = min(mot_validos) if mot_validos else None
+
+        def procesar(data):
+            filas = {}
+            nombres = set()
+            for d in data:
+                codigo = (d.get('codigo_despacho') or '').strip()
+                if not codigo:
+                    continue
+                filas[codigo] = d
+                try:
+                    mid = int(d.get('motorista_id') or 0)
+                except (TypeError, ValueError):
+                    mid = 0
+                if mid not in mot_validos:
+                    mn = str((d.get('motorista') or {}).get('nombre') or '').strip()
+                    if mn:
+                        nombres.add((mn, str((d.get('motorista') or {}).get('apellido') or '').strip()))
+            por_nombre = self._bulk_motoristas_por_nombre(nombres, batch)
+            mot_validos.update(por_nombre.values())
+            now_dt = timezone.now()
+            defaults_por_codigo = {}
+            for codigo, d in filas.items():
+                try:
+                    mid = int(d.get('motorista_id') or 0)
+                except (TypeError, ValueError):
+                    mid = 0
+                if mid not in mot_validos:
+                    m = d.get('motorista') or {}
+                    mid = por_nombre.get((str(m.get('nombre') or '').strip(), str(m.get('apellido') or '').strip())) or mot_default
+                if not mid:
+                    continue
+                defaults = self._defaults_despacho(d, now_dt)
+                defaults.update(motorista_id=mid, usuario_registro=usuario_reg, usuario_modificacion=usuario_reg)
+                defaults_por_codigo[codigo] = defaults
+            if not defaults_por_codigo:
+                return 0
+            campos = [c for c in self._defaults_despacho({}, now_dt)] + ['motorista', 'usuario_registro', 'usuario_modificacion']
+            n = self._bulk_upsert(Despacho, 'codigo_despacho', defaults_por_codigo, campos, batch)
+            self._codigos_bulk.update(defaults_por_codigo)
+            return n
+        return self._bulk_archivos(base, 'despachos', procesar)
+
+    def _bulk_movimientos(self, base: pathlib.Path, batch: int) -> int:
+        from ...models import MovimientoDespacho
+        usuario = self._usuario_registro()
+
+        def procesar(data):
+            ids = set()
+            for d in data:
+                try:
+                    ids.add(int(d.get('despacho_id')))
+                except (TypeError, ValueError):
+                    continue
+            existentes = set()
+            lista = list(ids)
+            for i in range(0, len(lista), batch):
+                existentes.update(Despacho.objects.filter(id__in=lista[i:i + batch]).values_list('id', flat=True))
+            nuevos = []
+            for d in data:
+                try:
+                    did = int(d.get('despacho_id'))
+                except (TypeError, ValueError):
+                    continue
+                if did not in existentes:
+                    continue
+                nuevos.append(MovimientoDespacho(despacho_id=did, estado_nuevo=(d.get('estado_nuevo') or '').upper()[:9] or 'PENDIENTE', fecha_movimiento=self._parse_datetime(d.get('fecha_movimiento')) or timezone.now(), usuario=usuario))
+            MovimientoDespacho.objects.bulk_create(nuevos, batch_size=batch)
+            return len(nuevos)
+        return self._bulk_archivos(base, 'movimientos', procesar)
+
     def _parse_date(self, s):
         try:
             if not s:
@@ -1,33 +1,47 @@
+import time
+
 from django.core.management.base import BaseCommand
 from appnproylogico.models import Despacho
-from appnproylogico.services.ia_service import AnalizadorDespachoIA
+from appnproylogico.services.ia_service import AnalizadorDespachoIA, ClienteIALocal
 
 class Command(BaseCommand):
     help = 'Prueba el servicio de IA con despachos que tienen incidencia'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=3, help='Cantidad de despachos con incidencia')
+        parser.add_argument('--workers', type=int, default=None, help='Llamadas simultáneas (default settings.IA_MAX_WORKERS)')
+        parser.add_argument('--local', action='store_true', help='Usar el cliente local sin red (benchmark)')
+        parser.add_argument('--latencia', type=float, default=0.0, help='Latencia simulada del cliente local, en segundos')
+
     def handle(self, *args, **options):
         # Buscar despachos con incidencia
-        despachos = Despacho.objects.filter(hubo_incidencia=True)[:3]
-        
-        if not despachos.exists():
+        despachos = list(Despacho.objects.filter(hubo_incidencia=True)[:options['limite']])
+
+        if not despachos:
             self.stdout.write(self.style.WARNING('No hay despachos con incidencia para analizar'))
             return
-        
-        analizador = AnalizadorDespachoIA()
-        
+
+        cliente = ClienteIALocal(latencia=options['latencia']) if options['local'] else None
+        analizador = AnalizadorDespachoIA(client=cliente, max_workers=options['workers'])
+
+        inicio = time.perf_counter()
+        resultados = analizador.analizar_lote(despachos)
+        duracion = time.perf_counter() - inicio
+
         for despacho in despachos:
+            resultado = resultados.get(despacho.id) or {}
             self.stdout.write(f'\n{"="*60}')
             self.stdout.write(f'Analizando: {despacho.codigo_despacho}')
             self.stdout.write(f'Estado: {despacho.estado}')
             self.stdout.write(f'Incidencia: {despacho.tipo_incidencia}')
-            
-            resultado = analizador.analizar_incidencia(despacho)
-            
+
             if resultado.get('error'):
                 self.stdout.write(self.style.ERROR(f"Error: {resultado['resumen']}"))
             else:
-                self.stdout.write(self.style.SUCCESS(f"\nResumen: {resultado['resumen']}"))
-                self.stdout.write(self.style.SUCCESS(f"Sugerencia: {resultado['sugerencia']}"))
-        
+                self.stdout.write(self.style.SUCCESS(f"\nResumen: {resultado.get('resumen')}"))
+                self.stdout.write(self.style.SUCCESS(f"Sugerencia: {resultado.get('sugerencia')}"))
+
         self.stdout.write(f'\n{"="*60}\n')
-        self.stdout.write(self.style.SUCCESS('Análisis completado'))
\ No newline at end of file
+        if cliente is not None:
+            self.stdout.write(f'Llamadas al cliente local: {cliente.llamadas}')
+        self.stdout.write(self.style.SUCCESS(f'Análisis completado: {len(despachos)} despachos en {duracion:.2f}s'))
@@ -0,0 +1,50 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ...services.reportes_service import tomar_jobs
+# El pool importa el initializer y la tarea en hijos sin Django configurado
+from ...services.reportes_worker import ejecutar_job, inicializar_worker
+
+
+class Command(BaseCommand):
+    help = 'Procesa la cola de reportes PDF/XLSX (tabla reporte_job) con un pool de procesos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Procesos en paralelo')
+        parser.add_argument('--intervalo', type=float, default=2.0, help='Segundos entre sondeos de la cola')
+        parser.add_argument('--once', action='store_true', help='Vaciar la cola y terminar')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        intervalo = max(0.1, options['intervalo'])
+        once = options['once']
+        # No heredar la conexión del proceso padre en los hijos
+        connections.close_all()
+        ctx = multiprocessing.get_context('spawn')
+        self.stdout.write(self.style.NOTICE(f'Procesando reportes con {workers} worker(s)'))
+        en_curso = set()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=inicializar_worker) as pool:
+            try:
+                while True:
+                    for job_id in tomar_jobs(workers - len(en_curso)):
+                        en_curso.add(pool.submit(ejecutar_job, job_id))
+                    if not en_curso:
+                        if once:
+                            break
+                        time.sleep(intervalo)
+                        continue
+                    hechos, en_curso = wait(en_curso, timeout=intervalo, return_when=FIRST_COMPLETED)
+                    for fut in hechos:
+                        try:
+                            job_id, estado = fut.result()
+                        except Exception as e:
+                            self.stdout.write(self.style.WARNING(f'Worker falló: {e}'))
+                            continue
+                        estilo = self.style.SUCCESS if estado == 'LISTO' else self.style.WARNING
+                        self.stdout.write(estilo(f'Job {job_id}: {estado}'))
+            except KeyboardInterrupt:
+                self.stdout.write(self.style.NOTICE('Interrumpido; esperando jobs en curso'))
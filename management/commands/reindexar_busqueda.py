@@ -0,0 +1,19 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from ...services.busqueda_service import BUSQUEDA_LOTE, indexar_despachos
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de consulta rápida (busqueda_despacho / busqueda_token)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=BUSQUEDA_LOTE, help='Despachos por transacción')
+        parser.add_argument('--ids', type=str, default='', help='Solo estos ids de despacho, separados por coma')
+
+    def handle(self, *args, **options):
+        ids = [int(i) for i in options['ids'].split(',') if i.strip().isdigit()] or None
+        inicio = perf_counter()
+        n = indexar_despachos(ids, lote=max(1, options['lote']))
+        self.stdout.write(self.style.SUCCESS(f'Indexados {n} despachos en {perf_counter() - inicio:.2f}s'))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appnproylogico', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReporteJob',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(max_length=30)),
+                ('formato', models.CharField(max_length=10)),
+                ('parametros', models.JSONField(default=dict)),
+                ('hash_parametros', models.CharField(db_comment='sha256 de tipo/formato/parámetros normalizados', max_length=64)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('PROCESANDO', 'Procesando'), ('LISTO', 'Listo'), ('ERROR', 'Error')], default='PENDIENTE', max_length=10)),
+                ('archivo', models.CharField(blank=True, db_comment='Ruta relativa a MEDIA_ROOT', max_length=255, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='appnproylogico.usuario')),
+            ],
+            options={
+                'db_table': 'reporte_job',
+                'db_table_comment': 'Cola de generación de reportes PDF/XLSX en segundo plano',
+                'managed': True,
+                'indexes': [
+                    models.Index(fields=['estado', 'fecha_creacion'], name='idx_reporte_job_estado'),
+                    models.Index(fields=['hash_parametros', 'fecha_creacion'], name='idx_reporte_job_hash'),
+                ],
+            },
+        ),
+    ]
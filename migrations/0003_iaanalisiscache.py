@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appnproylogico', '0002_reportejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IaAnalisisCache',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('hash_entrada', models.CharField(db_comment='sha256 de modelo + entradas estables del prompt', max_length=64, unique=True)),
+                ('despacho_id', models.IntegerField(blank=True, db_comment='Despacho que originó el análisis (referencia)', null=True)),
+                ('modelo', models.CharField(max_length=50)),
+                ('resultado', models.JSONField()),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'ia_analisis_cache',
+                'db_table_comment': 'Resultados de análisis IA de incidencias, para no repetir llamadas',
+                'managed': True,
+            },
+        ),
+    ]
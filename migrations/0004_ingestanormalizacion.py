@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appnproylogico', '0003_iaanalisiscache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestaNormalizacion',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('fuente', models.CharField(max_length=50)),
+                ('archivo_nombre', models.CharField(max_length=255)),
+                ('estado', models.CharField(choices=[('PROCESANDO', 'Procesando'), ('COMPLETADA', 'Completada'), ('ERROR', 'Error')], default='PROCESANDO', max_length=10)),
+                ('filas_leidas', models.PositiveIntegerField(default=0)),
+                ('filas_insertadas', models.PositiveIntegerField(default=0)),
+                ('filas_error', models.PositiveIntegerField(default=0)),
+                ('lotes', models.PositiveIntegerField(default=0)),
+                ('vueltas_normalizacion', models.PositiveIntegerField(db_comment='Llamadas a sp_normalizar_despachos', default=0)),
+                ('ultimo_error', models.TextField(blank=True, null=True)),
+                ('fecha_inicio', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='appnproylogico.usuario')),
+            ],
+            options={
+                'db_table': 'ingesta_normalizacion',
+                'db_table_comment': 'Progreso por lote de cada archivo ingestado a normalizacion_despacho',
+                'managed': True,
+            },
+        ),
+    ]
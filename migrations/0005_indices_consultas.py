@@ -0,0 +1,54 @@
+# Índices compuestos para las consultas calientes de despacho, movimiento y auditoría.
+#
+# Los modelos de 0001_initial están declarados managed=False en el estado de
+# migraciones, así que AddIndex no generaría SQL: se crean a mano, solo si la
+# tabla existe (en la base de pruebas las crea pruebas.PruebasRunner) y el
+# índice aún no. MySQL/MariaDB no tienen CREATE INDEX IF NOT EXISTS.
+
+from django.db import migrations
+
+
+INDICES = [
+    # Resúmenes y cierre por día/mes/año y farmacia (rango sobre fecha_registro)
+    ('despacho', 'idx_despacho_fecha_farmacia', 'fecha_registro, farmacia_origen_local_id'),
+    # Despachos activos y filtros por estado ordenados por fecha
+    ('despacho', 'idx_despacho_estado_fecha', 'estado, fecha_registro'),
+    # Recetas pendientes de devolución (MariaDB no tiene índices parciales)
+    ('despacho', 'idx_despacho_receta_pendiente', 'tiene_receta_retenida, requiere_devolucion_receta, receta_devuelta_farmacia, fecha_registro'),
+    # Historial de un despacho y reporte de movimientos por rango de fechas
+    ('movimiento_despacho', 'idx_movimiento_despacho_fecha', 'despacho_id, fecha_movimiento'),
+    ('movimiento_despacho', 'idx_movimiento_fecha', 'fecha_movimiento'),
+    # Feed de avisos y correcciones pendientes
+    ('auditoria_general', 'idx_auditoria_tipo_fecha', 'tipo_operacion, fecha_evento'),
+    ('auditoria_general', 'idx_auditoria_tabla_registro', 'nombre_tabla, id_registro_afectado, tipo_operacion, fecha_evento'),
+]
+
+
+def _indices_existentes(schema_editor, tabla):
+    with schema_editor.connection.cursor() as cur:
+        return schema_editor.connection.introspection.get_constraints(cur, tabla)
+
+
+def crear_indices(apps, schema_editor):
+    tablas = set(schema_editor.connection.introspection.table_names())
+    for tabla, nombre, columnas in INDICES:
+        if tabla in tablas and nombre not in _indices_existentes(schema_editor, tabla):
+            schema_editor.execute(f'CREATE INDEX {nombre} ON {tabla} ({columnas})')
+
+
+def borrar_indices(apps, schema_editor):
+    tablas = set(schema_editor.connection.introspection.table_names())
+    for tabla, nombre, _ in INDICES:
+        if tabla in tablas and nombre in _indices_existentes(schema_editor, tabla):
+            schema_editor.execute(f'DROP INDEX {nombre} ON {tabla}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appnproylogico', '0004_ingestanormalizacion'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, borrar_indices),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def poblar_lecturas(apps, schema_editor):
+    """Crea las lecturas a partir de los registros AVISO_MOV_LEIDO existentes.
+
+    El AuditoriaGeneral histórico de 0001_initial no tiene el campo usuario, así
+    que las lecturas rellenadas quedan con usuario NULL.
+    """
+    AuditoriaGeneral = apps.get_model('appnproylogico', 'AuditoriaGeneral')
+    AvisoLectura = apps.get_model('appnproylogico', 'AvisoLectura')
+    avisos = set(AuditoriaGeneral.objects.filter(tipo_operacion='AVISO_MOV').values_list('id', flat=True))
+    lecturas = {}
+    leidos = (
+        AuditoriaGeneral.objects.filter(tipo_operacion='AVISO_MOV_LEIDO')
+        .order_by('fecha_evento')
+        .values_list('id_registro_afectado', 'fecha_evento')
+    )
+    for registro, fecha in leidos.iterator(chunk_size=2000):
+        try:
+            aviso_id = int(registro)
+        except (TypeError, ValueError):
+            continue
+        if aviso_id in avisos and aviso_id not in lecturas:
+            lecturas[aviso_id] = AvisoLectura(aviso_id=aviso_id, leido_en=fecha)
+    AvisoLectura.objects.bulk_create(lecturas.values(), batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appnproylogico', '0005_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvisoLectura',
+            fields=[
+                ('aviso', models.OneToOneField(db_comment='Auditoría AVISO_MOV leída', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='lectura', serialize=False, to='appnproylogico.auditoriageneral')),
+                ('leido_en', models.DateTimeField()),
+                ('usuario', models.ForeignKey(blank=True, db_comment='Operadora que marcó como leído', null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='appnproylogico.usuario')),
+            ],
+            options={
+                'db_table': 'aviso_lectura',
+                'db_table_comment': 'Estado de lectura de avisos de motoristas (auditoria_general es inmutable)',
+                'managed': True,
+            },
+        ),
+        migrations.RunPython(poblar_lecturas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appnproylogico', '0006_avisolectura'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CierreDia',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('fecha', models.DateField(unique=True)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('entregados', models.PositiveIntegerField(default=0)),
+                ('fallidos', models.PositiveIntegerField(default=0)),
+                ('en_camino', models.PositiveIntegerField(default=0)),
+                ('pendientes', models.PositiveIntegerField(default=0)),
+                ('anulados', models.PositiveIntegerField(default=0)),
+                ('con_receta', models.PositiveIntegerField(default=0)),
+                ('con_incidencias', models.PositiveIntegerField(default=0)),
+                ('por_farmacia', models.JSONField(db_comment='{local_id: {nombre, total, entregados, fallidos}}', default=dict)),
+                ('ultimo_despacho_id', models.BigIntegerField(db_comment='Checkpoint: último despacho escrito en el archivo de cierre', default=0)),
+                ('filas_archivo', models.PositiveIntegerField(default=0)),
+                ('archivo', models.CharField(blank=True, max_length=255, null=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('usuario', models.ForeignKey(blank=True, db_comment='Operadora que ejecutó el último cierre', null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='appnproylogico.usuario')),
+            ],
+            options={
+                'db_table': 'cierre_dia',
+                'db_table_comment': 'Resumen compacto por día del cierre de operadora',
+                'managed': True,
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 15:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appnproylogico', '0007_cierredia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BusquedaDespacho',
+            fields=[
+                ('despacho', models.OneToOneField(db_comment='Despacho indexado', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='busqueda', serialize=False, to='appnproylogico.despacho')),
+                ('codigo_despacho', models.CharField(blank=True, max_length=20, null=True)),
+                ('local_id', models.CharField(blank=True, db_comment='farmacia_origen_local_id del despacho', max_length=20, null=True)),
+                ('local_nombre', models.CharField(blank=True, max_length=150, null=True)),
+                ('motorista_id', models.IntegerField(blank=True, null=True)),
+                ('motorista_nombre', models.CharField(blank=True, max_length=161, null=True)),
+                ('cliente_nombre', models.CharField(blank=True, max_length=100, null=True)),
+                ('estado', models.CharField(blank=True, max_length=20, null=True)),
+                ('tipo_despacho', models.CharField(blank=True, max_length=27, null=True)),
+                ('prioridad', models.CharField(blank=True, max_length=10, null=True)),
+                ('fecha_registro', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'busqueda_despacho',
+                'db_table_comment': 'Fila desnormalizada de consulta rápida (farmacia, motorista, cliente)',
+                'managed': True,
+                'indexes': [
+                    models.Index(fields=['-fecha_registro', '-despacho'], name='idx_busqueda_fecha'),
+                    models.Index(fields=['local_id'], name='idx_busqueda_local'),
+                    models.Index(fields=['motorista_id'], name='idx_busqueda_motorista'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='BusquedaToken',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('campo', models.CharField(choices=[('L', 'Farmacia'), ('M', 'Motorista'), ('C', 'Cliente')], max_length=1)),
+                ('token', models.CharField(db_comment='Palabra en minúsculas y sin tildes', max_length=40)),
+                ('despacho', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='appnproylogico.busquedadespacho')),
+            ],
+            options={
+                'db_table': 'busqueda_token',
+                'db_table_comment': 'Índice invertido de consulta rápida: búsqueda por prefijo de palabra',
+                'managed': True,
+                'indexes': [models.Index(fields=['campo', 'token', 'despacho'], name='idx_token_campo')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appnproylogico', '0008_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ruta',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('farmacia_origen_local_id', models.CharField(db_comment='local_id de la farmacia de salida', max_length=20)),
+                ('paradas', models.PositiveSmallIntegerField(default=0)),
+                ('distancia_km', models.DecimalField(blank=True, db_comment='Recorrido estimado desde la farmacia (haversine)', decimal_places=3, max_digits=8, null=True)),
+                ('fecha_creacion', models.DateTimeField()),
+                ('motorista', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='rutas', to='appnproylogico.motorista')),
+            ],
+            options={
+                'db_table': 'ruta',
+                'db_table_comment': 'Lote de despachos ASIGNADO/PREPARADO de un motorista que salen de la misma farmacia',
+                'managed': True,
+                'indexes': [models.Index(fields=['motorista', 'farmacia_origen_local_id'], name='idx_ruta_motorista')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RutaParada',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('orden', models.PositiveSmallIntegerField(db_comment='1 = primera entrega')),
+                ('distancia_km', models.DecimalField(blank=True, db_comment='Desde la parada anterior (o la farmacia)', decimal_places=3, max_digits=8, null=True)),
+                ('despacho', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='parada_ruta', to='appnproylogico.despacho')),
+                ('ruta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='paradas_ruta', to='appnproylogico.ruta')),
+            ],
+            options={
+                'db_table': 'ruta_parada',
+                'db_table_comment': 'Secuencia de entregas de una ruta (vecino más cercano + 2-opt)',
+                'managed': True,
+                'ordering': ['ruta', 'orden'],
+            },
+        ),
+    ]
@@ -368,3 +368,180 @@ class NormalizacionDespacho(models.Model):
     class Meta:
         managed = True
         db_table = 'normalizacion_despacho'
+
+
+class ReporteJob(models.Model):
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('PROCESANDO', 'Procesando'),
+        ('LISTO', 'Listo'),
+        ('ERROR', 'Error'),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    tipo = models.CharField(max_length=30)
+    formato = models.CharField(max_length=10)
+    parametros = models.JSONField(default=dict)
+    hash_parametros = models.CharField(max_length=64, db_comment='sha256 de tipo/formato/parámetros normalizados')
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='PENDIENTE')
+    archivo = models.CharField(max_length=255, blank=True, null=True, db_comment='Ruta relativa a MEDIA_ROOT')
+    error = models.TextField(blank=True, null=True)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    usuario = models.ForeignKey(Usuario, models.DO_NOTHING, blank=True, null=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(blank=True, null=True)
+    fecha_fin = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        managed = True
+        db_table = 'reporte_job'
+        db_table_comment = 'Cola de generación de reportes PDF/XLSX en segundo plano'
+        indexes = [
+            models.Index(fields=['estado', 'fecha_creacion'], name='idx_reporte_job_estado'),
+            models.Index(fields=['hash_parametros', 'fecha_creacion'], name='idx_reporte_job_hash'),
+        ]
+
+
+class IaAnalisisCache(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    hash_entrada = models.CharField(unique=True, max_length=64, db_comment='sha256 de modelo + entradas estables del prompt')
+    despacho_id = models.IntegerField(blank=True, null=True, db_comment='Despacho que originó el análisis (referencia)')
+    modelo = models.CharField(max_length=50)
+    resultado = models.JSONField()
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        managed = True
+        db_table = 'ia_analisis_cache'
+        db_table_comment = 'Resultados de análisis IA de incidencias, para no repetir llamadas'
+
+
+class IngestaNormalizacion(models.Model):
+    ESTADOS = [
+        ('PROCESANDO', 'Procesando'),
+        ('COMPLETADA', 'Completada'),
+        ('ERROR', 'Error'),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    fuente = models.CharField(max_length=50)
+    archivo_nombre = models.CharField(max_length=255)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='PROCESANDO')
+    filas_leidas = models.PositiveIntegerField(default=0)
+    filas_insertadas = models.PositiveIntegerField(default=0)
+    filas_error = models.PositiveIntegerField(default=0)
+    lotes = models.PositiveIntegerField(default=0)
+    vueltas_normalizacion = models.PositiveIntegerField(default=0, db_comment='Llamadas a sp_normalizar_despachos')
+    ultimo_error = models.TextField(blank=True, null=True)
+    usuario = models.ForeignKey(Usuario, models.DO_NOTHING, blank=True, null=True)
+    fecha_inicio = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    fecha_fin = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        managed = True
+        db_table = 'ingesta_normalizacion'
+        db_table_comment = 'Progreso por lote de cada archivo ingestado a normalizacion_despacho'
+
+
+class AvisoLectura(models.Model):
+    aviso = models.OneToOneField(AuditoriaGeneral, models.DO_NOTHING, primary_key=True, related_name='lectura', db_comment='Auditoría AVISO_MOV leída')
+    usuario = models.ForeignKey(Usuario, models.DO_NOTHING, blank=True, null=True, db_comment='Operadora que marcó como leído')
+    leido_en = models.DateTimeField()
+
+    class Meta:
+        managed = True
+        db_table = 'aviso_lectura'
+        db_table_comment = 'Estado de lectura de avisos de motoristas (auditoria_general es inmutable)'
+
+
+class CierreDia(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    fecha = models.DateField(unique=True)
+    total = models.PositiveIntegerField(default=0)
+    entregados = models.PositiveIntegerField(default=0)
+    fallidos = models.PositiveIntegerField(default=0)
+    en_camino = models.PositiveIntegerField(default=0)
+    pendientes = models.PositiveIntegerField(default=0)
+    anulados = models.PositiveIntegerField(default=0)
+    con_receta = models.PositiveIntegerField(default=0)
+    con_incidencias = models.PositiveIntegerField(default=0)
+    por_farmacia = models.JSONField(default=dict, db_comment='{local_id: {nombre, total, entregados, fallidos}}')
+    ultimo_despacho_id = models.BigIntegerField(default=0, db_comment='Checkpoint: último despacho escrito en el archivo de cierre')
+    filas_archivo = models.PositiveIntegerField(default=0)
+    archivo = models.CharField(max_length=255, blank=True, null=True)
+    usuario = models.ForeignKey(Usuario, models.DO_NOTHING, blank=True, null=True, db_comment='Operadora que ejecutó el último cierre')
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'cierre_dia'
+        db_table_comment = 'Resumen compacto por día del cierre de operadora'
+
+
+class BusquedaDespacho(models.Model):
+    despacho = models.OneToOneField(Despacho, models.CASCADE, primary_key=True, related_name='busqueda', db_comment='Despacho indexado')
+    codigo_despacho = models.CharField(max_length=20, blank=True, null=True)
+    local_id = models.CharField(max_length=20, blank=True, null=True, db_comment='farmacia_origen_local_id del despacho')
+    local_nombre = models.CharField(max_length=150, blank=True, null=True)
+    motorista_id = models.IntegerField(blank=True, null=True)
+    motorista_nombre = models.CharField(max_length=161, blank=True, null=True)
+    cliente_nombre = models.CharField(max_length=100, blank=True, null=True)
+    estado = models.CharField(max_length=20, blank=True, null=True)
+    tipo_despacho = models.CharField(max_length=27, blank=True, null=True)
+    prioridad = models.CharField(max_length=10, blank=True, null=True)
+    fecha_registro = models.DateTimeField()
+
+    class Meta:
+        managed = True
+        db_table = 'busqueda_despacho'
+        db_table_comment = 'Fila desnormalizada de consulta rápida (farmacia, motorista, cliente)'
+        indexes = [
+            models.Index(fields=['-fecha_registro', '-despacho'], name='idx_busqueda_fecha'),
+            models.Index(fields=['local_id'], name='idx_busqueda_local'),
+            models.Index(fields=['motorista_id'], name='idx_busqueda_motorista'),
+        ]
+
+
+class BusquedaToken(models.Model):
+    CAMPOS = (('L', 'Farmacia'), ('M', 'Motorista'), ('C', 'Cliente'))
+
+    id = models.BigAutoField(primary_key=True)
+    despacho = models.ForeignKey(BusquedaDespacho, models.CASCADE, related_name='tokens')
+    campo = models.CharField(max_length=1, choices=CAMPOS)
+    token = models.CharField(max_length=40, db_comment='Palabra en minúsculas y sin tildes')
+
+    class Meta:
+        managed = True
+        db_table = 'busqueda_token'
+        db_table_comment = 'Índice invertido de consulta rápida: búsqueda por prefijo de palabra'
+        indexes = [
+            models.Index(fields=['campo', 'token', 'despacho'], name='idx_token_campo'),
+        ]
+
+
+class Ruta(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    motorista = models.ForeignKey(Motorista, models.DO_NOTHING, related_name='rutas')
+    farmacia_origen_local_id = models.CharField(max_length=20, db_comment='local_id de la farmacia de salida')
+    paradas = models.PositiveSmallIntegerField(default=0)
+    distancia_km = models.DecimalField(max_digits=8, decimal_places=3, blank=True, null=True, db_comment='Recorrido estimado desde la farmacia (haversine)')
+    fecha_creacion = models.DateTimeField()
+
+    class Meta:
+        managed = True
+        db_table = 'ruta'
+        db_table_comment = 'Lote de despachos ASIGNADO/PREPARADO de un motorista que salen de la misma farmacia'
+        indexes = [models.Index(fields=['motorista', 'farmacia_origen_local_id'], name='idx_ruta_motorista')]
+
+
+class RutaParada(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    ruta = models.ForeignKey(Ruta, models.CASCADE, related_name='paradas_ruta')
+    despacho = models.OneToOneField(Despacho, models.CASCADE, related_name='parada_ruta')
+    orden = models.PositiveSmallIntegerField(db_comment='1 = primera entrega')
+    distancia_km = models.DecimalField(max_digits=8, decimal_places=3, blank=True, null=True, db_comment='Desde la parada anterior (o la farmacia)')
+
+    class Meta:
+        managed = True
+        db_table = 'ruta_parada'
+        db_table_comment = 'Secuencia de entregas de una ruta (vecino más cercano + 2-opt)'
+        ordering = ['ruta', 'orden']
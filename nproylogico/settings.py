@@ -103,6 +103,9 @@ DATABASES = {
     }
 }
 
+# La base de pruebas necesita las tablas que 0001_initial deja con managed=False
+TEST_RUNNER = 'appnproylogico.pruebas.PruebasRunner'
+
 
 SECURE_SSL_REDIRECT = os.getenv('SECURE_SSL_REDIRECT', 'false').lower() == 'true'
 SECURE_HSTS_SECONDS = int(os.getenv('SECURE_HSTS_SECONDS', '0'))
@@ -190,6 +193,23 @@ UPLOAD_ALLOWED_CONTENT_TYPES = (
 )
 PDF_PASSWORD = os.getenv('PDF_PASSWORD', 'l0gic0*')
 
+# TTL (s) de la caché de roles por usuario y de tokens OAuth verificados
+PERMISOS_CACHE_TTL = int(os.getenv('PERMISOS_CACHE_TTL', '60'))
+
+# Caché común a todos los workers (roles, tokens OAuth, versión de despachos activos). Sin
+# CACHE_REDIS_URL cada proceso tiene su LocMemCache y las cachés que dependen de invalidación
+# por signals se omiten o usan TTL corto (roles.cache_compartida; CACHE_COMPARTIDA la fuerza)
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', '')
+if CACHE_REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Reportes PDF/XLSX en segundo plano (manage.py procesar_reportes)
+REPORTES_ASYNC = os.getenv('REPORTES_ASYNC', 'false').lower() == 'true'
+REPORTES_JOB_TTL_SECONDS = int(os.getenv('REPORTES_JOB_TTL_SECONDS', '600'))
+REPORTES_JOB_TIMEOUT_SECONDS = int(os.getenv('REPORTES_JOB_TIMEOUT_SECONDS', '900'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -280,4 +300,37 @@ DEBUG_TOOLBAR_CONFIG = {
 # Cargar variables de entorno
 load_dotenv()
 # API Key de OpenAI
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
\ No newline at end of file
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# 'openai' o 'local' (cliente sin red para pruebas/benchmarks)
+IA_CLIENTE = os.getenv('IA_CLIENTE', 'openai')
+IA_MAX_WORKERS = int(os.getenv('IA_MAX_WORKERS', '4'))
+IA_TIMEOUT_SECONDS = float(os.getenv('IA_TIMEOUT_SECONDS', '20'))
+IA_REINTENTOS = int(os.getenv('IA_REINTENTOS', '2'))
+
+# Eventos en tiempo real (SSE): 'memoria' (un proceso) o 'redis' (pub/sub entre procesos)
+EVENTOS_BACKEND = os.getenv('EVENTOS_BACKEND', 'memoria')
+EVENTOS_REDIS_URL = os.getenv('EVENTOS_REDIS_URL', 'redis://localhost:6379/0')
+EVENTOS_KEEPALIVE_SECONDS = int(os.getenv('EVENTOS_KEEPALIVE_SECONDS', '15'))
+EVENTOS_SSE_MAX_SECONDS = int(os.getenv('EVENTOS_SSE_MAX_SECONDS', '300'))
+# Bajo WSGI/runserver cada panel abierto ocupa un hilo del servidor mientras dura la conexión:
+# se corta antes y el navegador reconecta (retry: 3000)
+EVENTOS_SSE_SYNC_MAX_SECONDS = int(os.getenv('EVENTOS_SSE_SYNC_MAX_SECONDS', '30'))
+
+# Segundos que se reutiliza el snapshot de conteos del inicio (home)
+DASHBOARD_METRICAS_TTL = int(os.getenv('DASHBOARD_METRICAS_TTL', '60'))
+
+# Segundos máximos que un proceso reutiliza su índice espacial en memoria (services/geo_service.py)
+GEO_INDICE_TTL = int(os.getenv('GEO_INDICE_TTL', '300'))
+
+# Asignación automática (services/asignacion_service.py): despachos en curso por motorista y distancia máxima farmacia-origen
+ASIGNACION_CAPACIDAD = int(os.getenv('ASIGNACION_CAPACIDAD', '4'))
+ASIGNACION_RADIO_MAX_KM = float(os.getenv('ASIGNACION_RADIO_MAX_KM', '15'))
+# Segundos que la vista previa de auto-asignación sigue siendo aplicable
+ASIGNACION_PROPUESTA_MAX_SEGUNDOS = int(os.getenv('ASIGNACION_PROPUESTA_MAX_SEGUNDOS', '900'))
+# id de Usuario que firma las asignaciones de `manage.py auto_asignar` cuando no se pasa --usuario (cron)
+ASIGNACION_USUARIO_SISTEMA = os.getenv('ASIGNACION_USUARIO_SISTEMA', '')
+
+# Listados paginados (services/paginacion_service.py): sobre este total el conteo se estima con las estadísticas de la tabla
+PAGINACION_CONTEO_EXACTO_MAX = int(os.getenv('PAGINACION_CONTEO_EXACTO_MAX', '10000'))
+# Segundos que se reutiliza el total de un listado (mismos filtros) al navegar con tokens de página
+PAGINACION_CONTEO_TTL = int(os.getenv('PAGINACION_CONTEO_TTL', '300'))
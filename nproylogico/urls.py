@@ -59,7 +59,13 @@ urlpatterns = [
     path('farmacias/<int:pk>/actualizar/', views.actualizar_farmacia, name='actualizar_farmacia'),
     path('farmacias/<int:pk>/remover/', views.remover_farmacia, name='remover_farmacia'),
     path('movimientos/ingestar-normalizacion/', views.ingestar_normalizacion, name='ingestar_normalizacion'),
+    path('api/ingestas-normalizacion/', views.api_ingestas_normalizacion, name='api_ingestas_normalizacion'),
+    path('api/cierres-dia/', views.api_cierres_dia, name='api_cierres_dia'),
+    path('api/geo/farmacias-cercanas/', views.api_farmacias_cercanas, name='api_farmacias_cercanas'),
+    path('api/geo/despachos-en-radio/', views.api_despachos_en_radio, name='api_despachos_en_radio'),
     path('movimientos/registrar/', views.registrar_movimiento, name='registrar_movimiento'),
+    path('movimientos/registrar-lote/', views.registrar_movimientos_lote, name='registrar_movimientos_lote'),
+    path('despachos/auto-asignar/', views.auto_asignar_despachos, name='auto_asignar_despachos'),
     path('movimientos/anular/', views.movimiento_anular, name='movimiento_anular'),
     path('movimientos/modificar/', views.movimiento_modificar, name='movimiento_modificar'),
     path('movimientos/domicilio/', views.movimiento_directo, name='movimiento_directo'),
@@ -95,8 +101,11 @@ urlpatterns = [
     path('reportes/movimientos/', views.reporte_movimientos, name='reporte_movimientos'),
     path('reportes/resumen-operativo/', views.resumen_operativo_hoy, name='resumen_operativo_hoy'),
     path('reportes/resumen-operativo/export/', views.export_resumen_operativo, name='export_resumen_operativo'),
+    path('reportes/jobs/<int:job_id>/', views.estado_reporte_job, name='estado_reporte_job'),
+    path('reportes/jobs/<int:job_id>/descargar/', views.descargar_reporte_job, name='descargar_reporte_job'),
     path('react/despachos-activos/', views.react_despachos_activos, name='react_despachos_activos'),
     path('api/despachos-activos/', views.api_despachos_activos, name='api_despachos_activos'),
+    path('api/eventos/', views.stream_eventos, name='stream_eventos'),
     path('reportes/despachos-activos/', views.despachos_activos, name='despachos_activos'),
     path('reportes/recetas-pendientes/', views.recetas_pendientes_devolucion, name='recetas_pendientes'),
     path('reportes/consulta-rapida/', views.consulta_rapida, name='consulta_rapida'),
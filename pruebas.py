@@ -0,0 +1,47 @@
+"""Runner de pruebas: crea las tablas base antes de migrar la base de pruebas.
+
+0001_initial declara managed=False los modelos de la base heredada (despacho,
+usuario, motorista, auditoria_general...), así que `manage.py test` no crea sus
+tablas y las migraciones posteriores, con FK e índices sobre ellas, fallan. En
+producción esas tablas ya existen; aquí se crean desde models.py justo antes
+de aplicar las migraciones.
+"""
+from django.apps import apps
+from django.db import connections
+from django.db.models.signals import pre_migrate
+from django.test.runner import DiscoverRunner
+
+APP_LABEL = 'appnproylogico'
+
+
+def modelos_base():
+    """Modelos de la app que 0001_initial deja sin gestionar (managed=False)."""
+    from django.db.migrations import CreateModel
+    from importlib import import_module
+    inicial = import_module(f'{apps.get_app_config(APP_LABEL).name}.migrations.0001_initial')
+    nombres = {
+        op.name.lower() for op in inicial.Migration.operations
+        if isinstance(op, CreateModel) and op.options.get('managed') is False
+    }
+    return [m for m in apps.get_app_config(APP_LABEL).get_models() if m._meta.model_name in nombres]
+
+
+def crear_tablas_base(sender, using='default', **kwargs):
+    conexion = connections[using]
+    existentes = set(conexion.introspection.table_names())
+    faltan = [m for m in modelos_base() if m._meta.db_table not in existentes]
+    if not faltan:
+        return
+    # Un solo schema_editor: las FK entre tablas base se agregan al final
+    with conexion.schema_editor() as editor:
+        for modelo in faltan:
+            editor.create_model(modelo)
+
+
+class PruebasRunner(DiscoverRunner):
+    def setup_databases(self, **kwargs):
+        pre_migrate.connect(crear_tablas_base, sender=apps.get_app_config(APP_LABEL), dispatch_uid='crear_tablas_base')
+        try:
+            return super().setup_databases(**kwargs)
+        finally:
+            pre_migrate.disconnect(crear_tablas_base, sender=apps.get_app_config(APP_LABEL), dispatch_uid='crear_tablas_base')
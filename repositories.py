@@ -1,4 +1,11 @@
+import time
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
 from django.db import connection
+from django.db.models import Avg, Count, Q, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
 from django.utils import timezone
 from .models import Despacho, Localfarmacia
 
@@ -7,24 +14,279 @@ def fetchall(sql, params=None):
         cur.execute(sql, params or [])
         return cur.fetchall()
 
+
+def _inicio_dia(d):
+    dt = datetime(d.year, d.month, d.day)
+    return timezone.make_aware(dt) if settings.USE_TZ else dt
+
+
+def filtro_periodo(campo, fecha=None, anio=None, mes=None):
+    """kwargs de filtro por período como rango semiabierto [inicio, fin) sobre `campo`.
+
+    A diferencia de __date/__year/__month no envuelve la columna en una función,
+    así que MySQL puede usar los índices que empiezan por la fecha.
+    """
+    if fecha:
+        ini = _inicio_dia(fecha)
+        fin = _inicio_dia(fecha + timedelta(days=1))
+    elif anio and mes:
+        anio, mes = int(anio), int(mes)
+        ini = _inicio_dia(date(anio, mes, 1))
+        fin = _inicio_dia(date(anio + 1, 1, 1) if mes == 12 else date(anio, mes + 1, 1))
+    elif anio:
+        ini = _inicio_dia(date(int(anio), 1, 1))
+        fin = _inicio_dia(date(int(anio) + 1, 1, 1))
+    elif mes:
+        # Un mes de todos los años no es un rango contiguo
+        return {f'{campo}__month': int(mes)}
+    else:
+        return {}
+    return {f'{campo}__gte': ini, f'{campo}__lt': fin}
+
+DESPACHOS_ACTIVOS_COLUMNS = (
+    "id, codigo_despacho, estado, tipo_despacho, prioridad, farmacia_origen, motorista, "
+    "moto_patente, cliente_nombre, cliente_telefono, destino_direccion, tiene_receta_retenida, "
+    "requiere_aprobacion_operadora, aprobado_por_operadora, fecha_registro, fecha_asignacion, "
+    "fecha_salida_farmacia, minutos_en_ruta, hubo_incidencia, tipo_incidencia, coordenadas_destino"
+)
+
+
 def get_despachos_activos():
-    sql = (
-        "SELECT id, codigo_despacho, estado, tipo_despacho, prioridad, farmacia_origen, motorista, "
-        "moto_patente, cliente_nombre, cliente_telefono, destino_direccion, tiene_receta_retenida, "
-        "requiere_aprobacion_operadora, aprobado_por_operadora, fecha_registro, fecha_asignacion, "
-        "fecha_salida_farmacia, minutos_en_ruta, hubo_incidencia, tipo_incidencia, coordenadas_destino "
-        "FROM vista_despachos_activos"
-    )
-    rows = fetchall(sql)
+    rows = fetchall(f"SELECT {DESPACHOS_ACTIVOS_COLUMNS} FROM vista_despachos_activos")
     if rows:
         return rows
+    from .services.fixtures_estaticos import cargar_filas
+    # El JSON trae filas con el orden de DESPACHOS_ACTIVOS_COLUMNS, no objetos
+    return list(cargar_filas('despachos_activos.json'))
+
+
+# Read model de despachos activos: versión global + filas cacheadas por versión.
+# Cualquier cambio en Despacho (signals.py) sube la versión; el TTL acota la
+# antigüedad de minutos_en_ruta y cubre escrituras que no pasan por el ORM.
+# Con una caché por proceso (LocMemCache) el cambio en un worker no llega a los
+# demás, así que ahí la versión también vence con el TTL.
+DESPACHOS_ACTIVOS_VERSION_KEY = 'despachos_activos_version'
+DESPACHOS_ACTIVOS_CACHE_TTL = 60
+
+
+def _ttl_version_despachos_activos():
+    from .roles import cache_compartida
+    return None if cache_compartida() else DESPACHOS_ACTIVOS_CACHE_TTL
+
+
+def version_despachos_activos():
+    v = cache.get(DESPACHOS_ACTIVOS_VERSION_KEY)
+    if v is None:
+        # Arranca en el reloj para no repetir versiones tras vaciar la caché
+        cache.add(DESPACHOS_ACTIVOS_VERSION_KEY, int(time.time() * 1000), _ttl_version_despachos_activos())
+        v = cache.get(DESPACHOS_ACTIVOS_VERSION_KEY) or 0
+    return v
+
+
+def invalidar_despachos_activos():
     try:
-        import json, pathlib
-        data_path = pathlib.Path(__file__).resolve().parent.parent / 'static' / 'data' / 'despachos_activos.json'
-        with open(data_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return cache.incr(DESPACHOS_ACTIVOS_VERSION_KEY)
+    except ValueError:
+        v = int(time.time() * 1000)
+        cache.set(DESPACHOS_ACTIVOS_VERSION_KEY, v, _ttl_version_despachos_activos())
+        return v
+
+
+def get_despachos_activos_snapshot():
+    """(version, filas) de vista_despachos_activos; se recalcula solo al cambiar la versión o vencer el TTL."""
+    version = version_despachos_activos()
+    clave = f'despachos_activos_rows_{version}'
+    rows = cache.get(clave)
+    if rows is None:
+        rows = [tuple(r) for r in get_despachos_activos()]
+        cache.set(clave, rows, DESPACHOS_ACTIVOS_CACHE_TTL)
+    return version, rows
+
+
+
+DASHBOARD_METRICAS_KEY = 'dashboard_metricas'
+DASHBOARD_METRICAS_CAMPOS = ('total_farmacias', 'total_motoristas', 'total_motos', 'asignaciones_activas')
+# Respaldo en static/data cuando la tabla está vacía
+DASHBOARD_METRICAS_FALLBACK = {
+    'total_farmacias': ('farmacias.json', None),
+    'total_motoristas': ('motoristas.json', None),
+    'total_motos': ('motos.json', None),
+    'asignaciones_activas': ('asignaciones_moto_motorista.json', lambda a: a.get('activa')),
+}
+
+
+def get_conteos_dashboard():
+    """Conteos del panel de inicio en una sola consulta."""
+    row = fetchall(
+        "SELECT (SELECT COUNT(*) FROM localfarmacia WHERE activo = 1), "
+        "(SELECT COUNT(*) FROM motorista WHERE activo = 1), "
+        "(SELECT COUNT(*) FROM moto), "
+        "(SELECT COUNT(*) FROM asignacion_moto_motorista WHERE activa = 1)"
+    )[0]
+    return dict(zip(DASHBOARD_METRICAS_CAMPOS, (int(v or 0) for v in row)))
+
+
+def metricas_dashboard():
+    """Snapshot cacheado de los conteos del inicio; se recalcula al expirar o al invalidarse."""
+    datos = cache.get(DASHBOARD_METRICAS_KEY)
+    if datos is not None:
+        return datos
+    try:
+        datos = get_conteos_dashboard()
     except Exception:
+        datos = dict.fromkeys(DASHBOARD_METRICAS_CAMPOS, 0)
+    from .services.fixtures_estaticos import contar
+    for campo, (archivo, filtro) in DASHBOARD_METRICAS_FALLBACK.items():
+        if not datos[campo]:
+            datos[campo] = contar(archivo, filtro)
+    cache.set(DASHBOARD_METRICAS_KEY, datos, int(getattr(settings, 'DASHBOARD_METRICAS_TTL', 60)))
+    return datos
+
+
+def invalidar_metricas_dashboard():
+    cache.delete(DASHBOARD_METRICAS_KEY)
+
+
+def _filtrar_despachos_activos(rows, q='', estado='', prioridad='', tipo=''):
+    # Mismos criterios que el WHERE de get_despachos_activos_page, para el fallback JSON
+    out = []
+    for r in rows:
+        if q and not any(q in str(r[i] or '').lower() for i in (1, 5, 6, 10)):
+            continue
+        if estado and r[2] != estado:
+            continue
+        if prioridad and r[4] != prioridad:
+            continue
+        if tipo and r[3] != tipo:
+            continue
+        out.append(r)
+    return out
+
+
+def _pagina_en_memoria(rows, q, estado, prioridad, tipo, limit, cursor):
+    data = _filtrar_despachos_activos(rows, q, estado, prioridad, tipo)
+    data.sort(key=lambda r: r[0], reverse=True)
+    total = len(data)
+    if cursor:
+        data = [r for r in data if r[0] < int(cursor)]
+    page = data[:limit]
+    next_cursor = page[-1][0] if len(data) > limit else None
+    return page, total, False, next_cursor
+
+
+def get_despachos_activos_page(q='', estado='', prioridad='', tipo='', limit=100, cursor=None, count_cap=None):
+    """Página filtrada de vista_despachos_activos.
+
+    Filtros, orden y paginación keyset (id descendente) se resuelven en SQL.
+    Retorna (rows, count, count_estimado, next_cursor); count es el total exacto
+    de filas que cumplen los filtros, salvo que se pase count_cap: entonces se
+    cuenta hasta count_cap y count_estimado indica que hay más.
+    """
+    q = (q or '').strip().lower()
+    estado = (estado or '').strip().upper()
+    prioridad = (prioridad or '').strip().upper()
+    tipo = (tipo or '').strip().upper()
+    limit = max(1, int(limit))
+    where = []
+    params = []
+    if q:
+        like = f"%{q}%"
+        where.append(
+            "(LOWER(codigo_despacho) LIKE %s OR LOWER(farmacia_origen) LIKE %s "
+            "OR LOWER(motorista) LIKE %s OR LOWER(destino_direccion) LIKE %s)"
+        )
+        params += [like, like, like, like]
+    if estado:
+        where.append("estado = %s")
+        params.append(estado)
+    if prioridad:
+        where.append("prioridad = %s")
+        params.append(prioridad)
+    if tipo:
+        where.append("tipo_despacho = %s")
+        params.append(tipo)
+    filtros = (" WHERE " + " AND ".join(where)) if where else ""
+    page_where = list(where)
+    page_params = list(params)
+    if cursor:
+        page_where.append("id < %s")
+        page_params.append(int(cursor))
+    sql = (
+        f"SELECT {DESPACHOS_ACTIVOS_COLUMNS} FROM vista_despachos_activos"
+        + ((" WHERE " + " AND ".join(page_where)) if page_where else "")
+        + " ORDER BY id DESC LIMIT %s"
+    )
+    rows = list(fetchall(sql, page_params + [limit + 1]))
+    if not rows and not fetchall("SELECT 1 FROM vista_despachos_activos LIMIT 1"):
+        return _pagina_en_memoria(get_despachos_activos(), q, estado, prioridad, tipo, limit, cursor)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1][0]
+    if count_cap is None:
+        count = fetchall(f"SELECT COUNT(*) FROM vista_despachos_activos{filtros}", params)[0][0]
+        return rows, count, False, next_cursor
+    count_sql = (
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM vista_despachos_activos{filtros} LIMIT %s) t"
+    )
+    count = fetchall(count_sql, params + [count_cap + 1])[0][0]
+    estimado = count > count_cap
+    return rows, min(count, count_cap), estimado, next_cursor
+
+
+def _resumen_operativo_orm(qs, granularidad):
+    """Agrega despachos por farmacia (y por año/mes según granularidad) en una sola consulta.
+
+    granularidad: 'dia' -> filas de vista_resumen_operativo_hoy,
+    'mes' -> [anio, mes, ...], 'anio' -> [anio, ...]. Las columnas extra
+    (domicilio, reenvio, intercambio, error) van al final como antes.
+    """
+    claves = []
+    if granularidad in ('mes', 'anio'):
+        qs = qs.annotate(anio=ExtractYear('fecha_registro'))
+        claves.append('anio')
+    if granularidad == 'mes':
+        qs = qs.annotate(mes=ExtractMonth('fecha_registro'))
+        claves.append('mes')
+    agg = qs.values(*claves, 'farmacia_origen_local_id').annotate(
+        total=Count('id'),
+        entregados=Count('id', filter=Q(estado='ENTREGADO')),
+        fallidos=Count('id', filter=Q(estado='FALLIDO')),
+        en_camino=Count('id', filter=Q(estado='EN_CAMINO')),
+        pendientes=Count('id', filter=Q(estado='PENDIENTE')),
+        anulados=Count('id', filter=Q(estado='ANULADO')),
+        con_receta=Count('id', filter=Q(tiene_receta_retenida=True)),
+        con_incidencias=Count('id', filter=Q(hubo_incidencia=True)),
+        domicilio=Count('id', filter=Q(tipo_despacho='DOMICILIO')),
+        reenvio=Count('id', filter=Q(tipo_despacho='REENVIO_RECETA')),
+        intercambio=Count('id', filter=Q(tipo_despacho='INTERCAMBIO')),
+        error=Count('id', filter=Q(tipo_despacho='ERROR_DESPACHO')),
+        prom_min=Avg('tiempo_total_minutos', filter=Q(tiempo_total_minutos__gt=0)),
+        valor_total=Sum('valor_declarado'),
+    ).order_by()
+    agg = list(agg)
+    if not agg:
         return []
+    lids = {r['farmacia_origen_local_id'] or '' for r in agg}
+    farmacias = {
+        lid: (nombre, comuna)
+        for lid, nombre, comuna in Localfarmacia.objects.filter(local_id__in=lids).values_list('local_id', 'local_nombre', 'comuna_nombre')
+    }
+    out = []
+    for r in agg:
+        lid = r['farmacia_origen_local_id'] or ''
+        nombre, comuna = farmacias.get(lid, (lid, ''))
+        fila = [
+            lid, nombre, comuna, r['total'], r['entregados'], r['fallidos'], r['en_camino'], r['pendientes'],
+            r['anulados'], r['con_receta'], r['con_incidencias'], int(r['prom_min'] or 0), float(r['valor_total'] or 0),
+            r['domicilio'], r['reenvio'], r['intercambio'], r['error'],
+        ]
+        out.append([r[k] for k in claves] + fila)
+    # Ordenar por periodo y total desc, igual que las vistas SQL
+    n = len(claves)
+    out.sort(key=lambda f: tuple(f[:n]) + (f[n + 3],), reverse=True)
+    return out
+
 
 def get_resumen_operativo_hoy():
     sql = (
@@ -37,38 +299,7 @@ def get_resumen_operativo_hoy():
         return rows
     # Fallback por ORM
     hoy = timezone.now().date()
-    qs = Despacho.objects.filter(fecha_registro__date=hoy)
-    out = []
-    if qs.count() == 0:
-        return out
-    # Agrupar por farmacia_origen_local_id
-    by_farm = {}
-    for d in qs:
-        lid = d.farmacia_origen_local_id or ''
-        by_farm.setdefault(lid, []).append(d)
-    for lid, items in by_farm.items():
-        farm = Localfarmacia.objects.filter(local_id=lid).first()
-        nombre = farm.local_nombre if farm else lid
-        comuna = farm.comuna_nombre if farm else ''
-        total = len(items)
-        entregados = sum(1 for x in items if x.estado == 'ENTREGADO')
-        fallidos = sum(1 for x in items if x.estado == 'FALLIDO')
-        en_camino = sum(1 for x in items if x.estado == 'EN_CAMINO')
-        pendientes = sum(1 for x in items if x.estado == 'PENDIENTE')
-        anulados = sum(1 for x in items if x.estado == 'ANULADO')
-        con_receta = sum(1 for x in items if x.tiene_receta_retenida)
-        con_incidencias = sum(1 for x in items if x.hubo_incidencia)
-        domicilio = sum(1 for x in items if x.tipo_despacho == 'DOMICILIO')
-        reenvio = sum(1 for x in items if x.tipo_despacho == 'REENVIO_RECETA')
-        intercambio = sum(1 for x in items if x.tipo_despacho == 'INTERCAMBIO')
-        error = sum(1 for x in items if x.tipo_despacho == 'ERROR_DESPACHO')
-        tiempos = [x.tiempo_total_minutos for x in items if x.tiempo_total_minutos]
-        prom_min = int(sum(tiempos)/len(tiempos)) if tiempos else 0
-        valor_total = float(sum((x.valor_declarado or 0) for x in items))
-        out.append([lid, nombre, comuna, total, entregados, fallidos, en_camino, pendientes, anulados, con_receta, con_incidencias, prom_min, valor_total, domicilio, reenvio, intercambio, error])
-    # Ordenar por total desc
-    out.sort(key=lambda r: r[3], reverse=True)
-    return out
+    return _resumen_operativo_orm(Despacho.objects.filter(**filtro_periodo('fecha_registro', fecha=hoy)), 'dia')
 
 def get_resumen_operativo_mes(anio=None, mes=None):
     base = (
@@ -89,41 +320,8 @@ def get_resumen_operativo_mes(anio=None, mes=None):
     if rows:
         return rows
     # Fallback por ORM
-    qs = Despacho.objects.all()
-    if anio:
-        qs = qs.filter(fecha_registro__year=int(anio))
-    if mes:
-        qs = qs.filter(fecha_registro__month=int(mes))
-    out = []
-    if qs.count() == 0:
-        return out
-    by_farm = {}
-    for d in qs:
-        lid = d.farmacia_origen_local_id or ''
-        key = (d.fecha_registro.year, d.fecha_registro.month, lid)
-        by_farm.setdefault(key, []).append(d)
-    for (yy, mm, lid), items in by_farm.items():
-        farm = Localfarmacia.objects.filter(local_id=lid).first()
-        nombre = farm.local_nombre if farm else lid
-        comuna = farm.comuna_nombre if farm else ''
-        total = len(items)
-        entregados = sum(1 for x in items if x.estado == 'ENTREGADO')
-        fallidos = sum(1 for x in items if x.estado == 'FALLIDO')
-        en_camino = sum(1 for x in items if x.estado == 'EN_CAMINO')
-        pendientes = sum(1 for x in items if x.estado == 'PENDIENTE')
-        anulados = sum(1 for x in items if x.estado == 'ANULADO')
-        con_receta = sum(1 for x in items if x.tiene_receta_retenida)
-        con_incidencias = sum(1 for x in items if x.hubo_incidencia)
-        domicilio = sum(1 for x in items if x.tipo_despacho == 'DOMICILIO')
-        reenvio = sum(1 for x in items if x.tipo_despacho == 'REENVIO_RECETA')
-        intercambio = sum(1 for x in items if x.tipo_despacho == 'INTERCAMBIO')
-        error = sum(1 for x in items if x.tipo_despacho == 'ERROR_DESPACHO')
-        tiempos = [x.tiempo_total_minutos for x in items if x.tiempo_total_minutos]
-        prom_min = int(sum(tiempos)/len(tiempos)) if tiempos else 0
-        valor_total = float(sum((x.valor_declarado or 0) for x in items))
-        out.append([yy, mm, lid, nombre, comuna, total, entregados, fallidos, en_camino, pendientes, anulados, con_receta, con_incidencias, prom_min, valor_total, domicilio, reenvio, intercambio, error])
-    out.sort(key=lambda r: (r[0], r[1], r[5]), reverse=True)
-    return out
+    qs = Despacho.objects.filter(**filtro_periodo('fecha_registro', anio=anio, mes=mes))
+    return _resumen_operativo_orm(qs, 'mes')
 
 def get_resumen_operativo_anual(anio=None):
     base = (
@@ -137,101 +335,151 @@ def get_resumen_operativo_anual(anio=None):
     if rows:
         return rows
     # Fallback por ORM
-    qs = Despacho.objects.all()
-    if anio:
-        qs = qs.filter(fecha_registro__year=int(anio))
-    out = []
-    if qs.count() == 0:
-        return out
-    by_farm = {}
-    for d in qs:
-        lid = d.farmacia_origen_local_id or ''
-        key = (d.fecha_registro.year, lid)
-        by_farm.setdefault(key, []).append(d)
-    for (yy, lid), items in by_farm.items():
-        farm = Localfarmacia.objects.filter(local_id=lid).first()
-        nombre = farm.local_nombre if farm else lid
-        comuna = farm.comuna_nombre if farm else ''
-        total = len(items)
-        entregados = sum(1 for x in items if x.estado == 'ENTREGADO')
-        fallidos = sum(1 for x in items if x.estado == 'FALLIDO')
-        en_camino = sum(1 for x in items if x.estado == 'EN_CAMINO')
-        pendientes = sum(1 for x in items if x.estado == 'PENDIENTE')
-        anulados = sum(1 for x in items if x.estado == 'ANULADO')
-        con_receta = sum(1 for x in items if x.tiene_receta_retenida)
-        con_incidencias = sum(1 for x in items if x.hubo_incidencia)
-        domicilio = sum(1 for x in items if x.tipo_despacho == 'DOMICILIO')
-        reenvio = sum(1 for x in items if x.tipo_despacho == 'REENVIO_RECETA')
-        intercambio = sum(1 for x in items if x.tipo_despacho == 'INTERCAMBIO')
-        error = sum(1 for x in items if x.tipo_despacho == 'ERROR_DESPACHO')
-        tiempos = [x.tiempo_total_minutos for x in items if x.tiempo_total_minutos]
-        prom_min = int(sum(tiempos)/len(tiempos)) if tiempos else 0
-        valor_total = float(sum((x.valor_declarado or 0) for x in items))
-        out.append([yy, lid, nombre, comuna, total, entregados, fallidos, en_camino, pendientes, anulados, con_receta, con_incidencias, prom_min, valor_total, domicilio, reenvio, intercambio, error])
-    out.sort(key=lambda r: (r[0], r[4]), reverse=True)
-    return out
+    qs = Despacho.objects.filter(**filtro_periodo('fecha_registro', anio=anio))
+    return _resumen_operativo_orm(qs, 'anio')
+
+def get_resumen_asignaciones_mf():
+    """Filas del export asignaciones_mf con los conteos de despachos por (motorista, farmacia).
+
+    Los contadores salen de una única agregación condicional agrupada por
+    motorista y local de origen, sin importar cuántas asignaciones existan.
+    """
+    from .models import AsignacionMotoristaFarmacia
+    asignaciones = list(
+        AsignacionMotoristaFarmacia.objects.select_related('motorista__usuario', 'farmacia').order_by('-fecha_asignacion')
+    )
+    if not asignaciones:
+        return []
+    agg = Despacho.objects.filter(
+        motorista_id__in={a.motorista_id for a in asignaciones}
+    ).values('motorista_id', 'farmacia_origen_local_id').annotate(
+        total=Count('id'),
+        entregados=Count('id', filter=Q(estado='ENTREGADO')),
+        fallidos=Count('id', filter=Q(estado='FALLIDO')),
+        en_camino=Count('id', filter=Q(estado='EN_CAMINO')),
+        pendientes=Count('id', filter=Q(estado='PENDIENTE')),
+        anulados=Count('id', filter=Q(estado='ANULADO')),
+        con_receta=Count('id', filter=Q(tiene_receta_retenida=True)),
+    ).order_by()
+    campos = ('total', 'entregados', 'fallidos', 'en_camino', 'pendientes', 'anulados', 'con_receta')
+    por_farmacia = {}
+    por_motorista = {}
+    for r in agg:
+        conteos = [r[c] for c in campos]
+        por_farmacia[(r['motorista_id'], r['farmacia_origen_local_id'])] = conteos
+        acumulado = por_motorista.setdefault(r['motorista_id'], [0] * len(campos))
+        for i, v in enumerate(conteos):
+            acumulado[i] += v
+    rows = []
+    for a in asignaciones:
+        try:
+            lid = getattr(a.farmacia, 'local_id', None)
+            # Sin local_id se cuentan todos los despachos del motorista, como antes
+            if lid:
+                conteos = por_farmacia.get((a.motorista_id, lid), [0] * len(campos))
+            else:
+                conteos = por_motorista.get(a.motorista_id, [0] * len(campos))
+            rows.append([
+                f"{a.motorista.usuario.nombre} {a.motorista.usuario.apellido}",
+                f"{a.farmacia.local_nombre}",
+                'Sí' if a.activa else 'No',
+                a.fecha_asignacion.strftime('%Y-%m-%d %H:%M'),
+                *conteos,
+            ])
+        except Exception:
+            continue
+    return rows
+
 
 def normalize_from_normalizacion(limit=500):
     with connection.cursor() as cur:
         cur.execute("CALL sp_normalizar_despachos(%s)", [int(limit)])
         return True
 
+def drenar_normalizacion(chunk=500, max_vueltas=1000):
+    """Llama a sp_normalizar_despachos por bloques hasta vaciar el staging pendiente.
+
+    Se detiene si una vuelta no reduce los pendientes (filas que el SP no puede
+    normalizar). Devuelve (vueltas, pendientes_restantes).
+    """
+    from .models import NormalizacionDespacho
+    pendientes = NormalizacionDespacho.objects.filter(procesado=False, error_normalizacion__isnull=True)
+    restantes = pendientes.count()
+    vueltas = 0
+    while restantes and vueltas < max_vueltas:
+        normalize_from_normalizacion(limit=chunk)
+        vueltas += 1
+        antes, restantes = restantes, pendientes.count()
+        if restantes >= antes:
+            break
+    if vueltas:
+        # El SP inserta despachos sin pasar por el ORM
+        invalidar_despachos_activos()
+    return vueltas, restantes
+
+FARMACIA_IMPORT_ALIASES = {
+    'local_id': ['local_id', 'id_local', 'id'],
+    'local_nombre': ['local_nombre', 'nombre_local', 'farmacia', 'nombre'],
+    'local_direccion': ['local_direccion', 'direccion', 'dirección', 'calle'],
+    'comuna_nombre': ['comuna_nombre', 'comuna'],
+    'localidad_nombre': ['localidad_nombre', 'localidad'],
+    'fk_region': ['fk_region', 'region_id', 'id_region'],
+    'fk_comuna': ['fk_comuna', 'comuna_id', 'id_comuna'],
+    'fk_localidad': ['fk_localidad', 'localidad_id', 'id_localidad'],
+    'funcionamiento_hora_apertura': ['funcionamiento_hora_apertura', 'hora_apertura', 'apertura'],
+    'funcionamiento_hora_cierre': ['funcionamiento_hora_cierre', 'hora_cierre', 'cierre'],
+    'funcionamiento_dia': ['funcionamiento_dia', 'dia_funcionamiento', 'dia', 'día'],
+    'local_telefono': ['local_telefono', 'telefono', 'teléfono', 'fono'],
+    'local_lat': ['local_lat', 'lat', 'latitud'],
+    'local_lng': ['local_lng', 'lng', 'longitud'],
+    'fecha': ['fecha', 'date', 'f_registro', 'fecha_actualizacion'],
+}
+
+
 def normalize_farmacia_headers(headers):
-    mapping = {
-        'local_id': ['local_id', 'id_local', 'id'],
-        'local_nombre': ['local_nombre', 'nombre_local', 'farmacia', 'nombre'],
-        'local_direccion': ['local_direccion', 'direccion', 'calle'],
-        'comuna_nombre': ['comuna_nombre', 'comuna'],
-        'localidad_nombre': ['localidad_nombre', 'localidad'],
-        'fk_region': ['fk_region', 'region_id', 'id_region'],
-        'fk_comuna': ['fk_comuna', 'comuna_id', 'id_comuna'],
-        'fk_localidad': ['fk_localidad', 'localidad_id', 'id_localidad'],
-        'funcionamiento_hora_apertura': ['funcionamiento_hora_apertura', 'hora_apertura', 'apertura'],
-        'funcionamiento_hora_cierre': ['funcionamiento_hora_cierre', 'hora_cierre', 'cierre'],
-        'funcionamiento_dia': ['funcionamiento_dia', 'dia_funcionamiento', 'dia'],
-        'local_telefono': ['local_telefono', 'telefono', 'fono'],
-        'local_lat': ['local_lat', 'lat', 'latitud'],
-        'local_lng': ['local_lng', 'lng', 'longitud'],
-        'fecha': ['fecha', 'date', 'f_registro'],
-    }
     normalized = {}
-    for canonical, aliases in mapping.items():
+    for canonical, aliases in FARMACIA_IMPORT_ALIASES.items():
         for h in headers:
             hh = str(h).strip().lower()
-            if hh in [a.lower() for a in aliases]:
+            if hh in aliases:
                 normalized[hh] = canonical
     return {h: normalized.get(str(h).strip().lower(), str(h).strip().lower()) for h in headers}
 
-def validate_farmacias_import(rows):
-    if not rows:
-        return []
-    headers = rows[0]
+
+def iter_farmacias_import(rows, incluir_duplicados=False):
+    """
+    Igual que validate_farmacias_import pero consumiendo `rows` (encabezado +
+    filas, cualquier iterable) de forma incremental
+
+    Con incluir_duplicados=True también entrega los local_id repetidos, para
+    que quien importa los cuente y los informe.
+    """
+    rows = iter(rows)
+    headers = next(rows, None)
+    if not headers:
+        return
     header_map = normalize_farmacia_headers(headers)
     idx = {header_map.get(h, h): i for i, h in enumerate(headers)}
+    # Sin ningún encabezado reconocido se asume el orden de columnas de FARMACIA_IMPORT_ALIASES
+    posicional = not any(c in idx for c in FARMACIA_IMPORT_ALIASES)
+
+    def celda(r, campo, pos):
+        i = idx.get(campo, pos if posicional else None)
+        if i is None or i >= len(r) or r[i] is None:
+            return ''
+        return str(r[i]).strip()
+
     seen = set()
-    cleaned = []
-    for r in rows[1:]:
-        local_id = str(r[idx.get('local_id', 0)]).strip()
-        key = (local_id or '').upper()
-        if key in seen:
+    for r in rows:
+        if not r:
+            continue
+        item = {campo: celda(r, campo, pos) for pos, campo in enumerate(FARMACIA_IMPORT_ALIASES)}
+        key = item['local_id'].upper()
+        if key in seen and not incluir_duplicados:
             continue
         seen.add(key)
-        item = {
-            'local_id': local_id,
-            'local_nombre': str(r[idx.get('local_nombre', 1)]).strip(),
-            'local_direccion': str(r[idx.get('local_direccion', 2)]).strip(),
-            'comuna_nombre': str(r[idx.get('comuna_nombre', 3)]).strip(),
-            'localidad_nombre': str(r[idx.get('localidad_nombre', 4)]).strip(),
-            'fk_region': str(r[idx.get('fk_region', 5)]).strip(),
-            'fk_comuna': str(r[idx.get('fk_comuna', 6)]).strip(),
-            'fk_localidad': str(r[idx.get('fk_localidad', 7)]).strip(),
-            'funcionamiento_hora_apertura': str(r[idx.get('funcionamiento_hora_apertura', 8)]).strip(),
-            'funcionamiento_hora_cierre': str(r[idx.get('funcionamiento_hora_cierre', 9)]).strip(),
-            'funcionamiento_dia': str(r[idx.get('funcionamiento_dia', 10)]).strip(),
-            'local_telefono': str(r[idx.get('local_telefono', 11)]).strip(),
-            'local_lat': str(r[idx.get('local_lat', 12)]).strip(),
-            'local_lng': str(r[idx.get('local_lng', 13)]).strip(),
-            'fecha': str(r[idx.get('fecha', 14)]).strip(),
-        }
-        cleaned.append(item)
-    return cleaned
+        yield item
+
+
+def validate_farmacias_import(rows):
+    return list(iter_farmacias_import(rows))
@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 
 
 MODULOS = {
@@ -20,9 +22,64 @@ ROLES = (
 )
 
 
-def obtener_rol_usuario(user):
-    if user.is_superuser:
-        return 'admin'
+PERMISOS_POR_ROL = {
+    'admin': {k: {'all'} for k in MODULOS.keys()},
+    'operador': {
+        'farmacias': {'view'},
+        'motoristas': {'view'},
+        'motos': {'view'},
+        'asignaciones': {'view'},
+        'movimientos': {'view', 'add'},
+        'despachos': {'view', 'add', 'change'},
+    },
+    'supervisor': {
+        'farmacias': {'view'},
+        'motoristas': {'view', 'change'},
+        'motos': {'view'},
+        'asignaciones': {'view', 'change'},
+        'movimientos': {'view', 'add'},
+        'despachos': {'view', 'change'},
+    },
+    'gerente': {k: {'view'} for k in MODULOS.keys()},
+    'motorista': {
+        'farmacias': {'view'},
+        'motoristas': {'view'},
+        'motos': {'view'},
+        'asignaciones': {'view'},
+        'movimientos': {'view'},
+        'despachos': {'view'},
+    },
+}
+
+
+# Backends que viven dentro de cada proceso: un delete en un worker no llega a los demás
+CACHES_POR_PROCESO = ('LocMemCache', 'DummyCache')
+
+
+def permisos_cache_ttl():
+    return int(getattr(settings, 'PERMISOS_CACHE_TTL', 60))
+
+
+def cache_compartida():
+    """True si la caché por defecto es común a todos los procesos (CACHE_COMPARTIDA la fuerza)."""
+    forzada = getattr(settings, 'CACHE_COMPARTIDA', None)
+    if forzada is not None:
+        return bool(forzada)
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    return backend.rsplit('.', 1)[-1] not in CACHES_POR_PROCESO
+
+
+def clave_rol_usuario(user_id):
+    return f'rol_usuario_{user_id}'
+
+
+def invalidar_rol_usuario(*user_ids):
+    ids = [u for u in user_ids if u is not None]
+    if ids:
+        cache.delete_many([clave_rol_usuario(u) for u in ids])
+
+
+def _rol_desde_grupos(user):
     grupos = {g.name for g in user.groups.all()}
     if 'Motoristas' in grupos:
         return 'motorista'
@@ -35,37 +92,30 @@ def obtener_rol_usuario(user):
     return 'usuario'
 
 
+def obtener_rol_usuario(user):
+    if user.is_superuser:
+        return 'admin'
+    # Memo por request: request.user es una instancia nueva en cada request
+    rol = getattr(user, '_rol_memo', None)
+    if rol:
+        return rol
+    if getattr(user, 'pk', None) is None:
+        return _rol_desde_grupos(user)
+    if not cache_compartida():
+        # Con caché por proceso la invalidación por signals no llega a los otros workers
+        user._rol_memo = _rol_desde_grupos(user)
+        return user._rol_memo
+    clave = clave_rol_usuario(user.pk)
+    rol = cache.get(clave)
+    if rol is None:
+        rol = _rol_desde_grupos(user)
+        cache.set(clave, rol, permisos_cache_ttl())
+    user._rol_memo = rol
+    return rol
+
+
 def obtener_permisos_usuario(user):
     rol = obtener_rol_usuario(user)
-    if rol == 'admin':
-        return {k: {'all'} for k in MODULOS.keys()}
-    if rol == 'operador':
-        return {
-            'farmacias': {'view'},
-            'motoristas': {'view'},
-            'motos': {'view'},
-            'asignaciones': {'view'},
-            'movimientos': {'view', 'add'},
-            'despachos': {'view', 'add', 'change'},
-        }
-    if rol == 'supervisor':
-        return {
-            'farmacias': {'view'},
-            'motoristas': {'view', 'change'},
-            'motos': {'view'},
-            'asignaciones': {'view', 'change'},
-            'movimientos': {'view', 'add'},
-            'despachos': {'view', 'change'},
-        }
-    if rol == 'gerente':
-        return {k: {'view'} for k in MODULOS.keys()}
-    if rol == 'motorista':
-        return {
-            'farmacias': {'view'},
-            'motoristas': {'view'},
-            'motos': {'view'},
-            'asignaciones': {'view'},
-            'movimientos': {'view'},
-            'despachos': {'view'},
-        }
-    return {k: set() for k in MODULOS.keys()}
+    permisos = PERMISOS_POR_ROL.get(rol) or {k: set() for k in MODULOS.keys()}
+    # Copia para no exponer los sets compartidos de PERMISOS_POR_ROL
+    return {k: set(v) for k, v in permisos.items()}
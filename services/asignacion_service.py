@@ -0,0 +1,321 @@
+"""Asignación automática de motoristas a despachos PENDIENTE.
+
+Candidatos: motoristas activos, disponibles hoy, con moto asignada
+(asignacion_moto_motorista activa) y al menos una farmacia asignada
+(asignacion_motorista_farmacia activa). Cada motorista ofrece
+`capacidad - carga actual` cupos; el costo de un cupo es la distancia desde
+su farmacia asignada más cercana a la farmacia de origen del despacho, más
+una penalización por la carga que ya lleva. Dejar un despacho sin asignar
+cuesta según su prioridad, así que con cupos escasos ganan los ALTA.
+
+Problemas chicos se resuelven exactos con el algoritmo húngaro; sobre
+ASIGNACION_HUNGARO_MAX_CELDAS se usa greedy por prioridad + reparación por
+intercambios. La propuesta se aplica en una transacción y el cambio de estado
+pasa por DespachoStateMachine (movimientos, auditoría, eventos).
+
+La vista previa entrega un token firmado con sus pares (despacho, motorista):
+al confirmar se aplica exactamente esa propuesta, no una recalculada.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Subquery
+from django.utils import timezone
+
+from .geo_service import haversine_km
+
+logger = logging.getLogger('appnproylogico')
+
+ESTADOS_EN_CURSO = ('ASIGNADO', 'PREPARANDO', 'PREPARADO', 'EN_CAMINO')
+# Costo (en km equivalentes) de dejar un despacho sin asignar
+COSTO_SIN_ASIGNAR = {'ALTA': 1000.0, 'MEDIA': 100.0, 'BAJA': 30.0}
+ORDEN_PRIORIDAD = {'ALTA': 0, 'MEDIA': 1, 'BAJA': 2}
+KM_POR_DESPACHO_EN_CURSO = 2.0
+DISTANCIA_DESCONOCIDA_KM = 10.0
+INFACTIBLE = 1e9
+ASIGNACION_MAX_DESPACHOS = 500
+ASIGNACION_HUNGARO_MAX_CELDAS = 10000
+REPARACION_MAX_PASADAS = 5
+# Vigencia del token de una vista previa
+ASIGNACION_PROPUESTA_MAX_SEGUNDOS = 900
+PROPUESTA_SALT = 'appnproylogico.auto_asignar'
+
+
+def hungaro(costos):
+    """
+    Asignación de costo mínimo (filas <= columnas), O(n²·m)
+
+    Returns:
+        lista con la columna asignada a cada fila
+    """
+    n = len(costos)
+    if not n:
+        return []
+    m = len(costos[0])
+    inf = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            fila = costos[i0 - 1]
+            ui0 = u[i0]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = fila[j - 1] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    asignacion = [-1] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            asignacion[p[j] - 1] = j - 1
+    return asignacion
+
+
+def _greedy_con_reparacion(despachos, motoristas, distancia, cupos, carga):
+    """Greedy por prioridad y antigüedad; luego intercambios entre pares que bajen la distancia total."""
+    asignado = {}
+    usados = dict.fromkeys(motoristas, 0)
+    for d in sorted(despachos, key=lambda d: (ORDEN_PRIORIDAD.get(d['prioridad'], 1), d['fecha_registro'])):
+        mejor, costo_mejor = None, COSTO_SIN_ASIGNAR.get(d['prioridad'], 100.0)
+        for m in motoristas:
+            if usados[m] >= cupos[m]:
+                continue
+            c = distancia(d, m) + KM_POR_DESPACHO_EN_CURSO * (carga.get(m, 0) + usados[m])
+            if c < costo_mejor:
+                mejor, costo_mejor = m, c
+        if mejor is not None:
+            asignado[d['id']] = mejor
+            usados[mejor] += 1
+    por_id = {d['id']: d for d in despachos}
+    for _ in range(REPARACION_MAX_PASADAS):
+        mejoro = False
+        ids = list(asignado)
+        for x in range(len(ids)):
+            a = por_id[ids[x]]
+            for y in range(x + 1, len(ids)):
+                b = por_id[ids[y]]
+                ma, mb = asignado[a['id']], asignado[b['id']]
+                if ma == mb:
+                    continue
+                ahorro = distancia(a, ma) + distancia(b, mb) - distancia(a, mb) - distancia(b, ma)
+                if ahorro > 1e-9:
+                    asignado[a['id']], asignado[b['id']] = mb, ma
+                    mejoro = True
+        if not mejoro:
+            break
+    return asignado
+
+
+def _hungaro_por_cupos(despachos, motoristas, distancia, cupos, carga):
+    columnas = [(m, k) for m in motoristas for k in range(cupos[m])]
+    n = len(despachos)
+    costos = []
+    for d in despachos:
+        fila = []
+        for m, k in columnas:
+            dist = distancia(d, m)
+            fila.append(INFACTIBLE if dist >= INFACTIBLE else dist + KM_POR_DESPACHO_EN_CURSO * (carga.get(m, 0) + k))
+        # Una columna ficticia por despacho: quedar sin asignar
+        fila.extend([COSTO_SIN_ASIGNAR.get(d['prioridad'], 100.0)] * n)
+        costos.append(fila)
+    asignado = {}
+    for i, j in enumerate(hungaro(costos)):
+        if 0 <= j < len(columnas) and costos[i][j] < INFACTIBLE:
+            asignado[despachos[i]['id']] = columnas[j][0]
+    return asignado
+
+
+def cargar_problema(limite=ASIGNACION_MAX_DESPACHOS):
+    """(despachos PENDIENTE, {motorista_id: [(local_id, lat, lng)]}, carga por motorista, coordenadas de origen)."""
+    from ..models import AsignacionMotoMotorista, AsignacionMotoristaFarmacia, Despacho, Localfarmacia
+    despachos = list(
+        Despacho.objects.filter(estado='PENDIENTE')
+        .order_by('fecha_registro', 'id')
+        .values('id', 'codigo_despacho', 'farmacia_origen_local_id', 'prioridad', 'fecha_registro', 'motorista_id')[:limite]
+    )
+    con_moto = AsignacionMotoMotorista.objects.filter(activa=True).values('motorista_id')
+    farmacias = {}
+    for mid, local_id, lat, lng in (
+        AsignacionMotoristaFarmacia.objects.filter(
+            activa=True, motorista__activo=True, motorista__disponible_hoy=True, motorista_id__in=Subquery(con_moto)
+        ).values_list('motorista_id', 'farmacia__local_id', 'farmacia__local_lat', 'farmacia__local_lng')
+    ):
+        farmacias.setdefault(mid, []).append((local_id, float(lat) if lat is not None else None, float(lng) if lng is not None else None))
+    carga = dict(
+        Despacho.objects.filter(motorista_id__in=list(farmacias), estado__in=ESTADOS_EN_CURSO)
+        .values('motorista_id').annotate(n=Count('id')).values_list('motorista_id', 'n').order_by()
+    ) if farmacias else {}
+    origenes = {
+        lid: (float(lat), float(lng))
+        for lid, lat, lng in Localfarmacia.objects.filter(
+            local_id__in={d['farmacia_origen_local_id'] for d in despachos}, local_lat__isnull=False, local_lng__isnull=False
+        ).values_list('local_id', 'local_lat', 'local_lng')
+    } if despachos else {}
+    return despachos, farmacias, carga, origenes
+
+
+def proponer(despachos, farmacias, carga, origenes, capacidad=None, radio_max_km=None):
+    """
+    Resuelve la asignación
+
+    Returns:
+        dict con propuestas [{despacho_id, codigo, motorista_id, distancia_km}], sin_asignar [codigos],
+        metodo ('hungaro' o 'greedy') y tiempo_ms
+    """
+    capacidad = capacidad or getattr(settings, 'ASIGNACION_CAPACIDAD', 4)
+    radio_max_km = radio_max_km or getattr(settings, 'ASIGNACION_RADIO_MAX_KM', 15.0)
+    inicio = time.perf_counter()
+    cupos = {m: max(0, capacidad - carga.get(m, 0)) for m in farmacias}
+    motoristas = [m for m, c in cupos.items() if c]
+    memo = {}
+
+    def distancia(d, m):
+        origen = d['farmacia_origen_local_id']
+        clave = (origen, m)
+        if clave not in memo:
+            mejor = INFACTIBLE
+            o = origenes.get(origen)
+            for local_id, lat, lng in farmacias[m]:
+                if local_id == origen:
+                    mejor = 0.0
+                    break
+                dist = haversine_km(o[0], o[1], lat, lng) if (o and lat is not None) else DISTANCIA_DESCONOCIDA_KM
+                mejor = min(mejor, dist)
+            memo[clave] = mejor if mejor <= radio_max_km else INFACTIBLE
+        return memo[clave]
+
+    if not despachos or not motoristas:
+        asignado, metodo = {}, 'vacio'
+    elif len(despachos) * (sum(cupos[m] for m in motoristas) + len(despachos)) <= ASIGNACION_HUNGARO_MAX_CELDAS:
+        asignado, metodo = _hungaro_por_cupos(despachos, motoristas, distancia, cupos, carga), 'hungaro'
+    else:
+        asignado, metodo = _greedy_con_reparacion(despachos, motoristas, distancia, cupos, carga), 'greedy'
+    propuestas = [
+        {'despacho_id': d['id'], 'codigo': d['codigo_despacho'], 'motorista_id': asignado[d['id']],
+         'distancia_km': round(distancia(d, asignado[d['id']]), 3)}
+        for d in despachos if d['id'] in asignado
+    ]
+    return {
+        'propuestas': propuestas,
+        'sin_asignar': [d['codigo_despacho'] for d in despachos if d['id'] not in asignado],
+        'metodo': metodo,
+        'tiempo_ms': round((time.perf_counter() - inicio) * 1000, 2),
+    }
+
+
+def _exigir_usuario(usuario):
+    if usuario is None:
+        raise ValueError('Se requiere el Usuario que firma la asignación')
+
+
+def aplicar_propuestas(propuestas, usuario):
+    """
+    Aplica las propuestas en una transacción: cambia el motorista de los que siguen
+    PENDIENTE y los pasa a ASIGNADO con la máquina de estados
+
+    Returns:
+        resultados de DespachoStateMachine.apply_transitions
+
+    Raises:
+        ValueError: sin `usuario` (los movimientos lo exigen), antes de abrir la transacción
+    """
+    from ..models import Despacho
+    from .despacho_estado_service import DespachoStateMachine
+    _exigir_usuario(usuario)
+    por_id = {p['despacho_id']: p for p in propuestas}
+    if not por_id:
+        return []
+    ahora = timezone.now()
+    with transaction.atomic():
+        vigentes = list(Despacho.objects.select_for_update().filter(id__in=por_id, estado='PENDIENTE').order_by('id'))
+        for d in vigentes:
+            d.motorista_id = por_id[d.id]['motorista_id']
+            d.fecha_asignacion = ahora
+        Despacho.objects.bulk_update(vigentes, ['motorista', 'fecha_asignacion'])
+        return DespachoStateMachine(usuario).apply_transitions([
+            {'codigo': d.codigo_despacho, 'estado': 'ASIGNADO', 'observacion': 'Asignación automática'} for d in vigentes
+        ])
+
+
+def firmar_propuestas(propuestas):
+    """Token firmado con los pares (despacho_id, motorista_id) de una vista previa."""
+    from django.core import signing
+    return signing.dumps([[p['despacho_id'], p['motorista_id']] for p in propuestas], salt=PROPUESTA_SALT, compress=True)
+
+
+def leer_propuestas(token):
+    """Propuestas de un token de firmar_propuestas; ValueError si no es válido o venció."""
+    from django.core import signing
+    max_age = getattr(settings, 'ASIGNACION_PROPUESTA_MAX_SEGUNDOS', ASIGNACION_PROPUESTA_MAX_SEGUNDOS)
+    try:
+        pares = signing.loads(token or '', salt=PROPUESTA_SALT, max_age=max_age)
+    except signing.BadSignature:
+        raise ValueError('Propuesta inválida o vencida: vuelve a generar la vista previa')
+    return [{'despacho_id': int(d), 'motorista_id': int(m)} for d, m in pares]
+
+
+def aplicar_vista_previa(token, usuario):
+    """
+    Aplica la propuesta de una vista previa tal como se mostró
+
+    Se omiten los despachos que ya no están PENDIENTE y los motoristas que
+    dejaron de estar activos o disponibles.
+
+    Returns:
+        dict con propuestas (cantidad del token), aplicados y omitidos
+    """
+    from ..models import Motorista
+    _exigir_usuario(usuario)
+    propuestas = leer_propuestas(token)
+    vigentes = set(
+        Motorista.objects.filter(id__in={p['motorista_id'] for p in propuestas}, activo=True, disponible_hoy=True).values_list('id', flat=True)
+    )
+    resultados = aplicar_propuestas([p for p in propuestas if p['motorista_id'] in vigentes], usuario)
+    aplicados = sum(1 for r in resultados if r['ok'])
+    logger.info('Auto-asignación confirmada: %s de %s propuestas aplicadas', aplicados, len(propuestas))
+    return {'propuestas': len(propuestas), 'aplicados': aplicados, 'omitidos': len(propuestas) - aplicados}
+
+
+def auto_asignar(usuario=None, aplicar=True, capacidad=None, limite=ASIGNACION_MAX_DESPACHOS):
+    """Carga, resuelve y (si `aplicar`) aplica; devuelve el resumen de `proponer` + 'aplicados'."""
+    if aplicar:
+        _exigir_usuario(usuario)
+    resumen = proponer(*cargar_problema(limite), capacidad=capacidad)
+    resumen['aplicados'] = 0
+    if aplicar and resumen['propuestas']:
+        resultados = aplicar_propuestas(resumen['propuestas'], usuario)
+        resumen['aplicados'] = sum(1 for r in resultados if r['ok'])
+    logger.info(
+        'Auto-asignación %s: %s propuestas, %s aplicadas, %s sin asignar en %s ms',
+        resumen['metodo'], len(resumen['propuestas']), resumen['aplicados'], len(resumen['sin_asignar']), resumen['tiempo_ms'],
+    )
+    return resumen
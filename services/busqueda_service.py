@@ -0,0 +1,197 @@
+"""Índice de consulta rápida: fila desnormalizada por despacho + tokens por campo.
+
+consulta_rapida buscaba con LIKE '%...%' sobre un join de cuatro tablas, que
+ningún índice puede resolver. Aquí cada despacho guarda sus nombres ya
+resueltos (busqueda_despacho) y las palabras normalizadas de farmacia,
+motorista y cliente (busqueda_token). Una búsqueda es un prefijo por palabra
+(`token LIKE 'abc%'`, servido por idx_token_campo) y la paginación es por
+keyset sobre (fecha_registro, despacho_id).
+
+El índice se mantiene al escribir: signals.py reindexa los despachos guardados
+y propaga cambios de nombre de farmacia/usuario; los caminos con bulk_create o
+bulk_update llaman a `indexar_despachos` explícitamente.
+"""
+import logging
+import re
+import unicodedata
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Q
+
+logger = logging.getLogger('appnproylogico')
+
+BUSQUEDA_PAGINA = 50
+BUSQUEDA_LOTE = 1000
+TOKEN_MAX = 40
+TOKENS_CONSULTA_MAX = 5
+
+
+def normalizar(texto):
+    """Minúsculas, sin tildes y con la puntuación convertida en espacios."""
+    s = unicodedata.normalize('NFKD', str(texto or ''))
+    s = ''.join(c for c in s if not unicodedata.combining(c)).lower()
+    return re.sub(r'[^0-9a-z]+', ' ', s).strip()
+
+
+def tokens(texto):
+    """Palabras normalizadas únicas de `texto`, en orden de aparición."""
+    vistos = []
+    for t in normalizar(texto).split():
+        t = t[:TOKEN_MAX]
+        if t not in vistos:
+            vistos.append(t)
+    return vistos
+
+
+def _nombre_motorista(motorista):
+    usuario = getattr(motorista, 'usuario', None) if motorista else None
+    if not usuario:
+        return ''
+    return f"{usuario.nombre or ''} {usuario.apellido or ''}".strip()
+
+
+def _filas(despachos, locales):
+    from ..models import BusquedaDespacho, BusquedaToken
+    filas, toks = [], []
+    for d in despachos:
+        fila = BusquedaDespacho(
+            despacho_id=d.id,
+            codigo_despacho=d.codigo_despacho,
+            local_id=d.farmacia_origen_local_id,
+            local_nombre=locales.get(d.farmacia_origen_local_id),
+            motorista_id=d.motorista_id,
+            motorista_nombre=_nombre_motorista(d.motorista),
+            cliente_nombre=d.cliente_nombre,
+            estado=d.estado,
+            tipo_despacho=d.tipo_despacho,
+            prioridad=d.prioridad,
+            fecha_registro=d.fecha_registro,
+        )
+        filas.append(fila)
+        for campo, texto in (('L', fila.local_nombre), ('M', fila.motorista_nombre), ('C', fila.cliente_nombre)):
+            toks.extend(BusquedaToken(despacho_id=d.id, campo=campo, token=t) for t in tokens(texto))
+    return filas, toks
+
+
+def indexar_despachos(ids=None, lote=BUSQUEDA_LOTE):
+    """
+    (Re)indexa los despachos `ids` (todos si es None) por lotes
+
+    Returns:
+        cantidad de despachos indexados
+    """
+    from ..models import BusquedaDespacho, BusquedaToken, Despacho, Localfarmacia
+    qs = Despacho.objects.select_related('motorista__usuario').order_by('id')
+    if ids is not None:
+        ids = sorted({int(i) for i in ids if i})
+        if not ids:
+            return 0
+    total = 0
+    ultimo = 0
+    while True:
+        if ids is not None:
+            bloque = ids[total:total + lote]
+            if not bloque:
+                break
+            despachos = list(qs.filter(id__in=bloque))
+            borrar = bloque
+        else:
+            despachos = list(qs.filter(id__gt=ultimo)[:lote])
+            if not despachos:
+                break
+            ultimo = despachos[-1].id
+            borrar = [d.id for d in despachos]
+        locales = dict(
+            Localfarmacia.objects.filter(local_id__in={d.farmacia_origen_local_id for d in despachos}).values_list('local_id', 'local_nombre')
+        )
+        filas, toks = _filas(despachos, locales)
+        with transaction.atomic():
+            # Borrar e insertar: los despachos eliminados también salen del índice
+            BusquedaToken.objects.filter(despacho_id__in=borrar).delete()
+            BusquedaDespacho.objects.filter(despacho_id__in=borrar).delete()
+            BusquedaDespacho.objects.bulk_create(filas)
+            BusquedaToken.objects.bulk_create(toks)
+        total += len(borrar) if ids is not None else len(despachos)
+    return total
+
+
+def indexar_al_confirmar(ids):
+    """Reindexa `ids` cuando la transacción actual haga commit."""
+    ids = list(ids)
+
+    def _indexar():
+        try:
+            indexar_despachos(ids)
+        except Exception:
+            logger.exception('No se pudo indexar %s despachos para consulta rápida', len(ids))
+    transaction.on_commit(_indexar)
+
+
+def _reemplazar_tokens(filtro, campo, texto):
+    from ..models import BusquedaDespacho, BusquedaToken
+    ids = list(BusquedaDespacho.objects.filter(**filtro).values_list('despacho_id', flat=True))
+    if not ids:
+        return 0
+    nuevos = tokens(texto)
+    with transaction.atomic():
+        BusquedaToken.objects.filter(despacho_id__in=ids, campo=campo).delete()
+        BusquedaToken.objects.bulk_create(
+            [BusquedaToken(despacho_id=i, campo=campo, token=t) for i in ids for t in nuevos], batch_size=BUSQUEDA_LOTE
+        )
+    return len(ids)
+
+
+def renombrar_farmacia(local_id, local_nombre):
+    """Propaga un cambio de nombre de farmacia a las filas ya indexadas."""
+    from ..models import BusquedaDespacho
+    BusquedaDespacho.objects.filter(local_id=local_id).exclude(local_nombre=local_nombre).update(local_nombre=local_nombre)
+    return _reemplazar_tokens({'local_id': local_id}, 'L', local_nombre)
+
+
+def renombrar_motorista(motorista_id, nombre):
+    """Propaga un cambio de nombre/apellido del usuario de un motorista."""
+    from ..models import BusquedaDespacho
+    BusquedaDespacho.objects.filter(motorista_id=motorista_id).exclude(motorista_nombre=nombre).update(motorista_nombre=nombre)
+    return _reemplazar_tokens({'motorista_id': motorista_id}, 'M', nombre)
+
+
+def codificar_cursor(fila):
+    return f"{fila.fecha_registro.isoformat()}~{fila.despacho_id}"
+
+
+def decodificar_cursor(cursor):
+    """(fecha_registro, despacho_id) o None si el cursor no es válido."""
+    try:
+        # Un '+' del offset sin codificar llega como espacio en la query string
+        fecha, pk = (cursor or '').replace(' ', '+').rsplit('~', 1)
+        return datetime.fromisoformat(fecha), int(pk)
+    except (TypeError, ValueError):
+        return None
+
+
+def buscar(local='', motorista='', cliente='', despues=None, limite=BUSQUEDA_PAGINA):
+    """
+    Consulta rápida sobre el índice, de la más reciente a la más antigua
+
+    Cada palabra de cada campo debe coincidir como prefijo de alguna palabra
+    del nombre indexado (sin tildes ni mayúsculas).
+
+    Args:
+        despues: cursor devuelto por la página anterior
+
+    Returns:
+        (filas, siguiente_cursor); filas son BusquedaDespacho, siguiente_cursor es None en la última página
+    """
+    from ..models import BusquedaDespacho, BusquedaToken
+    qs = BusquedaDespacho.objects.all()
+    for campo, texto in (('L', local), ('M', motorista), ('C', cliente)):
+        for t in tokens(texto)[:TOKENS_CONSULTA_MAX]:
+            qs = qs.filter(despacho_id__in=BusquedaToken.objects.filter(campo=campo, token__istartswith=t).values('despacho_id'))
+    pos = decodificar_cursor(despues)
+    if pos:
+        fecha, pk = pos
+        qs = qs.filter(Q(fecha_registro__lt=fecha) | Q(fecha_registro=fecha, despacho_id__lt=pk))
+    filas = list(qs.order_by('-fecha_registro', '-despacho_id')[:limite + 1])
+    siguiente = codificar_cursor(filas[limite - 1]) if len(filas) > limite else None
+    return filas[:limite], siguiente
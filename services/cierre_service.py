@@ -0,0 +1,177 @@
+"""Cierre del día de operadora: archivo incremental + resumen compacto en cierre_dia.
+
+El archivo media/reportes/cierre_YYYY-MM-DD.json sigue siendo un array JSON de
+filas (el export 'despachos_activos' lo lee tal cual), pero se escribe fila a
+fila y los cierres repetidos solo agregan los despachos con id mayor al
+checkpoint guardado en cierre_dia.ultimo_despacho_id. La fila de cierre_dia
+queda bloqueada mientras se escribe el archivo, así que dos cierres
+simultáneos del mismo día se serializan.
+"""
+import json
+import logging
+import os
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from ..repositories import filtro_periodo
+from .reportes_service import EXPORT_CHUNK_SIZE, _filas_despacho_detalle, media_root
+
+logger = logging.getLogger('appnproylogico')
+
+
+def archivo_cierre(fecha):
+    return media_root() / 'reportes' / f"cierre_{fecha.strftime('%Y-%m-%d')}.json"
+
+
+def _dump(fila):
+    return json.dumps(fila, ensure_ascii=False).encode('utf-8')
+
+
+def _reescribir(path, filas):
+    """Escribe el array completo en un temporal y lo reemplaza de forma atómica."""
+    tmp = path.with_suffix('.json.tmp')
+    n = 0
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(b'[')
+            for fila in filas:
+                f.write((b',' if n else b'') + _dump(fila))
+                n += 1
+            f.write(b']')
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+    return n
+
+
+def _anexar(path, filas):
+    """
+    Agrega filas antes del ']' final del array existente; None si el archivo no es un array válido
+
+    Si `filas` falla a mitad de camino el archivo vuelve a su largo anterior y la excepción se propaga.
+    """
+    with open(path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        largo = f.tell()
+        if largo < 2:
+            return None
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b']':
+            return None
+        f.seek(-2, os.SEEK_END)
+        vacio = f.read(1) == b'['
+        f.seek(largo - 1)
+        f.truncate()
+        n = 0
+        try:
+            for fila in filas:
+                f.write((b'' if (vacio and not n) else b',') + _dump(fila))
+                n += 1
+        except BaseException:
+            f.seek(largo - 1)
+            f.truncate()
+            f.write(b']')
+            raise
+        f.write(b']')
+    return n
+
+
+def resumen_dia(fecha):
+    """Conteos del día por farmacia en una consulta agregada + mapa de nombres de farmacia."""
+    from ..models import Despacho, Localfarmacia
+    agg = list(
+        Despacho.objects.filter(**filtro_periodo('fecha_registro', fecha=fecha))
+        .values('farmacia_origen_local_id')
+        .annotate(
+            total=Count('id'),
+            entregados=Count('id', filter=Q(estado='ENTREGADO')),
+            fallidos=Count('id', filter=Q(estado='FALLIDO')),
+            en_camino=Count('id', filter=Q(estado='EN_CAMINO')),
+            pendientes=Count('id', filter=Q(estado='PENDIENTE')),
+            anulados=Count('id', filter=Q(estado='ANULADO')),
+            con_receta=Count('id', filter=Q(tiene_receta_retenida=True)),
+            con_incidencias=Count('id', filter=Q(hubo_incidencia=True)),
+        )
+        .order_by()
+    )
+    nombres = dict(
+        Localfarmacia.objects.filter(local_id__in={a['farmacia_origen_local_id'] for a in agg}).values_list('local_id', 'local_nombre')
+    )
+    campos = ('total', 'entregados', 'fallidos', 'en_camino', 'pendientes', 'anulados', 'con_receta', 'con_incidencias')
+    totales = {c: sum(a[c] for a in agg) for c in campos}
+    por_farmacia = {
+        (a['farmacia_origen_local_id'] or ''): {
+            'nombre': nombres.get(a['farmacia_origen_local_id']) or a['farmacia_origen_local_id'] or '',
+            'total': a['total'],
+            'entregados': a['entregados'],
+            'fallidos': a['fallidos'],
+        }
+        for a in agg
+    }
+    return totales, por_farmacia
+
+
+def cerrar_dia(fecha, usuario=None, since=None):
+    """
+    Genera o actualiza el cierre de `fecha`
+
+    Args:
+        since: id de despacho desde el que agregar filas. None usa el checkpoint
+            guardado; 0 (o un id anterior al checkpoint) reescribe el archivo completo
+
+    Returns:
+        (cierre, filas_nuevas)
+    """
+    from ..models import CierreDia
+    with transaction.atomic():
+        # Bloquea el cierre del día hasta terminar de escribir: otro cierre concurrente espera aquí
+        cierre, _ = CierreDia.objects.select_for_update().get_or_create(fecha=fecha)
+        return _cerrar(cierre, fecha, usuario, since)
+
+
+def _cerrar(cierre, fecha, usuario, since):
+    from ..models import Despacho
+    path = archivo_cierre(fecha)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    desde = cierre.ultimo_despacho_id if since is None else max(int(since), 0)
+    if not path.exists() or desde < cierre.ultimo_despacho_id:
+        # Evita duplicar filas ya escritas
+        desde = 0
+    ultimo = {'id': desde}
+    sin_codigo = []
+
+    def filas(desde_id):
+        qs = (
+            Despacho.objects.filter(**filtro_periodo('fecha_registro', fecha=fecha), id__gt=desde_id)
+            .select_related('motorista__usuario')
+            .order_by('id')
+        )
+        for d in qs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            if not (d.codigo_despacho or '').strip():
+                # Código estable basado en el id para no chocar con los códigos secuenciales
+                d.codigo_despacho = f"DSP-{fecha.strftime('%Y%m%d')}-C{d.id}"[:20]
+                sin_codigo.append(d)
+            ultimo['id'] = d.id
+            yield _filas_despacho_detalle(d)
+
+    nuevas = _anexar(path, filas(desde)) if desde else None
+    if nuevas is None:
+        if desde:
+            logger.warning('Archivo de cierre %s inválido; se reescribe completo', path.name)
+        nuevas = _reescribir(path, filas(0))
+        cierre.filas_archivo = 0
+    if sin_codigo:
+        Despacho.objects.bulk_update(sin_codigo, ['codigo_despacho'])
+
+    totales, por_farmacia = resumen_dia(fecha)
+    for campo, valor in totales.items():
+        setattr(cierre, campo, valor)
+    cierre.por_farmacia = por_farmacia
+    cierre.ultimo_despacho_id = ultimo['id']
+    cierre.filas_archivo += nuevas
+    cierre.archivo = path.name
+    cierre.usuario = usuario
+    cierre.save()
+    return cierre, nuevas
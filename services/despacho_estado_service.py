@@ -0,0 +1,153 @@
+"""Máquina de estados de Despacho: valida y aplica transiciones con bloqueo de fila.
+
+Todas las transiciones de un lote se aplican en una sola transacción: los
+despachos se bloquean con select_for_update (en orden de id para evitar
+interbloqueos), y los MovimientoDespacho y AuditoriaGeneral se insertan con
+bulk_create al final.
+"""
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger('appnproylogico')
+
+TRANSICIONES = {
+    'PENDIENTE': {'ASIGNADO', 'ANULADO'},
+    'ASIGNADO': {'PREPARANDO', 'ANULADO'},
+    'PREPARANDO': {'PREPARADO', 'ANULADO'},
+    'PREPARADO': {'EN_CAMINO', 'ANULADO'},
+    'EN_CAMINO': {'ENTREGADO', 'FALLIDO'},
+}
+
+CAMPOS_TRANSICION = ['estado', 'usuario_modificacion', 'fecha_modificacion']
+
+
+def validar_transicion(estado_actual, nuevo, tipo_despacho, receta_retenida, receta_devuelta):
+    """Devuelve (ok, motivo) según el mapa de transiciones y la regla de receta retenida."""
+    ea = (estado_actual or '').strip().upper()
+    nv = (nuevo or '').strip().upper()
+    td = (tipo_despacho or '').strip().upper()
+    if nv not in TRANSICIONES.get(ea, set()):
+        return False, 'Transición de estado no permitida'
+    if td == 'REENVIO_RECETA' and nv == 'PREPARADO':
+        if not (receta_retenida and receta_devuelta):
+            return False, 'Receta retenida requiere devolución antes de PREPARADO'
+    return True, ''
+
+
+def _normalizar_item(item):
+    """Ítem con codigo/estado/observacion/mensaje; 'error' no vacío si no se puede aplicar."""
+    if isinstance(item, dict):
+        valores = [item.get('codigo') or item.get('codigo_despacho'), item.get('estado'), item.get('observacion'), item.get('mensaje')]
+    elif isinstance(item, (list, tuple)) and len(item) >= 2:
+        valores = [item[0], item[1], None, None]
+    else:
+        return {'codigo': '', 'estado': '', 'observacion': '', 'mensaje': '', 'error': 'Ítem inválido: se espera {codigo, estado} o [codigo, estado]'}
+    valores = [v or '' for v in valores]
+    if not all(isinstance(v, str) for v in valores):
+        return {'codigo': str(valores[0]), 'estado': str(valores[1]), 'observacion': '', 'mensaje': '', 'error': 'Código, estado, observación y mensaje deben ser texto'}
+    codigo, estado, observacion, mensaje = (v.strip() for v in valores)
+    return {'codigo': codigo, 'estado': estado.upper(), 'observacion': observacion, 'mensaje': mensaje, 'error': ''}
+
+
+class DespachoStateMachine:
+    """Aplica transiciones de estado de despachos en nombre de `usuario` (modelo Usuario)."""
+
+    def __init__(self, usuario):
+        # movimiento_despacho.usuario_id es NOT NULL: sin Usuario no se puede registrar nada
+        if usuario is None:
+            raise ValueError('Se requiere el Usuario que registra los movimientos')
+        self.usuario = usuario
+
+    def aplicar(self, codigo, estado, observacion='', mensaje=''):
+        """Una transición; devuelve el resultado del ítem (ver apply_transitions)."""
+        return self.apply_transitions([{'codigo': codigo, 'estado': estado, 'observacion': observacion, 'mensaje': mensaje}])[0]
+
+    def apply_transitions(self, items):
+        """
+        Aplica varias transiciones en una transacción
+
+        Args:
+            items: dicts {'codigo', 'estado', 'observacion', 'mensaje'} o pares (codigo, estado);
+                un ítem mal formado solo falla él, con su error en el resultado
+
+        Returns:
+            lista (en el orden de entrada) de dicts
+            {'codigo', 'ok', 'estado_anterior', 'estado', 'error'}
+        """
+        from ..models import AuditoriaGeneral, Despacho, MovimientoDespacho
+        from ..repositories import invalidar_despachos_activos
+        from .busqueda_service import indexar_al_confirmar
+        from .rutas_service import replanificar_al_confirmar
+        from .eventos_service import evento_despacho, publicar_evento
+
+        items = [_normalizar_item(i) for i in items]
+        resultados = []
+        if not items:
+            return resultados
+        ahora = timezone.now()
+        with transaction.atomic():
+            codigos = {i['codigo'] for i in items if i['codigo'] and not i['error']}
+            despachos = {
+                d.codigo_despacho: d
+                for d in Despacho.objects.select_for_update().filter(codigo_despacho__in=codigos).order_by('id')
+            }
+            movimientos, auditorias, cambiados = [], [], {}
+            # Estado previo al lote, para el evento de cada despacho cambiado
+            anteriores = {}
+            for item in items:
+                res = {'codigo': item['codigo'], 'ok': False, 'estado_anterior': None, 'estado': item['estado'], 'error': ''}
+                resultados.append(res)
+                if item['error']:
+                    res['error'] = item['error']
+                    continue
+                d = despachos.get(item['codigo'])
+                if not d:
+                    res['error'] = 'Despacho no encontrado'
+                    continue
+                anterior = (d.estado or '').strip().upper()
+                res['estado_anterior'] = anterior
+                ok, motivo = validar_transicion(anterior, item['estado'], d.tipo_despacho, d.tiene_receta_retenida, d.receta_devuelta_farmacia)
+                if not ok:
+                    res['error'] = motivo
+                    continue
+                # El estado en memoria avanza: un mismo código puede encadenar transiciones en el lote
+                d.estado = item['estado']
+                d.usuario_modificacion = self.usuario
+                d.fecha_modificacion = ahora
+                cambiados[d.id] = d
+                anteriores.setdefault(d.id, anterior)
+                movimientos.append(MovimientoDespacho(
+                    despacho=d,
+                    estado_anterior=anterior,
+                    estado_nuevo=item['estado'],
+                    fecha_movimiento=ahora,
+                    usuario=self.usuario,
+                    observacion=item['observacion'] or None,
+                ))
+                auditorias.append(AuditoriaGeneral(
+                    nombre_tabla='movimiento_despacho',
+                    id_registro_afectado=str(d.id),
+                    tipo_operacion='MOV',
+                    usuario=self.usuario,
+                    fecha_evento=ahora,
+                    datos_antiguos={'estado': anterior},
+                    datos_nuevos={'estado': item['estado'], 'mensaje': item['mensaje']},
+                ))
+                res['ok'] = True
+            if cambiados:
+                if len(cambiados) == 1:
+                    next(iter(cambiados.values())).save(update_fields=CAMPOS_TRANSICION)
+                else:
+                    # bulk_update no emite post_save: read model, índice de búsqueda y rutas van explícitos
+                    Despacho.objects.bulk_update(list(cambiados.values()), CAMPOS_TRANSICION)
+                    transaction.on_commit(invalidar_despachos_activos)
+                    indexar_al_confirmar(cambiados)
+                    replanificar_al_confirmar({d.motorista_id for d in cambiados.values()})
+                MovimientoDespacho.objects.bulk_create(movimientos)
+                AuditoriaGeneral.objects.bulk_create(auditorias)
+                for d in cambiados.values():
+                    publicar_evento(evento_despacho(d, estado_anterior=anteriores[d.id]))
+        logger.info('Transiciones aplicadas: %s de %s', sum(1 for r in resultados if r['ok']), len(resultados))
+        return resultados
@@ -0,0 +1,214 @@
+"""Publicación de cambios de despachos y avisos hacia los paneles en tiempo real.
+
+Las vistas publican con `publicar_evento(...)` y el evento sale recién cuando la
+transacción hace commit. El bus por defecto es en memoria (un proceso ASGI); con
+settings.EVENTOS_BACKEND='redis' se usa Redis pub/sub para varios procesos.
+Los suscriptores pueden ser corutinas (SSE bajo ASGI) o hilos (runserver/WSGI).
+"""
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger('appnproylogico')
+
+CANAL_EVENTOS = 'appnproylogico:eventos'
+EVENTOS_COLA_MAX = 200
+
+
+class Suscripcion:
+    """Cola acotada de un cliente; si se llena se descartan los eventos más viejos."""
+
+    def __init__(self, bus, loop=None):
+        self.bus = bus
+        self.loop = loop
+        self.cola = asyncio.Queue(EVENTOS_COLA_MAX) if loop else queue.Queue(EVENTOS_COLA_MAX)
+
+    def entregar(self, evento):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._poner, evento)
+        else:
+            self._poner(evento)
+
+    def _poner(self, evento):
+        try:
+            self.cola.put_nowait(evento)
+        except (asyncio.QueueFull, queue.Full):
+            try:
+                self.cola.get_nowait()
+            except (asyncio.QueueEmpty, queue.Empty):
+                pass
+            self.cola.put_nowait(evento)
+
+    async def siguiente(self, timeout):
+        try:
+            return await asyncio.wait_for(self.cola.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def siguiente_sync(self, timeout):
+        try:
+            return self.cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def cerrar(self):
+        self.bus.desuscribir(self)
+
+
+class BusMemoria:
+    """Fanout en proceso: cada evento se copia a la cola de cada suscriptor."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._suscripciones = set()
+        self._ids = itertools.count(1)
+
+    def publicar(self, evento):
+        evento = dict(evento, id=next(self._ids))
+        self._repartir(evento)
+
+    def _repartir(self, evento):
+        with self._lock:
+            destinos = list(self._suscripciones)
+        for s in destinos:
+            try:
+                s.entregar(evento)
+            except RuntimeError:
+                # Loop del cliente ya cerrado
+                self.desuscribir(s)
+
+    def suscribir(self, loop=None):
+        s = Suscripcion(self, loop)
+        with self._lock:
+            self._suscripciones.add(s)
+        return s
+
+    def desuscribir(self, s):
+        with self._lock:
+            self._suscripciones.discard(s)
+
+    @property
+    def suscriptores(self):
+        return len(self._suscripciones)
+
+
+class BusRedis(BusMemoria):
+    """Publica en un canal Redis; un hilo por proceso reparte a los suscriptores locales."""
+
+    def __init__(self, url):
+        import redis
+        super().__init__()
+        self._redis = redis.Redis.from_url(url)
+        self._oyente = None
+
+    def publicar(self, evento):
+        self._redis.publish(CANAL_EVENTOS, json.dumps(evento, default=str))
+
+    def suscribir(self, loop=None):
+        if self._oyente is None:
+            with self._lock:
+                if self._oyente is None:
+                    self._oyente = threading.Thread(target=self._escuchar, name='eventos-redis', daemon=True)
+                    self._oyente.start()
+        return super().suscribir(loop)
+
+    def _escuchar(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CANAL_EVENTOS)
+        for msg in pubsub.listen():
+            try:
+                evento = json.loads(msg['data'])
+            except Exception:
+                continue
+            self._repartir(dict(evento, id=next(self._ids)))
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def obtener_bus():
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                if getattr(settings, 'EVENTOS_BACKEND', 'memoria') == 'redis':
+                    _bus = BusRedis(settings.EVENTOS_REDIS_URL)
+                else:
+                    _bus = BusMemoria()
+    return _bus
+
+
+def evento_despacho(despacho, tipo='despacho', **extra):
+    """Delta mínimo de un despacho para los paneles."""
+    return {
+        'tipo': tipo,
+        'despacho_id': despacho.id,
+        'codigo': despacho.codigo_despacho,
+        'estado': despacho.estado,
+        'farmacia': despacho.farmacia_origen_local_id,
+        'receta_devuelta': bool(despacho.receta_devuelta_farmacia),
+        **extra,
+    }
+
+
+def publicar_evento(evento):
+    """Publica `evento` cuando la transacción actual haga commit (o de inmediato si no hay)."""
+    def _enviar():
+        try:
+            obtener_bus().publicar(evento)
+        except Exception:
+            logger.exception('No se pudo publicar el evento %s', evento.get('tipo'))
+    transaction.on_commit(_enviar)
+
+
+def formato_sse(evento):
+    return f"id: {evento.get('id', '')}\nevent: {evento.get('tipo', 'mensaje')}\ndata: {json.dumps(evento, default=str)}\n\n"
+
+
+def _filtrar(evento, tipos):
+    return not tipos or evento.get('tipo') in tipos
+
+
+async def stream_sse(tipos=None, keepalive=15, duracion=300):
+    """Flujo SSE asíncrono (ASGI): no ocupa un hilo mientras espera eventos."""
+    s = obtener_bus().suscribir(loop=asyncio.get_running_loop())
+    fin = time.monotonic() + duracion
+    try:
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < fin:
+            evento = await s.siguiente(keepalive)
+            if evento is None:
+                yield ': keepalive\n\n'
+            elif _filtrar(evento, tipos):
+                yield formato_sse(evento)
+    finally:
+        s.cerrar()
+
+
+def stream_sse_sync(tipos=None, keepalive=15, duracion=300):
+    """
+    Variante con hilo para runserver/WSGI; se corta a los `duracion` segundos y el navegador reconecta
+
+    Cada conexión ocupa un hilo del servidor todo ese tiempo: la vista usa
+    EVENTOS_SSE_SYNC_MAX_SECONDS, más corto que el de ASGI.
+    """
+    s = obtener_bus().suscribir()
+    fin = time.monotonic() + duracion
+    try:
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < fin:
+            evento = s.siguiente_sync(keepalive)
+            if evento is None:
+                yield ': keepalive\n\n'
+            elif _filtrar(evento, tipos):
+                yield formato_sse(evento)
+    finally:
+        s.cerrar()
@@ -0,0 +1,260 @@
+"""Importación masiva de farmacias (CSV/TSV/XLSX/XLS) por conjuntos.
+
+Las filas se leen de forma incremental y se validan con
+repositories.iter_farmacias_import. Los local_id existentes y los ids de
+región/comuna/localidad se precargan una vez al inicio; las farmacias nuevas
+entran con bulk_create por lotes y, en modo upsert, las existentes que
+cambiaron se actualizan con bulk_update.
+"""
+import csv
+import io
+import itertools
+import logging
+import re
+from datetime import date, datetime, time
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+
+from ..repositories import invalidar_metricas_dashboard, iter_farmacias_import
+
+logger = logging.getLogger('appnproylogico')
+
+IMPORT_BATCH_SIZE = 500
+MENSAJES_MAX = 50
+FORMATOS_IMPORTACION = ('.csv', '.tsv', '.xlsx', '.xls')
+REQUERIDOS = ('local_id', 'local_nombre', 'local_direccion', 'comuna_nombre')
+# Campos que el upsert compara y actualiza
+CAMPOS_UPSERT = [
+    'local_nombre', 'local_direccion', 'comuna_nombre', 'localidad_nombre', 'fk_region', 'fk_comuna', 'fk_localidad',
+    'funcionamiento_hora_apertura', 'funcionamiento_hora_cierre', 'funcionamiento_dia', 'local_telefono',
+    'local_lat', 'local_lng', 'geolocalizacion_validada', 'fecha',
+]
+
+_NO_TELEFONO = re.compile(r'[^0-9+]')
+_NO_DIGITO = re.compile(r'[^0-9]')
+_COORD = Decimal('0.0000001')
+
+
+def _tabla_csv(texto, tsv=False):
+    primera = texto.readline()
+    sep = '\t' if (tsv or '\t' in primera) else ','
+    yield from csv.reader(itertools.chain([primera], texto), delimiter=sep)
+
+
+def _tablas_archivo(fichero):
+    name = fichero.name.lower()
+    if name.endswith('.csv') or name.endswith('.tsv'):
+        fichero.seek(0)
+        texto = io.TextIOWrapper(fichero.file, encoding='utf-8', errors='ignore', newline='')
+        try:
+            yield _tabla_csv(texto, tsv=name.endswith('.tsv'))
+        finally:
+            # No cerrar el archivo subido junto con el wrapper
+            texto.detach()
+    elif name.endswith('.xlsx'):
+        import openpyxl
+        wb = openpyxl.load_workbook(fichero, read_only=True, data_only=True)
+        try:
+            for sheet in wb.worksheets:
+                yield sheet.iter_rows(values_only=True)
+        finally:
+            wb.close()
+    elif name.endswith('.xls'):
+        import xlrd
+        book = xlrd.open_workbook(file_contents=fichero.read(), on_demand=True)
+        try:
+            for i in range(book.nsheets):
+                sh = book.sheet_by_index(i)
+                yield (sh.row_values(r) for r in range(sh.nrows))
+                book.unload_sheet(i)
+        finally:
+            book.release_resources()
+    else:
+        raise ValueError('Formato no soportado. Usa CSV/TSV/XLSX/XLS.')
+
+
+def iter_tablas(csv_text=None, fichero=None):
+    """Tablas (encabezado + filas) del texto pegado o de cada hoja del archivo subido."""
+    if csv_text:
+        return iter([_tabla_csv(io.StringIO(csv_text))])
+    if fichero:
+        return _tablas_archivo(fichero)
+    return iter(())
+
+
+def _hora(valor, defecto):
+    for fmt in ('%H:%M:%S', '%H:%M'):
+        try:
+            return datetime.strptime(valor, fmt).time()
+        except ValueError:
+            pass
+    return defecto
+
+
+def _fecha(valor, hoy):
+    if not valor:
+        return hoy
+    for fmt in ('%d-%m-%y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%d-%m-%Y', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(valor, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f'fecha inválida {valor!r}')
+
+
+def _coordenada(valor):
+    try:
+        return Decimal(valor).quantize(_COORD) if valor else None
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def _telefono(valor):
+    tel = _NO_TELEFONO.sub('', valor or '')
+    if tel == '+56' or len(_NO_DIGITO.sub('', tel)) < 7:
+        return None
+    return tel
+
+
+def _fk(valor, ids):
+    """Id de la FK si existe en `ids` (precargados); None si no viene o no existe."""
+    try:
+        pk = int(float(valor)) if valor else None
+    except ValueError:
+        return None
+    return pk if pk in ids else None
+
+
+def campos_farmacia(item, fks, hoy):
+    """Valores de modelo para una fila validada; ValueError si la fila no es importable."""
+    faltan = [k for k in REQUERIDOS if not item.get(k)]
+    if faltan:
+        raise ValueError(f'faltan {", ".join(faltan)}')
+    regiones, comunas, localidades = fks
+    lat = _coordenada(item['local_lat'])
+    lng = _coordenada(item['local_lng'])
+    return {
+        'local_nombre': item['local_nombre'],
+        'local_direccion': item['local_direccion'],
+        'comuna_nombre': item['comuna_nombre'],
+        'localidad_nombre': item['localidad_nombre'],
+        'fk_region_id': _fk(item['fk_region'], regiones),
+        'fk_comuna_id': _fk(item['fk_comuna'], comunas),
+        'fk_localidad_id': _fk(item['fk_localidad'], localidades),
+        'funcionamiento_hora_apertura': _hora(item['funcionamiento_hora_apertura'], time(9, 0)),
+        'funcionamiento_hora_cierre': _hora(item['funcionamiento_hora_cierre'], time(21, 0)),
+        'funcionamiento_dia': item['funcionamiento_dia'] or 'lunes',
+        'local_telefono': _telefono(item['local_telefono']),
+        'local_lat': lat,
+        'local_lng': lng,
+        'geolocalizacion_validada': lat is not None and lng is not None,
+        'fecha': _fecha(item['fecha'], hoy),
+    }
+
+
+def _crear_lote(objs, resumen):
+    """bulk_create del lote; si falla, fila a fila para aislar las filas con error."""
+    from ..models import Localfarmacia
+    try:
+        Localfarmacia.objects.bulk_create(objs)
+        resumen['creados'] += len(objs)
+    except Exception:
+        for obj in objs:
+            try:
+                obj.save()
+                resumen['creados'] += 1
+            except Exception as e:
+                _error(resumen, f'Fila con error local_id={obj.local_id}: {e}')
+
+
+def _error(resumen, mensaje):
+    resumen['errores'] += 1
+    if len(resumen['mensajes']) < MENSAJES_MAX:
+        resumen['mensajes'].append(mensaje)
+
+
+def importar_farmacias(tablas, usuario=None, upsert=False, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Importa farmacias desde `tablas` (ver iter_tablas)
+
+    Args:
+        upsert: actualizar las farmacias existentes que cambiaron; si es False se saltan
+
+    Returns:
+        dict con creados, actualizados, sin_cambios, duplicados, errores y mensajes
+    """
+    from ..models import Comuna, Localfarmacia, Localidad, Region
+    from .busqueda_service import renombrar_farmacia
+    from .geo_service import invalidar_indice_geo
+
+    resumen = {'creados': 0, 'actualizados': 0, 'sin_cambios': 0, 'duplicados': 0, 'errores': 0, 'mensajes': []}
+    if upsert:
+        existentes = {k.upper(): v for k, v in Localfarmacia.objects.only('local_id', *CAMPOS_UPSERT).in_bulk(field_name='local_id').items()}
+    else:
+        existentes = {k.upper(): None for k in Localfarmacia.objects.values_list('local_id', flat=True)}
+    fks = (
+        set(Region.objects.values_list('id', flat=True)),
+        set(Comuna.objects.values_list('id', flat=True)),
+        set(Localidad.objects.values_list('id', flat=True)),
+    )
+    ahora = timezone.now()
+    hoy = date.today()
+    nuevos, cambiados, renombradas = [], [], []
+    vistos = set()
+    try:
+        for tabla in tablas:
+            for item in iter_farmacias_import(tabla, incluir_duplicados=True):
+                clave = item['local_id'].upper()
+                if clave in vistos:
+                    resumen['duplicados'] += 1
+                    if len(resumen['mensajes']) < MENSAJES_MAX:
+                        resumen['mensajes'].append(f'Duplicado en el archivo local_id={item["local_id"]}')
+                    continue
+                vistos.add(clave)
+                try:
+                    campos = campos_farmacia(item, fks, hoy)
+                except ValueError as e:
+                    _error(resumen, f'Fila inválida local_id={item["local_id"] or "?"}: {e}')
+                    continue
+                if clave not in existentes:
+                    nuevos.append(Localfarmacia(
+                        local_id=item['local_id'], activo=True, fecha_creacion=ahora, fecha_modificacion=ahora,
+                        usuario_modificacion=usuario, **campos,
+                    ))
+                    if len(nuevos) >= batch_size:
+                        _crear_lote(nuevos, resumen)
+                        nuevos = []
+                    continue
+                obj = existentes[clave]
+                if obj is None:
+                    resumen['duplicados'] += 1
+                    if len(resumen['mensajes']) < MENSAJES_MAX:
+                        resumen['mensajes'].append(f'Duplicado saltado local_id={item["local_id"]}')
+                    continue
+                diff = {k: v for k, v in campos.items() if getattr(obj, k) != v}
+                if not diff:
+                    resumen['sin_cambios'] += 1
+                    continue
+                if 'local_nombre' in diff:
+                    renombradas.append(obj)
+                for k, v in diff.items():
+                    setattr(obj, k, v)
+                obj.fecha_modificacion = ahora
+                obj.usuario_modificacion = usuario
+                cambiados.append(obj)
+        if nuevos:
+            _crear_lote(nuevos, resumen)
+        if cambiados:
+            Localfarmacia.objects.bulk_update(cambiados, CAMPOS_UPSERT + ['fecha_modificacion', 'usuario_modificacion'], batch_size=batch_size)
+            resumen['actualizados'] = len(cambiados)
+    except Exception as e:
+        logger.exception('Error importando farmacias')
+        resumen['mensajes'].append(f'Error al procesar: {e}')
+    # bulk_create/bulk_update no emiten post_save
+    if resumen['creados'] or resumen['actualizados']:
+        invalidar_metricas_dashboard()
+        invalidar_indice_geo('farmacias')
+    for obj in (renombradas if resumen['actualizados'] else []):
+        renombrar_farmacia(obj.local_id, obj.local_nombre)
+    return resumen
@@ -0,0 +1,144 @@
+"""Lectura memoizada de los JSON de respaldo en static/data.
+
+Cada archivo se parsea una vez por proceso y se vuelve a leer solo si cambia
+su mtime. Los datos son compartidos entre requests, por eso se exponen como
+tuplas de mappings de solo lectura (`cargar_lista`), de tuplas (`cargar_filas`,
+para los JSON con filas de vistas) o de registros con __slots__ inmutables
+(`registros`).
+"""
+import json
+import logging
+import pathlib
+import threading
+from types import MappingProxyType
+
+logger = logging.getLogger('appnproylogico')
+
+DATA_DIR = pathlib.Path(__file__).resolve().parents[2] / 'static' / 'data'
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def ruta(nombre):
+    return DATA_DIR / nombre
+
+
+def cargar_json(nombre, default=None):
+    """Contenido de static/data/<nombre>; `default` si no existe o no es JSON válido."""
+    path = ruta(nombre)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return default
+    hit = _cache.get(path)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    with _lock:
+        hit = _cache.get(path)
+        if hit and hit[0] == mtime:
+            return hit[1]
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            logger.warning('No se pudo leer %s', path.name)
+            return default
+        _cache[path] = (mtime, data)
+        return data
+
+
+def contar(nombre, filtro=None):
+    """Cantidad de elementos del JSON (opcionalmente los que cumplen `filtro`)."""
+    data = cargar_json(nombre) or []
+    if filtro is None:
+        return len(data)
+    return sum(1 for d in data if filtro(d))
+
+
+def _memo(clave, nombre, construir):
+    """Cachea `construir(data)` junto al mtime del archivo fuente."""
+    path = ruta(nombre)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return ()
+    hit = _cache.get(clave)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    data = cargar_json(nombre, [])
+    valor = construir(data if isinstance(data, list) else [])
+    _cache[clave] = (mtime, valor)
+    return valor
+
+
+def cargar_lista(nombre):
+    """Elementos del JSON como tupla de mappings de solo lectura (sirven tal cual en templates)."""
+    return _memo(('lista', nombre), nombre, lambda data: tuple(MappingProxyType(dict(d)) for d in data if isinstance(d, dict)))
+
+
+def cargar_filas(nombre):
+    """Elementos del JSON que son listas (p. ej. filas de una vista), como tupla de tuplas."""
+    return _memo(('filas', nombre), nombre, lambda data: tuple(tuple(d) for d in data if isinstance(d, list)))
+
+
+def registros(nombre, tipo):
+    """Elementos del JSON convertidos con `tipo.desde_dict`, como tupla."""
+    return _memo(('registros', nombre, tipo), nombre, lambda data: tuple(tipo.desde_dict(d) for d in data if isinstance(d, dict)))
+
+
+class Registro:
+    """Registro de solo lectura con __slots__; los atributos se fijan al construir."""
+    __slots__ = ()
+
+    def __init__(self, **valores):
+        for campo in self.__slots__:
+            object.__setattr__(self, campo, valores.get(campo))
+
+    def __setattr__(self, campo, valor):
+        raise AttributeError(f'{type(self).__name__} es de solo lectura')
+
+    def __repr__(self):
+        campos = ', '.join(f'{c}={getattr(self, c)!r}' for c in self.__slots__)
+        return f'{type(self).__name__}({campos})'
+
+
+class UsuarioRef(Registro):
+    __slots__ = ('nombre', 'apellido')
+
+
+class MotoristaRef(Registro):
+    __slots__ = ('usuario',)
+
+    def __str__(self):
+        return f"{self.usuario.nombre or ''} {self.usuario.apellido or ''}".strip()
+
+
+class DespachoRef(Registro):
+    __slots__ = ('id',)
+
+
+class MovimientoFixture(Registro):
+    """Fila de movimientos.json con la forma que usa reporte_movimientos."""
+    __slots__ = ('despacho', 'estado_nuevo', 'fecha_movimiento')
+
+    @classmethod
+    def desde_dict(cls, d):
+        return cls(despacho=DespachoRef(id=d.get('despacho_id')), estado_nuevo=d.get('estado_nuevo'), fecha_movimiento=d.get('fecha_movimiento'))
+
+
+class RecetaFixture(Registro):
+    """Fila de recetas_retencion.json con la forma de un Despacho del panel de recetas."""
+    __slots__ = ('codigo_despacho', 'farmacia_origen_local_id', 'motorista', 'cliente_nombre', 'estado', 'fecha_registro')
+
+    @classmethod
+    def desde_dict(cls, d):
+        mot = d.get('motorista') or {}
+        return cls(
+            codigo_despacho=d.get('codigo_despacho'),
+            farmacia_origen_local_id=d.get('farmacia_origen_local_id'),
+            motorista=MotoristaRef(usuario=UsuarioRef(nombre=mot.get('nombre'), apellido=mot.get('apellido'))),
+            cliente_nombre=d.get('cliente_nombre'),
+            estado=d.get('estado'),
+            fecha_registro=d.get('fecha_registro'),
+        )
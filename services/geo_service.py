@@ -0,0 +1,263 @@
+"""Índice espacial en memoria de farmacias y destinos de despachos.
+
+Cada proceso arma una grilla de celdas de GEO_CELDA_GRADOS (~1 km) con los
+puntos precalculados en radianes; una consulta solo evalúa haversine sobre las
+celdas que tocan el radio (o los anillos necesarios para los k más cercanos).
+Si la zona a recorrer tiene más celdas que las ocupadas (consulta lejos de los
+datos o radio enorme) se evalúan directamente las celdas ocupadas.
+La grilla se reconstruye cuando cambia su versión en caché (signals.py la sube
+al crear despachos o cambiar coordenadas) o vence GEO_INDICE_TTL.
+
+El índice de despachos se arma con los despachos no finalizados; como las
+transiciones de estado no lo invalidan, el estado se filtra en la base sobre
+los candidatos de la grilla.
+"""
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger('appnproylogico')
+
+RADIO_TIERRA_KM = 6371.0088
+KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180
+GEO_CELDA_GRADOS = 0.01
+GEO_VERSION_KEYS = {'farmacias': 'geo_farmacias_version', 'despachos': 'geo_despachos_version'}
+ESTADOS_FINALES = ('ENTREGADO', 'FALLIDO', 'ANULADO')
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distancias_km(lat, lng, puntos):
+    """Distancias desde (lat, lng) a cada (lat, lng) de `puntos`, en una pasada."""
+    p, l = math.radians(lat), math.radians(lng)
+    cos_p = math.cos(p)
+    sin, cos, asin, sqrt = math.sin, math.cos, math.asin, math.sqrt
+    out = []
+    for plat, plng in puntos:
+        p2, l2 = math.radians(plat), math.radians(plng)
+        a = sin((p2 - p) / 2) ** 2 + cos_p * cos(p2) * sin((l2 - l) / 2) ** 2
+        out.append(2 * RADIO_TIERRA_KM * asin(min(1.0, sqrt(a))))
+    return out
+
+
+class IndiceGeo:
+    """Grilla lat/lng -> puntos (clave, lat_rad, lng_rad, cos_lat, dato)."""
+
+    def __init__(self, celda=GEO_CELDA_GRADOS):
+        self.celda = celda
+        self.celdas = defaultdict(list)
+        self.posiciones = {}
+        self.n = 0
+        self._limites = None
+
+    def __len__(self):
+        return self.n
+
+    def _celda(self, lat, lng):
+        return math.floor(lat / self.celda), math.floor(lng / self.celda)
+
+    def agregar(self, clave, lat, lng, dato=None):
+        ci, cj = self._celda(lat, lng)
+        p = math.radians(lat)
+        self.celdas[(ci, cj)].append((clave, p, math.radians(lng), math.cos(p), dato))
+        self.posiciones[clave] = (lat, lng)
+        self.n += 1
+        if self._limites is None:
+            self._limites = [ci, ci, cj, cj]
+        else:
+            lim = self._limites
+            lim[0], lim[1], lim[2], lim[3] = min(lim[0], ci), max(lim[1], ci), min(lim[2], cj), max(lim[3], cj)
+
+    def _evaluar(self, lat, lng, claves_celda, filtro, out, radio_km=None):
+        p, l = math.radians(lat), math.radians(lng)
+        cos_p = math.cos(p)
+        sin, asin, sqrt = math.sin, math.asin, math.sqrt
+        celdas = self.celdas
+        for c in claves_celda:
+            for clave, p2, l2, cos2, dato in celdas.get(c, ()):
+                if filtro is not None and not filtro(dato):
+                    continue
+                a = sin((p2 - p) / 2) ** 2 + cos_p * cos2 * sin((l2 - l) / 2) ** 2
+                d = 2 * RADIO_TIERRA_KM * asin(min(1.0, sqrt(a)))
+                if radio_km is None or d <= radio_km:
+                    out.append((d, clave, dato))
+
+    def en_radio(self, lat, lng, radio_km, filtro=None):
+        """[(distancia_km, clave, dato)] dentro de `radio_km`, del más cercano al más lejano."""
+        if not self.n:
+            return []
+        ci, cj = self._celda(lat, lng)
+        di = math.ceil(radio_km / (KM_POR_GRADO * self.celda))
+        dj = math.ceil(radio_km / (KM_POR_GRADO * self.celda * max(math.cos(math.radians(lat)), 0.01)))
+        if (2 * di + 1) * (2 * dj + 1) > len(self.celdas):
+            claves = [c for c in self.celdas if abs(c[0] - ci) <= di and abs(c[1] - cj) <= dj]
+        else:
+            claves = ((i, j) for i in range(ci - di, ci + di + 1) for j in range(cj - dj, cj + dj + 1))
+        out = []
+        self._evaluar(lat, lng, claves, filtro, out, radio_km)
+        out.sort(key=lambda t: t[0])
+        return out
+
+    def cercanos(self, lat, lng, k, filtro=None):
+        """Los `k` puntos más cercanos (que cumplen `filtro`), recorriendo anillos de celdas."""
+        if not self.n or k <= 0:
+            return []
+        ci, cj = self._celda(lat, lng)
+        lim = self._limites
+        anillo_max = max(abs(ci - lim[0]), abs(ci - lim[1]), abs(cj - lim[2]), abs(cj - lim[3]))
+        # Los anillos antes del rectángulo que contiene los datos están vacíos
+        anillo_min = max(lim[0] - ci, ci - lim[1], lim[2] - cj, cj - lim[3], 0)
+        # Distancia mínima garantizada hasta el anillo r+1: r celdas en la dirección más corta
+        km_celda = KM_POR_GRADO * self.celda * min(1.0, max(math.cos(math.radians(lat)), 0.01))
+        out = []
+        for r in range(anillo_min, anillo_max + 1):
+            if (2 * r + 1) ** 2 > len(self.celdas):
+                # Recorrer más anillos cuesta más que evaluar todas las celdas ocupadas
+                out = []
+                self._evaluar(lat, lng, list(self.celdas), filtro, out)
+                break
+            if r == 0:
+                anillo = [(ci, cj)]
+            else:
+                anillo = [(ci + di, cj + dj) for di in range(-r, r + 1) for dj in (-r, r)]
+                anillo += [(ci + di, cj + dj) for di in (-r, r) for dj in range(-r + 1, r)]
+            self._evaluar(lat, lng, anillo, filtro, out)
+            if len(out) >= k:
+                out.sort(key=lambda t: t[0])
+                del out[k:]
+                if out[-1][0] <= r * km_celda:
+                    break
+        out.sort(key=lambda t: t[0])
+        return out[:k]
+
+
+def _version(nombre):
+    key = GEO_VERSION_KEYS[nombre]
+    v = cache.get(key)
+    if v is None:
+        cache.add(key, int(time.time() * 1000), None)
+        v = cache.get(key) or 0
+    return v
+
+
+def invalidar_indice_geo(nombre):
+    """Sube la versión del índice `nombre` ('farmacias' o 'despachos'); cada proceso lo rearma en su próxima consulta."""
+    key = GEO_VERSION_KEYS[nombre]
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), None)
+
+
+def despacho_guardado_geo(pk, lat, lng, estado, created=False):
+    """Invalida el índice de despachos solo si el punto de `pk` pudo cambiar respecto del índice local."""
+    punto = (float(lat), float(lng)) if lat is not None and lng is not None else None
+    hit = _indices.get('despachos')
+    if not created and hit is not None:
+        previo = hit[2].posiciones.get(pk)
+        if previo == punto or (previo is None and (punto is None or estado in ESTADOS_FINALES)):
+            return
+    elif punto is None:
+        return
+    invalidar_indice_geo('despachos')
+
+
+def _construir_farmacias():
+    from ..models import Localfarmacia
+    indice = IndiceGeo()
+    filas = (
+        Localfarmacia.objects.filter(local_lat__isnull=False, local_lng__isnull=False)
+        .values_list('id', 'local_id', 'local_nombre', 'local_direccion', 'local_lat', 'local_lng',
+                     'funcionamiento_hora_apertura', 'funcionamiento_hora_cierre', 'funcionamiento_dia', 'activo')
+    )
+    for pk, local_id, nombre, direccion, lat, lng, apertura, cierre, dia, activo in filas.iterator(chunk_size=5000):
+        indice.agregar(pk, float(lat), float(lng), {
+            'id': pk, 'local_id': local_id, 'local_nombre': nombre, 'local_direccion': direccion,
+            'lat': float(lat), 'lng': float(lng), 'apertura': apertura, 'cierre': cierre,
+            'dia': (dia or '').strip().lower(), 'activo': bool(activo),
+        })
+    return indice
+
+
+def _construir_despachos():
+    from ..models import Despacho
+    indice = IndiceGeo()
+    filas = (
+        Despacho.objects.exclude(estado__in=ESTADOS_FINALES)
+        .filter(destino_lat__isnull=False, destino_lng__isnull=False)
+        .values_list('id', 'destino_lat', 'destino_lng')
+    )
+    for pk, lat, lng in filas.iterator(chunk_size=5000):
+        indice.agregar(pk, float(lat), float(lng))
+    return indice
+
+
+_CONSTRUCTORES = {'farmacias': _construir_farmacias, 'despachos': _construir_despachos}
+_indices = {}
+_lock = threading.Lock()
+
+
+def obtener_indice(nombre):
+    """Índice del proceso para `nombre`, reconstruido si cambió la versión o venció el TTL."""
+    version = _version(nombre)
+    ttl = getattr(settings, 'GEO_INDICE_TTL', 300)
+    hit = _indices.get(nombre)
+    if hit and hit[0] == version and time.monotonic() - hit[1] < ttl:
+        return hit[2]
+    with _lock:
+        hit = _indices.get(nombre)
+        if hit and hit[0] == version and time.monotonic() - hit[1] < ttl:
+            return hit[2]
+        inicio = time.perf_counter()
+        indice = _CONSTRUCTORES[nombre]()
+        _indices[nombre] = (version, time.monotonic(), indice)
+        logger.info('Índice geo %s: %s puntos en %.0f ms', nombre, len(indice), (time.perf_counter() - inicio) * 1000)
+        return indice
+
+
+def farmacia_abierta(f, ahora):
+    """Según activo y horario (cierre <= apertura cruza la medianoche; '24/7' siempre abierta)."""
+    if not f['activo']:
+        return False
+    if '24' in f['dia'] or not (f['apertura'] and f['cierre']):
+        return True
+    hora = ahora.time()
+    if f['apertura'] < f['cierre']:
+        return f['apertura'] <= hora < f['cierre']
+    return hora >= f['apertura'] or hora < f['cierre']
+
+
+def nearest_farmacias(lat, lng, k=5, abiertas=False, ahora=None):
+    """Las `k` farmacias activas más cercanas a (lat, lng); con `abiertas`, solo las abiertas a `ahora`."""
+    from django.utils import timezone
+    ahora = timezone.localtime(ahora) if ahora else timezone.localtime()
+    filtro = (lambda f: farmacia_abierta(f, ahora)) if abiertas else (lambda f: f['activo'])
+    return [
+        dict(f, apertura=str(f['apertura']), cierre=str(f['cierre']), distancia_km=round(d, 3))
+        for d, _, f in obtener_indice('farmacias').cercanos(lat, lng, k, filtro)
+    ]
+
+
+def despachos_en_radio(lat, lng, radio_km=2.0, limite=500):
+    """Despachos no finalizados con destino a `radio_km` de (lat, lng), del más cercano al más lejano."""
+    from ..models import Despacho
+    candidatos = obtener_indice('despachos').en_radio(lat, lng, radio_km)[:limite * 2]
+    if not candidatos:
+        return []
+    distancias = {pk: d for d, pk, _ in candidatos}
+    filas = (
+        Despacho.objects.filter(id__in=distancias).exclude(estado__in=ESTADOS_FINALES)
+        .values('id', 'codigo_despacho', 'estado', 'prioridad', 'farmacia_origen_local_id', 'motorista_id', 'destino_direccion', 'destino_lat', 'destino_lng')
+    )
+    out = [dict(f, destino_lat=float(f['destino_lat']), destino_lng=float(f['destino_lng']), distancia_km=round(distancias[f['id']], 3)) for f in filas]
+    out.sort(key=lambda f: f['distancia_km'])
+    return out[:limite]
@@ -1,54 +1,201 @@
-from openai import OpenAI
+import hashlib
+import json
+import logging
+import time as _time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time
+
 from django.conf import settings
 from django.core.cache import cache
-from datetime import datetime, time
+
+logger = logging.getLogger('appnproylogico')
+
+MODELO_IA = "gpt-4o-mini"  # Modelo más económico para beta
+HORA_CIERRE_DEFAULT = time(20, 0)
+
+
+class ClienteOpenAI:
+    """Cliente real: una llamada a chat.completions por prompt"""
+
+    def __init__(self, api_key=None):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key or settings.OPENAI_API_KEY)
+
+    def completar(self, prompt, timeout=None):
+        response = self.client.chat.completions.create(
+            model=MODELO_IA,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=150,
+            temperature=0.3,
+            timeout=timeout,
+        )
+        return response.choices[0].message.content.strip()
+
+
+class ClienteIALocal:
+    """Cliente sin red para pruebas y benchmarks: respuesta determinista con latencia opcional"""
+
+    def __init__(self, latencia=0.0):
+        self.latencia = latencia
+        self.llamadas = 0
+
+    def completar(self, prompt, timeout=None):
+        self.llamadas += 1
+        if self.latencia:
+            _time.sleep(self.latencia)
+        codigo = ''
+        for linea in prompt.split('\n'):
+            if linea.startswith('DESPACHO:'):
+                codigo = linea.replace('DESPACHO:', '').strip()
+        sugerencia = 'Postergar' if 'Sin tiempo antes del cierre' in prompt else 'Reasignar'
+        return f"Resumen: Incidencia en despacho {codigo} (análisis local)\nSugerencia: {sugerencia}"
+
+
+def crear_cliente_ia():
+    """Cliente según settings.IA_CLIENTE ('openai' por defecto, 'local' para el stub)"""
+    if getattr(settings, 'IA_CLIENTE', 'openai') == 'local':
+        return ClienteIALocal()
+    return ClienteOpenAI()
+
 
 class AnalizadorDespachoIA:
     """Servicio simple de IA para analizar despachos con incidencias"""
-    
-    def __init__(self):
-        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    
+
+    def __init__(self, client=None, max_workers=None, timeout=None, reintentos=None):
+        self.client = client or crear_cliente_ia()
+        self.max_workers = max_workers or int(getattr(settings, 'IA_MAX_WORKERS', 4))
+        self.timeout = timeout or float(getattr(settings, 'IA_TIMEOUT_SECONDS', 20))
+        self.reintentos = reintentos if reintentos is not None else int(getattr(settings, 'IA_REINTENTOS', 2))
+
     def analizar_incidencia(self, despacho):
         """
         Analiza un despacho con incidencia y sugiere acción
-        
+
         Args:
             despacho: Objeto Despacho de Django
-            
+
         Returns:
             dict con 'resumen' y 'sugerencia'
         """
-        # Verificar cache
-        cache_key = f'ia_despacho_{despacho.id}'
-        resultado_cache = cache.get(cache_key)
-        if resultado_cache:
-            return resultado_cache
-        
-        # Preparar datos del despacho
-        estado = despacho.estado or "Desconocido"
-        prioridad = despacho.prioridad or "media"
-        tipo_incidencia = despacho.tipo_incidencia or "Sin especificar"
-        descripcion_incidencia = despacho.descripcion_incidencia or "Sin detalles"
-        
-        # Calcular tiempo transcurrido
-        tiempo_transcurrido = self._calcular_tiempo_transcurrido(despacho)
-        
-        # Obtener horario de cierre de la farmacia origen
-        horario_cierre = self._obtener_horario_cierre(despacho)
+        return self.analizar_lote([despacho])[despacho.id]
+
+    def analizar_lote(self, despachos):
+        """
+        Analiza varios despachos en paralelo (máx. `max_workers` llamadas simultáneas)
+
+        Los resultados se guardan en la tabla ia_analisis_cache por hash de las
+        entradas del prompt: una incidencia sin cambios no vuelve a llamar a la IA.
+
+        Returns:
+            dict {despacho.id: {'resumen', 'sugerencia', 'error'}}
+        """
+        from ..models import IaAnalisisCache
+        despachos = list(despachos)
+        if not despachos:
+            return {}
+        cierres = self._obtener_horarios_cierre(despachos)
         hora_actual = datetime.now().time()
-        
-        # Construir prompt
-        prompt = f"""Eres un asistente de logística farmacéutica. Analiza esta situación:
-
-DESPACHO: {despacho.codigo_despacho}
-Estado: {estado}
-Prioridad: {prioridad}
-Tipo de incidencia: {tipo_incidencia}
-Descripción: {descripcion_incidencia}
-Tiempo en ruta: {tiempo_transcurrido}
-Hora actual: {hora_actual.strftime('%H:%M')}
-Farmacia cierra: {horario_cierre.strftime('%H:%M')}
+
+        entradas = {}
+        for d in despachos:
+            datos = self._datos_prompt(d, cierres.get(d.farmacia_origen_local_id, HORA_CIERRE_DEFAULT), hora_actual)
+            entradas[d.id] = (self._hash_entradas(datos), datos)
+
+        resultados = {}
+        # Cache en memoria (ia_despacho_{id}) y luego la persistente en BD
+        pendientes = {}
+        for did, (h, datos) in entradas.items():
+            en_memoria = cache.get(f'ia_despacho_{did}')
+            if en_memoria and en_memoria.get('hash') == h:
+                resultados[did] = en_memoria['resultado']
+            else:
+                pendientes[did] = (h, datos)
+        if pendientes:
+            guardados = {
+                c.hash_entrada: c.resultado
+                for c in IaAnalisisCache.objects.filter(hash_entrada__in={h for h, _ in pendientes.values()})
+            }
+            for did in list(pendientes):
+                h = pendientes[did][0]
+                if h in guardados:
+                    resultados[did] = guardados[h]
+                    cache.set(f'ia_despacho_{did}', {'hash': h, 'resultado': guardados[h]}, 3600)
+                    del pendientes[did]
+
+        if pendientes:
+            # Un mismo hash puede repetirse en el lote: se llama una sola vez
+            por_hash = {}
+            for did, (h, datos) in pendientes.items():
+                por_hash.setdefault(h, (datos, []))[1].append(did)
+            trabajadores = max(1, min(self.max_workers, len(por_hash)))
+            with ThreadPoolExecutor(max_workers=trabajadores) as pool:
+                futuros = {h: pool.submit(self._llamar_con_reintentos, self._construir_prompt(datos)) for h, (datos, _) in por_hash.items()}
+            nuevos = []
+            for h, fut in futuros.items():
+                resultado = fut.result()
+                datos, ids = por_hash[h]
+                for did in ids:
+                    resultados[did] = resultado
+                if not resultado.get('error'):
+                    nuevos.append(IaAnalisisCache(hash_entrada=h, despacho_id=ids[0], modelo=MODELO_IA, resultado=resultado))
+                    for did in ids:
+                        cache.set(f'ia_despacho_{did}', {'hash': h, 'resultado': resultado}, 3600)
+            if nuevos:
+                try:
+                    IaAnalisisCache.objects.bulk_create(nuevos, ignore_conflicts=True)
+                except Exception:
+                    logger.exception('No se pudo persistir el cache de análisis IA')
+        return resultados
+
+    def _llamar_con_reintentos(self, prompt):
+        ultimo_error = None
+        for intento in range(self.reintentos + 1):
+            try:
+                contenido = self.client.completar(prompt, timeout=self.timeout)
+                return self._parsear_respuesta(contenido)
+            except Exception as e:
+                ultimo_error = e
+                if intento < self.reintentos:
+                    _time.sleep(min(2 ** intento, 8) * 0.5)
+        return {
+            'resumen': f'Error al analizar con IA: {str(ultimo_error)}',
+            'sugerencia': 'Error',
+            'error': True
+        }
+
+    def _datos_prompt(self, despacho, horario_cierre, hora_actual):
+        """Entradas del prompt; la hora actual solo se usa para el hash como 'hay tiempo o no'"""
+        return {
+            'codigo': despacho.codigo_despacho,
+            'estado': despacho.estado or "Desconocido",
+            'prioridad': despacho.prioridad or "media",
+            'tipo_incidencia': despacho.tipo_incidencia or "Sin especificar",
+            'descripcion': despacho.descripcion_incidencia or "Sin detalles",
+            'salida': despacho.fecha_salida_farmacia.isoformat() if despacho.fecha_salida_farmacia else '',
+            'tiempo_transcurrido': self._calcular_tiempo_transcurrido(despacho),
+            'hora_actual': hora_actual.strftime('%H:%M'),
+            'cierre': horario_cierre.strftime('%H:%M'),
+            'hay_tiempo': hora_actual < horario_cierre,
+        }
+
+    def _hash_entradas(self, datos):
+        # tiempo_transcurrido y hora_actual cambian cada minuto: no forman parte de la clave
+        estables = {k: v for k, v in datos.items() if k not in ('tiempo_transcurrido', 'hora_actual')}
+        base = json.dumps({'modelo': MODELO_IA, **estables}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(base.encode('utf-8')).hexdigest()
+
+    def _construir_prompt(self, datos):
+        margen = 'Hay tiempo antes del cierre' if datos['hay_tiempo'] else 'Sin tiempo antes del cierre'
+        return f"""Eres un asistente de logística farmacéutica. Analiza esta situación:
+
+DESPACHO: {datos['codigo']}
+Estado: {datos['estado']}
+Prioridad: {datos['prioridad']}
+Tipo de incidencia: {datos['tipo_incidencia']}
+Descripción: {datos['descripcion']}
+Tiempo en ruta: {datos['tiempo_transcurrido']}
+Hora actual: {datos['hora_actual']}
+Farmacia cierra: {datos['cierre']} ({margen})
 
 TAREA:
 1. Resume la situación en máximo 2 líneas
@@ -58,31 +205,6 @@ FORMATO (usa exactamente este):
 Resumen: [tu resumen aquí]
 Sugerencia: [Reasignar o Postergar]"""
 
-        try:
-            # Llamar a OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Modelo más económico para beta
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=150,
-                temperature=0.3
-            )
-            
-            # Procesar respuesta
-            contenido = response.choices[0].message.content.strip()
-            resultado = self._parsear_respuesta(contenido)
-            
-            # Guardar en cache por 1 hora
-            cache.set(cache_key, resultado, 3600)
-            
-            return resultado
-            
-        except Exception as e:
-            return {
-                'resumen': f'Error al analizar con IA: {str(e)}',
-                'sugerencia': 'Error',
-                'error': True
-            }
-    
     def _calcular_tiempo_transcurrido(self, despacho):
         """Calcula el tiempo transcurrido del despacho"""
         if despacho.fecha_salida_farmacia:
@@ -95,30 +217,30 @@ Sugerencia: [Reasignar o Postergar]"""
                 mins = minutos % 60
                 return f"{horas}h {mins}min"
         return "Tiempo no disponible"
-    
-    def _obtener_horario_cierre(self, despacho):
-        """Obtiene el horario de cierre de la farmacia origen"""
+
+    def _obtener_horarios_cierre(self, despachos):
+        """Horario de cierre de las farmacias origen, en una sola consulta"""
         try:
             from ..models import Localfarmacia
-            farmacia = Localfarmacia.objects.get(local_id=despacho.farmacia_origen_local_id)
-            return farmacia.funcionamiento_hora_cierre
-        except:
-            return time(20, 0)  # Default 20:00
-    
+            ids = {d.farmacia_origen_local_id for d in despachos if d.farmacia_origen_local_id}
+            return dict(Localfarmacia.objects.filter(local_id__in=ids).values_list('local_id', 'funcionamiento_hora_cierre'))
+        except Exception:
+            return {}
+
     def _parsear_respuesta(self, contenido):
         """Parsea la respuesta de la IA al formato esperado"""
         lineas = contenido.split('\n')
         resumen = ""
         sugerencia = ""
-        
+
         for linea in lineas:
             if linea.startswith('Resumen:'):
                 resumen = linea.replace('Resumen:', '').strip()
             elif linea.startswith('Sugerencia:'):
                 sugerencia = linea.replace('Sugerencia:', '').strip()
-        
+
         return {
             'resumen': resumen or contenido,
             'sugerencia': sugerencia or 'Revisar manualmente',
             'error': False
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,165 @@
+"""Ingesta por streaming de planillas de transportistas a normalizacion_despacho.
+
+Las filas se leen de forma incremental (CSV/TSV línea a línea, XLSX en modo
+read_only), se insertan en lotes con bulk_create y tras cada lote se drena el
+staging con sp_normalizar_despachos. El avance queda en ingesta_normalizacion.
+"""
+import csv
+import io
+import itertools
+import logging
+
+from django.utils import timezone
+
+from ..repositories import drenar_normalizacion
+
+logger = logging.getLogger('appnproylogico')
+
+INGESTA_BATCH_SIZE = 1000
+NORMALIZACION_CHUNK = 500
+FORMATOS_INGESTA = ('.csv', '.tsv', '.xlsx')
+
+
+def _filas_csv(fichero, tsv=False):
+    fichero.seek(0)
+    texto = io.TextIOWrapper(fichero.file, encoding='utf-8', errors='ignore', newline='')
+    try:
+        primera = texto.readline()
+        sep = '\t' if (tsv or '\t' in primera) else ','
+        yield from csv.DictReader(itertools.chain([primera], texto), delimiter=sep)
+    finally:
+        # No cerrar el archivo subido junto con el wrapper
+        texto.detach()
+
+
+def _filas_xlsx(fichero):
+    import openpyxl
+    wb = openpyxl.load_workbook(fichero, read_only=True, data_only=True)
+    try:
+        for sheet in wb.worksheets:
+            filas = sheet.iter_rows(values_only=True)
+            encabezado = next(filas, None)
+            if not encabezado:
+                continue
+            headers = [str(h).strip() if h else '' for h in encabezado]
+            for row in filas:
+                d = {}
+                for i, v in enumerate(row):
+                    key = headers[i] if i < len(headers) else f'col_{i}'
+                    d[key] = v if v is not None else ''
+                yield d
+    finally:
+        wb.close()
+
+
+def iter_filas_archivo(fichero):
+    """Itera las filas (dict) de un CSV/TSV/XLSX subido sin cargarlo completo."""
+    name = fichero.name.lower()
+    if name.endswith('.csv') or name.endswith('.tsv'):
+        return _filas_csv(fichero, tsv=name.endswith('.tsv'))
+    if name.endswith('.xlsx'):
+        return _filas_xlsx(fichero)
+    raise ValueError('Formato no soportado. Usa CSV/TSV/XLSX.')
+
+
+def fila_a_staging(r, fuente, ahora):
+    from ..models import NormalizacionDespacho
+
+    def get(*keys):
+        for k in keys:
+            if k in r and r[k] is not None:
+                val = str(r[k]).strip()
+                if val != '':
+                    return val
+        return None
+
+    return NormalizacionDespacho(
+        fuente=fuente,
+        farmacia_origen_local_id=get('farmacia_origen_local_id','local_id','farmacia'),
+        motorista_documento=get('motorista_documento','motorista','rut_motorista','dni_motorista'),
+        cliente_nombre_raw=get('cliente_nombre','cliente'),
+        cliente_telefono_raw=get('cliente_telefono','telefono','fono'),
+        destino_direccion_raw=get('destino_direccion','direccion','calle'),
+        destino_lat_raw=get('destino_lat','lat'),
+        destino_lng_raw=get('destino_lng','lng'),
+        estado_raw=get('estado','estado_raw'),
+        tipo_despacho_raw=get('tipo_despacho','tipo'),
+        prioridad_raw=get('prioridad','prio'),
+        numero_receta_raw=get('numero_receta','receta'),
+        observaciones_raw=get('observaciones','obs'),
+        fecha_registro_raw=get('fecha','fecha_registro'),
+        procesado=False,
+        error_normalizacion=None,
+        fecha_creacion=ahora,
+    )
+
+
+def _insertar_lote(objs, mensajes):
+    """bulk_create del lote; si falla, fila a fila para aislar las filas con error."""
+    from ..models import NormalizacionDespacho
+    try:
+        NormalizacionDespacho.objects.bulk_create(objs)
+        return len(objs), 0
+    except Exception:
+        ok = err = 0
+        for obj in objs:
+            try:
+                obj.save()
+                ok += 1
+            except Exception as e:
+                err += 1
+                if len(mensajes) < 20:
+                    mensajes.append(f'Fila staging con error: {e}')
+        return ok, err
+
+
+def ingestar_archivo(fichero, fuente, usuario=None, batch_size=INGESTA_BATCH_SIZE, chunk=NORMALIZACION_CHUNK):
+    """Ingesta `fichero` por lotes y devuelve (ingesta, mensajes)."""
+    from ..models import IngestaNormalizacion
+    mensajes = []
+    ingesta = IngestaNormalizacion.objects.create(fuente=fuente, archivo_nombre=fichero.name[:255], usuario=usuario)
+    progreso = {'filas_leidas': 0, 'filas_insertadas': 0, 'filas_error': 0, 'lotes': 0, 'vueltas_normalizacion': 0}
+
+    def guardar(**extra):
+        IngestaNormalizacion.objects.filter(pk=ingesta.pk).update(fecha_actualizacion=timezone.now(), **progreso, **extra)
+
+    def normalizar():
+        try:
+            vueltas, _ = drenar_normalizacion(chunk=chunk)
+            progreso['vueltas_normalizacion'] += vueltas
+        except Exception as e:
+            mensajes.append(f'Error en normalización: {e}')
+            return str(e)
+        return None
+
+    def cerrar_lote(lote):
+        ok, err = _insertar_lote(lote, mensajes)
+        progreso['filas_insertadas'] += ok
+        progreso['filas_error'] += err
+        progreso['lotes'] += 1
+        error = normalizar()
+        guardar(**({'ultimo_error': error} if error else {}))
+
+    try:
+        ahora = timezone.now()
+        lote = []
+        for r in iter_filas_archivo(fichero):
+            progreso['filas_leidas'] += 1
+            try:
+                lote.append(fila_a_staging(r, fuente, ahora))
+            except Exception as e:
+                progreso['filas_error'] += 1
+                if len(mensajes) < 20:
+                    mensajes.append(f'Fila staging con error: {e}')
+            if len(lote) >= batch_size:
+                cerrar_lote(lote)
+                lote = []
+        if lote:
+            cerrar_lote(lote)
+        guardar(estado='COMPLETADA', fecha_fin=timezone.now())
+    except Exception as e:
+        logger.exception('Error en ingesta %s', ingesta.pk)
+        mensajes.append(f'Error al procesar: {e}')
+        guardar(estado='ERROR', ultimo_error=str(e)[:2000], fecha_fin=timezone.now())
+    ingesta.refresh_from_db()
+    return ingesta, mensajes
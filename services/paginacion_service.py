@@ -0,0 +1,285 @@
+"""Paginación keyset para los listados (listado_*, feed de avisos, reporte de movimientos).
+
+Paginator(qs, 10) hace COUNT(*) completo y OFFSET N en cada página, así que
+las páginas profundas de despacho o auditoria_general se vuelven lineales. Aquí
+cada página se pide con `WHERE (orden, id) > (último visto) ... LIMIT n+1`
+sobre la columna de orden de la vista más el id como desempate, y el total se
+cuenta exacto solo hasta PAGINACION_CONTEO_EXACTO_MAX; sobre ese umbral se
+estima con las estadísticas de la tabla (information_schema / EXPLAIN). El
+total se calcula en la primera página y las siguientes lo leen de la caché
+(clave por SQL y parámetros del listado, PAGINACION_CONTEO_TTL segundos).
+
+El objeto de página imita a django.core.paginator.Page: los templates siguen
+usando `?page={{ page_obj.next_page_number }}`, solo que el valor es un token
+con la posición (ver templatetags/paginacion.py para conservar los filtros).
+Un número en `page` (enlaces viejos) abre la primera página: no hay OFFSET.
+"""
+import base64
+import hashlib
+import json
+import logging
+import math
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import F, Q, QuerySet
+
+logger = logging.getLogger('appnproylogico')
+
+POR_PAGINA = 10
+PAGINACION_CONTEO_EXACTO_MAX = 10000
+PAGINACION_CONTEO_TTL = 300
+PAGINA_ULTIMA = 'last'
+
+
+def _valor_json(v):
+    # Con tipo explícito: DjangoJSONEncoder recorta microsegundos y el cursor debe ser exacto
+    if isinstance(v, datetime):
+        return ['dt', v.isoformat()]
+    if isinstance(v, date):
+        return ['d', v.isoformat()]
+    if isinstance(v, time):
+        return ['t', v.isoformat()]
+    if isinstance(v, Decimal):
+        return ['n', str(v)]
+    return v
+
+
+def _valor_python(v):
+    if not isinstance(v, list):
+        return v
+    tipo, texto = v
+    return {'dt': datetime.fromisoformat, 'd': date.fromisoformat, 't': time.fromisoformat, 'n': Decimal}[tipo](texto)
+
+
+def codificar_token(numero, sentido, valor, pk):
+    """Token de página: número, sentido ('s' siguiente / 'a' anterior) y (valor de orden, id) del borde."""
+    crudo = json.dumps([numero, sentido, _valor_json(valor), pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip('=')
+
+
+def decodificar_token(token):
+    """(numero, sentido, valor, pk) o None si el token no es válido."""
+    try:
+        crudo = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        numero, sentido, valor, pk = json.loads(crudo)
+        if sentido not in ('s', 'a') or int(numero) < 1:
+            return None
+        return int(numero), sentido, _valor_python(valor), int(pk)
+    except (TypeError, ValueError, KeyError, ArithmeticError):
+        return None
+
+
+def _atributo(obj, campo):
+    for parte in campo.split('__'):
+        obj = getattr(obj, parte, None)
+        if obj is None:
+            return None
+    return obj
+
+
+def _mayor(campo, valor):
+    # NULL se ordena como el menor valor (nulls_first en asc, nulls_last en desc)
+    return Q(**{f'{campo}__isnull': False}) if valor is None else Q(**{f'{campo}__gt': valor})
+
+
+def _menor(campo, valor):
+    if valor is None:
+        return Q(pk__in=[])
+    return Q(**{f'{campo}__lt': valor}) | Q(**{f'{campo}__isnull': True})
+
+
+def _igual(campo, valor):
+    return Q(**{f'{campo}__isnull': True}) if valor is None else Q(**{campo: valor})
+
+
+def _despues_de(campo, ascendente, valor, pk):
+    """Filas posteriores a (valor, pk) en el orden (campo, id) ascendente o descendente."""
+    if ascendente:
+        return _mayor(campo, valor) | (_igual(campo, valor) & Q(pk__gt=pk))
+    return _menor(campo, valor) | (_igual(campo, valor) & Q(pk__lt=pk))
+
+
+def _ordenar(qs, campo, ascendente):
+    if ascendente:
+        return qs.order_by(F(campo).asc(nulls_first=True), F('pk').asc())
+    return qs.order_by(F(campo).desc(nulls_last=True), F('pk').desc())
+
+
+def _estimar_filas(qs):
+    """Filas estimadas por las estadísticas del motor; None si no hay estimación disponible."""
+    try:
+        with connection.cursor() as cur:
+            if connection.vendor == 'mysql' and not qs.query.where:
+                cur.execute(
+                    'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                    [qs.model._meta.db_table],
+                )
+                fila = cur.fetchone()
+                return int(fila[0]) if fila and fila[0] is not None else None
+            if connection.vendor == 'mysql':
+                sql, params = qs.order_by().query.sql_with_params()
+                cur.execute('EXPLAIN ' + sql, params)
+                columnas = [c[0].lower() for c in cur.description]
+                fila = dict(zip(columnas, cur.fetchone()))
+                return int((fila.get('rows') or 0) * float(fila.get('filtered') or 100) / 100)
+            if connection.vendor == 'postgresql' and not qs.query.where:
+                cur.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [qs.model._meta.db_table])
+                fila = cur.fetchone()
+                return int(fila[0]) if fila and fila[0] >= 0 else None
+    except Exception:
+        logger.exception('No se pudo estimar el total de %s', qs.model._meta.db_table)
+    return None
+
+
+def contar(qs, exacto_max=None):
+    """
+    Total de `qs`, exacto hasta `exacto_max` filas
+
+    Returns:
+        (total, estimado); sobre el umbral el total sale de las estadísticas de la tabla
+    """
+    exacto_max = exacto_max or getattr(settings, 'PAGINACION_CONTEO_EXACTO_MAX', PAGINACION_CONTEO_EXACTO_MAX)
+    # COUNT sobre una subconsulta con LIMIT: nunca recorre más de exacto_max + 1 filas
+    total = qs.order_by()[:exacto_max + 1].count()
+    if total <= exacto_max:
+        return total, False
+    return max(_estimar_filas(qs) or 0, total), True
+
+
+def contar_listado(qs, refrescar=False):
+    """contar(qs) reutilizado entre páginas del mismo listado; `refrescar` lo recalcula."""
+    try:
+        sql, params = qs.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0, False
+    clave = 'paginacion:conteo:' + hashlib.sha1(f'{sql}|{params!r}'.encode()).hexdigest()
+    conteo = None if refrescar else cache.get(clave)
+    if conteo is None:
+        conteo = contar(qs)
+        cache.set(clave, conteo, int(getattr(settings, 'PAGINACION_CONTEO_TTL', PAGINACION_CONTEO_TTL)))
+    return tuple(conteo)
+
+
+class PaginadorKeyset:
+    """Lo que los templates leen de page_obj.paginator: count, num_pages, per_page y count_estimado."""
+
+    def __init__(self, count, per_page, count_estimado):
+        self.count = count
+        self.per_page = per_page
+        self.count_estimado = count_estimado
+
+    @property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+
+class PaginaKeyset:
+    """Página compatible con django.core.paginator.Page; los números de página vecinos son tokens."""
+
+    def __init__(self, object_list, number, paginator, siguiente=None, anterior=None):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._siguiente = siguiente
+        self._anterior = anterior
+
+    def __repr__(self):
+        return f'<Página {self.number} de {self.paginator.num_pages}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, i):
+        return self.object_list[i]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._siguiente is not None
+
+    def has_previous(self):
+        return self._anterior is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_page_number(self):
+        return self._siguiente
+
+    def previous_page_number(self):
+        return self._anterior
+
+    def start_index(self):
+        return (self.number - 1) * self.paginator.per_page + 1 if self.object_list else 0
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1 if self.object_list else 0
+
+
+def paginar(qs, page=None, orden='-id', por_pagina=POR_PAGINA):
+    """
+    Página `page` de `qs` ordenado por `orden` (p. ej. '-fecha_registro') más id
+
+    Args:
+        page: token de next/previous_page_number o 'last'; cualquier otro valor es la primera página
+
+    Listas en memoria (p. ej. fixtures de respaldo) se paginan con Paginator.
+    """
+    if not isinstance(qs, QuerySet):
+        return Paginator(qs, por_pagina).get_page(page)
+    campo = orden.lstrip('-')
+    ascendente = not orden.startswith('-')
+    page = str(page or '').strip()
+    pos = decodificar_token(page) if page and page != PAGINA_ULTIMA else None
+    # El total se recalcula al entrar al listado; al navegar se reutiliza
+    total, estimado = contar_listado(qs, refrescar=not pos and page != PAGINA_ULTIMA)
+    paginador = PaginadorKeyset(total, por_pagina, estimado)
+
+    if page == PAGINA_ULTIMA:
+        # La última página es la primera del orden inverso
+        cuantas = por_pagina if estimado else (total - (paginador.num_pages - 1) * por_pagina) or por_pagina
+        filas = list(_ordenar(qs, campo, not ascendente)[:cuantas])[::-1]
+        numero, hay_antes, hay_despues = paginador.num_pages, total > len(filas), False
+    elif pos and pos[1] == 'a':
+        numero, _, valor, pk = pos
+        filas = list(_ordenar(qs.filter(_despues_de(campo, not ascendente, valor, pk)), campo, not ascendente)[:por_pagina + 1])
+        if len(filas) <= por_pagina:
+            # Se llegó al inicio (o cambiaron los datos): mostrar la primera página
+            return paginar(qs, None, orden, por_pagina)
+        filas = filas[:por_pagina][::-1]
+        hay_antes, hay_despues = True, True
+    else:
+        if pos:
+            numero, _, valor, pk = pos
+            base = qs.filter(_despues_de(campo, ascendente, valor, pk))
+        else:
+            numero, base = 1, qs
+        filas = list(_ordenar(base, campo, ascendente)[:por_pagina + 1])
+        if not filas and numero > 1:
+            return paginar(qs, PAGINA_ULTIMA, orden, por_pagina)
+        hay_despues = len(filas) > por_pagina
+        filas = filas[:por_pagina]
+        hay_antes = numero > 1
+
+    siguiente = anterior = None
+    if hay_despues:
+        ultimo = filas[-1]
+        siguiente = codificar_token(numero + 1, 's', _atributo(ultimo, campo), ultimo.pk)
+    if hay_antes:
+        primero = filas[0]
+        anterior = 1 if numero <= 2 else codificar_token(numero - 1, 'a', _atributo(primero, campo), primero.pk)
+    if hay_despues and numero >= paginador.num_pages:
+        # La estimación (o el total en caché) quedó corta: que no contradiga la navegación
+        paginador.count = numero * por_pagina + 1
+    return PaginaKeyset(filas, numero, paginador, siguiente, anterior)
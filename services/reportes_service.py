@@ -0,0 +1,360 @@
+"""Construcción de reportes exportables y cola de generación en segundo plano.
+
+`construir_export` concentra la lógica de filas/cabeceras que antes vivía en
+`export_resumen_operativo`; la vista la usa para respuestas síncronas y el
+comando `procesar_reportes` para los jobs encolados (PDF/XLSX pesados).
+"""
+import hashlib
+import itertools
+import json
+import logging
+import pathlib
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from ..repositories import (
+    filtro_periodo,
+    get_resumen_asignaciones_mf,
+    get_resumen_operativo_anual,
+    get_resumen_operativo_hoy,
+    get_resumen_operativo_mes,
+)
+
+logger = logging.getLogger('appnproylogico')
+
+EXPORT_CHUNK_SIZE = 2000
+FORMATOS_ASYNC = ('xlsx', 'pdf')
+PARAMETROS_EXPORT = ('tipo', 'formato', 'detalle', 'anio', 'mes', 'fecha')
+REPORTES_JOB_MAX_INTENTOS = 3
+
+
+def cliente_normalizado(nombre: str):
+    s = (nombre or '').strip()
+    import re
+    m = re.match(r'(?i)^cliente\s+(\d+)$', s)
+    if not m:
+        return s or 'Cliente Uno'
+    n = int(m.group(1))
+    mapa = {
+        0: 'cero', 1: 'uno', 2: 'dos', 3: 'tres', 4: 'cuatro', 5: 'cinco', 6: 'seis', 7: 'siete', 8: 'ocho', 9: 'nueve',
+        10: 'diez', 11: 'once', 12: 'doce', 13: 'trece', 14: 'catorce', 15: 'quince', 16: 'dieciséis', 17: 'diecisiete', 18: 'dieciocho', 19: 'diecinueve', 20: 'veinte'
+    }
+    return f"Cliente {mapa.get(n, 'uno')}"
+
+
+def iter_no_vacio(it):
+    # Devuelve [] si el iterador está vacío, para que `not rows` siga funcionando
+    it = iter(it)
+    try:
+        primero = next(it)
+    except StopIteration:
+        return []
+    return itertools.chain([primero], it)
+
+
+def _filas_movimiento_detalle(qs):
+    campos = ('id', 'farmacia_origen_local_id', 'codigo_despacho', 'estado', 'fecha_registro')
+    for d in qs.only(*campos).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [d.farmacia_origen_local_id, d.codigo_despacho or d.id, d.estado, d.fecha_registro.strftime('%Y-%m-%d %H:%M')]
+
+
+def _filas_despacho_detalle(obj):
+    u = getattr(obj.motorista, 'usuario', None)
+    mot_name = f"{getattr(u,'nombre','')} {getattr(u,'apellido','')}".strip()
+    return [
+        obj.farmacia_origen_local_id or '',
+        obj.codigo_despacho or obj.id,
+        obj.estado or '',
+        obj.tipo_despacho or '',
+        obj.prioridad or '',
+        mot_name,
+        cliente_normalizado(obj.cliente_nombre),
+        obj.destino_direccion or '',
+        'Sí' if obj.tiene_receta_retenida else 'No',
+        'Sí' if obj.hubo_incidencia else 'No',
+        obj.fecha_registro.strftime('%Y-%m-%d %H:%M') if obj.fecha_registro else '',
+    ]
+
+
+def normalizar_parametros(data):
+    """Extrae de un QueryDict/dict solo los parámetros que afectan al reporte."""
+    params = {}
+    for k in PARAMETROS_EXPORT:
+        v = (data.get(k) or '').strip()
+        if v:
+            params[k] = v
+    params['tipo'] = (params.get('tipo') or 'diario').lower()
+    params['formato'] = (params.get('formato') or 'csv').lower()
+    return params
+
+
+def construir_export(params):
+    """Devuelve (headers, rows, filename, display_title) para los parámetros dados.
+
+    `rows` puede ser un iterador perezoso en los tipos de detalle.
+    """
+    tipo = params.get('tipo') or 'diario'
+    detalle = params.get('detalle') == '1'
+    anio = params.get('anio')
+    mes = params.get('mes')
+    display_title = ''
+    if tipo == 'diario' and not detalle:
+        rows = get_resumen_operativo_hoy()
+        headers = ['Farmacia','Comuna','Total despachos','Entregados','Fallidos','Directo','Reenvío receta','Intercambio','Error despacho','Con receta','Con incidencias']
+        filename = 'resumen_diario'
+        rows = [[r[1], r[2], r[3], r[4], r[5], r[13], r[14], r[15], r[16], r[9], r[10]] for r in rows]
+    elif tipo == 'mensual' and not detalle:
+        rows = get_resumen_operativo_mes(anio=anio, mes=mes)
+        headers = ['Año','Mes','Farmacia','Comuna','Total despachos','Entregados','Fallidos','Directo','Reenvío receta','Intercambio','Error despacho','Con receta','Con incidencias']
+        filename = f'resumen_mensual_{anio or "todos"}_{mes or "todos"}'
+        rows = [[r[0], r[1], r[3], r[4], r[5], r[6], r[7], r[15], r[16], r[17], r[18], r[11], r[12]] for r in rows]
+    elif tipo == 'asignaciones_mf':
+        headers = ['Motorista','Farmacia','Activa','Fecha asignación','Despachos totales','Entregados','Fallidos','En camino','Pendientes','Anulados','Con receta retenida']
+        filename = 'asignaciones_motorista_farmacia'
+        try:
+            rows = get_resumen_asignaciones_mf()
+        except Exception:
+            rows = []
+    elif tipo == 'despachos_activos':
+        headers = ['Local','Despacho','Estado','Tipo','Prioridad','Motorista','Cliente','Dirección','Con receta','Incidencia','Fecha']
+        fecha_arg = (params.get('fecha') or timezone.now().strftime('%Y-%m-%d'))
+        filename = f'reporte_diario_despachos_{fecha_arg}'
+        display_title = 'Reporte diario de despachos'
+        try:
+            base = pathlib.Path(getattr(settings, 'MEDIA_ROOT', None) or (pathlib.Path(settings.BASE_DIR) / 'media')) / 'reportes'
+            rows = []
+            file = base / f'cierre_{fecha_arg}.json'
+            if file.exists():
+                with open(file, 'r', encoding='utf-8') as f:
+                    rows = json.load(f) or []
+            else:
+                # Fallback: construir desde BD de la fecha
+                from ..models import Despacho
+                try:
+                    y, m, d = [int(x) for x in fecha_arg.split('-')]
+                except Exception:
+                    y, m, d = timezone.now().year, timezone.now().month, timezone.now().day
+                qs = Despacho.objects.filter(**filtro_periodo('fecha_registro', fecha=date(y, m, d))).select_related('motorista__usuario').order_by('fecha_registro')
+                rows = iter_no_vacio(_filas_despacho_detalle(obj) for obj in qs.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+        except Exception:
+            rows = []
+    elif tipo == 'diario' and detalle:
+        from ..models import Despacho
+        hoy = timezone.now().date()
+        qs = Despacho.objects.filter(**filtro_periodo('fecha_registro', fecha=hoy)).order_by('-fecha_registro')
+        headers = ['Local','Despacho','Estado','Fecha']
+        filename = 'movimientos_diario'
+        rows = iter_no_vacio(_filas_movimiento_detalle(qs))
+    elif tipo == 'mensual' and detalle:
+        from ..models import Despacho
+        qs = Despacho.objects.filter(**filtro_periodo('fecha_registro', anio=anio, mes=mes)).order_by('-fecha_registro')
+        headers = ['Local','Despacho','Estado','Fecha']
+        filename = f'movimientos_mensual_{anio or "todos"}_{mes or "todos"}'
+        rows = iter_no_vacio(_filas_movimiento_detalle(qs))
+    else:
+        rows = get_resumen_operativo_anual(anio=anio)
+        headers = ['Año','Farmacia','Comuna','Total despachos','Entregados','Fallidos','Directo','Reenvío receta','Intercambio','Error despacho','Con receta','Con incidencias']
+        filename = f'resumen_anual_{anio or "todos"}'
+        rows = [[r[0], r[2], r[3], r[4], r[5], r[13], r[14], r[15], r[16], r[10], r[11]] for r in rows]
+
+    if not rows and tipo != 'despachos_activos':
+        try:
+            from ..models import Despacho, Localfarmacia
+            hoy = timezone.now().date()
+            qs = Despacho.objects.all()
+            if tipo == 'diario':
+                qs = qs.filter(**filtro_periodo('fecha_registro', fecha=hoy))
+            elif tipo == 'mensual':
+                y = int(anio) if anio else hoy.year
+                m = int(mes) if mes else hoy.month
+                qs = qs.filter(**filtro_periodo('fecha_registro', anio=y, mes=m))
+            else:
+                y = int(anio) if anio else hoy.year
+                qs = qs.filter(**filtro_periodo('fecha_registro', anio=y))
+            agg = qs.values('farmacia_origen_local_id').annotate(
+                total=Count('id'),
+                entregados=Count('id', filter=Q(estado='ENTREGADO')),
+                fallidos=Count('id', filter=Q(estado='FALLIDO')),
+                directo=Count('id', filter=Q(tipo_despacho='DOMICILIO')),
+                reenvio=Count('id', filter=Q(tipo_despacho='REENVIO_RECETA')),
+                intercambio=Count('id', filter=Q(tipo_despacho='INTERCAMBIO')),
+                error=Count('id', filter=Q(tipo_despacho='ERROR_DESPACHO')),
+                con_receta=Count('id', filter=Q(tiene_receta_retenida=True)),
+                con_incidencias=Count('id', filter=Q(hubo_incidencia=True)),
+            )
+            mapa_nombres = {lf.local_id: lf.local_nombre for lf in Localfarmacia.objects.all()}
+            mapa_comunas = {lf.local_id: lf.comuna_nombre for lf in Localfarmacia.objects.all()}
+            if tipo == 'diario':
+                rows = [
+                    (mapa_nombres.get(r['farmacia_origen_local_id']), mapa_comunas.get(r['farmacia_origen_local_id']), r['total'], r['entregados'], r['fallidos'], r['directo'], r['reenvio'], r['intercambio'], r['error'], r['con_receta'], r['con_incidencias'])
+                    for r in agg
+                ]
+            elif tipo == 'mensual':
+                rows = [
+                    (y, m, mapa_nombres.get(r['farmacia_origen_local_id']), mapa_comunas.get(r['farmacia_origen_local_id']), r['total'], r['entregados'], r['fallidos'], r['directo'], r['reenvio'], r['intercambio'], r['error'], r['con_receta'], r['con_incidencias'])
+                    for r in agg
+                ]
+            else:
+                rows = [
+                    (y, mapa_nombres.get(r['farmacia_origen_local_id']), mapa_comunas.get(r['farmacia_origen_local_id']), r['total'], r['entregados'], r['fallidos'], r['directo'], r['reenvio'], r['intercambio'], r['error'], r['con_receta'], r['con_incidencias'])
+                    for r in agg
+                ]
+        except Exception:
+            rows = []
+    return headers, rows, filename, display_title
+
+
+def render_xlsx(headers, rows):
+    import io
+    import openpyxl
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Resumen'
+    ws.append(headers)
+    for r in rows:
+        ws.append(list(r))
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def render_pdf(headers, rows, titulo):
+    import io
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import mm
+    try:
+        from reportlab.lib.pdfencrypt import StandardEncryption
+        pwd = (settings.PDF_PASSWORD or '000').strip()
+        enc = StandardEncryption(pwd, pwd, canPrint=1, canModify=0, canCopy=0, canAnnotate=0)
+    except Exception:
+        enc = None
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buf,
+        pagesize=landscape(A4),
+        leftMargin=15*mm,
+        rightMargin=15*mm,
+        topMargin=15*mm,
+        bottomMargin=15*mm,
+        encrypt=enc
+    )
+    styles = getSampleStyleSheet()
+    elems = []
+    elems.append(Paragraph(titulo, styles['Title']))
+    elems.append(Spacer(1, 6*mm))
+    data_rows = [list(r) for r in rows]
+    if not data_rows:
+        data_rows = [["Sin datos"] + [""] * (len(headers) - 1)]
+    data = [headers] + data_rows
+    table = Table(data, repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.black),
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0,0), (-1,-1), 8),
+        ('ALIGN', (0,0), (-1,0), 'CENTER'),
+        ('ALIGN', (0,1), (-1,-1), 'LEFT'),
+        ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
+        ('ROWBACKGROUNDS', (0,1), (-1,-1), [colors.whitesmoke, colors.white]),
+    ]))
+    elems.append(table)
+    doc.build(elems)
+    return buf.getvalue()
+
+
+def render_archivo(formato, headers, rows, filename, display_title=''):
+    if formato == 'xlsx':
+        return render_xlsx(headers, rows)
+    return render_pdf(headers, rows, display_title or filename.replace('_', ' ').title())
+
+
+# Cola de jobs en BD (tabla reporte_job); la consume `manage.py procesar_reportes`
+
+def media_root():
+    return pathlib.Path(getattr(settings, 'MEDIA_ROOT', None) or (pathlib.Path(settings.BASE_DIR) / 'media'))
+
+
+def hash_parametros(params):
+    base = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(base.encode('utf-8')).hexdigest()
+
+
+def encolar_reporte(params, usuario=None):
+    """Crea un job o reutiliza uno idéntico del mismo usuario dentro del TTL. Devuelve (job, creado)."""
+    from ..models import ReporteJob
+    h = hash_parametros(params)
+    ttl = int(getattr(settings, 'REPORTES_JOB_TTL_SECONDS', 600))
+    desde = timezone.now() - timedelta(seconds=ttl)
+    existente = (
+        ReporteJob.objects
+        .filter(hash_parametros=h, usuario=usuario, fecha_creacion__gte=desde, estado__in=('PENDIENTE', 'PROCESANDO', 'LISTO'))
+        .order_by('-fecha_creacion')
+        .first()
+    )
+    # Un LISTO cuyo archivo ya no existe no sirve; se encola de nuevo
+    if existente and (existente.estado != 'LISTO' or (existente.archivo and (media_root() / existente.archivo).exists())):
+        return existente, False
+    job = ReporteJob.objects.create(
+        tipo=params.get('tipo') or 'diario',
+        formato=params.get('formato') or 'pdf',
+        parametros=params,
+        hash_parametros=h,
+        usuario=usuario,
+    )
+    return job, True
+
+
+def tomar_jobs(limite=1):
+    """Reclama hasta `limite` jobs pendientes y los marca PROCESANDO. Devuelve sus ids."""
+    from django.db import connection
+    from django.db.models import F
+    from ..models import ReporteJob
+    if limite <= 0:
+        return []
+    ahora = timezone.now()
+    # Jobs abandonados por un worker caído vuelven a la cola; tras REPORTES_JOB_MAX_INTENTOS quedan en ERROR
+    timeout = int(getattr(settings, 'REPORTES_JOB_TIMEOUT_SECONDS', 900))
+    abandonados = ReporteJob.objects.filter(estado='PROCESANDO', fecha_inicio__lt=ahora - timedelta(seconds=timeout))
+    abandonados.filter(intentos__lt=REPORTES_JOB_MAX_INTENTOS).update(estado='PENDIENTE')
+    abandonados.filter(intentos__gte=REPORTES_JOB_MAX_INTENTOS).update(
+        estado='ERROR', error='El worker no terminó el reporte tras varios intentos', fecha_fin=ahora,
+    )
+    skip = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic():
+        ids = list(
+            ReporteJob.objects.select_for_update(skip_locked=skip)
+            .filter(estado='PENDIENTE')
+            .order_by('fecha_creacion')
+            .values_list('id', flat=True)[:limite]
+        )
+        if ids:
+            ReporteJob.objects.filter(id__in=ids).update(estado='PROCESANDO', fecha_inicio=ahora, intentos=F('intentos') + 1)
+    return ids
+
+
+def procesar_job(job_id):
+    """Genera el archivo del job en MEDIA_ROOT/reportes/jobs y actualiza su estado."""
+    from ..models import ReporteJob
+    job = ReporteJob.objects.get(pk=job_id)
+    try:
+        headers, rows, filename, display_title = construir_export(job.parametros or {})
+        contenido = render_archivo(job.formato, headers, rows, filename, display_title)
+        rel = f'reportes/jobs/{job.id}_{filename}.{job.formato}'
+        destino = media_root() / rel
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        tmp = destino.with_name(destino.name + '.tmp')
+        tmp.write_bytes(contenido)
+        tmp.replace(destino)
+        ReporteJob.objects.filter(pk=job.id).update(estado='LISTO', archivo=rel, error=None, fecha_fin=timezone.now())
+        return job.id, 'LISTO'
+    except Exception as e:
+        logger.exception('Error generando reporte job=%s', job_id)
+        ReporteJob.objects.filter(pk=job.id).update(estado='ERROR', error=str(e)[:2000], fecha_fin=timezone.now())
+        return job.id, 'ERROR'
@@ -0,0 +1,17 @@
+"""Punto de entrada de los procesos del pool de `procesar_reportes`.
+
+Los hijos arrancan con 'spawn' y sin Django configurado, y el pool importa este
+módulo para resolver el initializer antes de llamarlo. Por eso aquí no se
+importan modelos ni repositories al cargar: todo se importa después de
+django.setup().
+"""
+
+
+def inicializar_worker():
+    import django
+    django.setup()
+
+
+def ejecutar_job(job_id):
+    from .reportes_service import procesar_job
+    return procesar_job(job_id)
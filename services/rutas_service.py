@@ -0,0 +1,153 @@
+"""Rutas de reparto: agrupa los despachos de un motorista que salen de la misma farmacia.
+
+Por cada (motorista, farmacia de origen) con despachos ASIGNADO/PREPARANDO/
+PREPARADO se arma una ruta y se ordenan las entregas con vecino más cercano
+desde la farmacia + mejora 2-opt sobre destino_lat/lng (haversine). Las
+paradas sin coordenadas van al final por antigüedad. Replanificar un
+motorista reemplaza sus rutas en una transacción; signals.py lo dispara al
+guardar un despacho y los caminos con bulk_update lo llaman explícitamente.
+"""
+import logging
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .geo_service import haversine_km
+
+logger = logging.getLogger('appnproylogico')
+
+ESTADOS_RUTA = ('ASIGNADO', 'PREPARANDO', 'PREPARADO')
+DOS_OPT_MAX_PASADAS = 20
+
+
+def ordenar_paradas(origen, puntos):
+    """
+    Secuencia de entrega para `puntos` [(clave, lat, lng)] saliendo de `origen` (lat, lng) o None
+
+    Returns:
+        (claves en orden, distancias desde la parada anterior)
+    """
+    if not puntos:
+        return [], []
+    nodos = [origen or (puntos[0][1], puntos[0][2])] + [(lat, lng) for _, lat, lng in puntos]
+    n = len(nodos)
+    dist = [[haversine_km(a[0], a[1], b[0], b[1]) for b in nodos] for a in nodos]
+    # Vecino más cercano desde la farmacia (nodo 0)
+    orden = [0]
+    pendientes = set(range(1, n))
+    while pendientes:
+        ultimo = orden[-1]
+        siguiente = min(pendientes, key=lambda j: dist[ultimo][j])
+        orden.append(siguiente)
+        pendientes.discard(siguiente)
+    # 2-opt sobre el camino abierto; el nodo 0 queda fijo al inicio
+    for _ in range(DOS_OPT_MAX_PASADAS):
+        mejoro = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                a, b = orden[i - 1], orden[i]
+                c = orden[j]
+                d = orden[j + 1] if j + 1 < n else None
+                antes = dist[a][b] + (dist[c][d] if d is not None else 0.0)
+                despues = dist[a][c] + (dist[b][d] if d is not None else 0.0)
+                if despues < antes - 1e-9:
+                    orden[i:j + 1] = reversed(orden[i:j + 1])
+                    mejoro = True
+        if not mejoro:
+            break
+    claves = [puntos[k - 1][0] for k in orden[1:]]
+    tramos = [dist[orden[k - 1]][orden[k]] for k in range(1, n)]
+    return claves, tramos
+
+
+def _km(valor):
+    return Decimal(str(round(valor, 3))) if valor is not None else None
+
+
+def planificar_motoristas(motorista_ids):
+    """
+    Recalcula las rutas de `motorista_ids` (y de los motoristas que aún tenían
+    en ruta alguno de sus despachos)
+
+    Returns:
+        cantidad de rutas creadas
+    """
+    from ..models import Despacho, Localfarmacia, Ruta, RutaParada
+    ids = {int(m) for m in motorista_ids if m}
+    if not ids:
+        return 0
+
+    def cargar(mids):
+        return list(
+            Despacho.objects.filter(motorista_id__in=mids, estado__in=ESTADOS_RUTA)
+            .order_by('fecha_registro', 'id')
+            .values('id', 'motorista_id', 'farmacia_origen_local_id', 'destino_lat', 'destino_lng')
+        )
+
+    despachos = cargar(ids)
+    # Despachos reasignados: su parada vieja está en la ruta de otro motorista, que también se replanifica
+    otros = set(
+        Ruta.objects.filter(paradas_ruta__despacho_id__in=[d['id'] for d in despachos]).exclude(motorista_id__in=ids)
+        .values_list('motorista_id', flat=True)
+    ) if despachos else set()
+    if otros:
+        ids |= otros
+        despachos += cargar(otros)
+    grupos = {}
+    for d in despachos:
+        grupos.setdefault((d['motorista_id'], d['farmacia_origen_local_id']), []).append(d)
+    origenes = {
+        lid: (float(lat), float(lng))
+        for lid, lat, lng in Localfarmacia.objects.filter(
+            local_id__in={o for _, o in grupos}, local_lat__isnull=False, local_lng__isnull=False
+        ).values_list('local_id', 'local_lat', 'local_lng')
+    } if grupos else {}
+    ahora = timezone.now()
+    with transaction.atomic():
+        RutaParada.objects.filter(ruta__motorista_id__in=ids).delete()
+        Ruta.objects.filter(motorista_id__in=ids).delete()
+        paradas = []
+        for (mid, origen), ds in grupos.items():
+            con_gps = [(d['id'], float(d['destino_lat']), float(d['destino_lng'])) for d in ds if d['destino_lat'] is not None and d['destino_lng'] is not None]
+            claves, tramos = ordenar_paradas(origenes.get(origen), con_gps)
+            if not origenes.get(origen) and tramos:
+                # Sin coordenadas de farmacia el primer tramo no es medible
+                tramos[0] = None
+            sin_gps = [d['id'] for d in ds if d['destino_lat'] is None or d['destino_lng'] is None]
+            secuencia = list(zip(claves, tramos)) + [(pk, None) for pk in sin_gps]
+            total = sum(t for _, t in secuencia if t is not None)
+            ruta = Ruta.objects.create(
+                motorista_id=mid, farmacia_origen_local_id=origen, paradas=len(secuencia),
+                distancia_km=_km(total) if claves else None, fecha_creacion=ahora,
+            )
+            paradas.extend(
+                RutaParada(ruta=ruta, despacho_id=pk, orden=i, distancia_km=_km(t)) for i, (pk, t) in enumerate(secuencia, start=1)
+            )
+        RutaParada.objects.bulk_create(paradas)
+    return len(grupos)
+
+
+def replanificar_al_confirmar(motorista_ids):
+    """Replanifica `motorista_ids` cuando la transacción actual haga commit."""
+    ids = {m for m in motorista_ids if m}
+    if not ids:
+        return
+
+    def _planificar():
+        try:
+            planificar_motoristas(ids)
+        except Exception:
+            logger.exception('No se pudieron replanificar las rutas de %s motoristas', len(ids))
+    transaction.on_commit(_planificar)
+
+
+def rutas_motorista(motorista_id):
+    """Rutas vigentes del motorista con sus paradas (y el despacho de cada una) en orden."""
+    from django.db.models import Prefetch
+    from ..models import Ruta, RutaParada
+    return list(
+        Ruta.objects.filter(motorista_id=motorista_id)
+        .order_by('fecha_creacion', 'id')
+        .prefetch_related(Prefetch('paradas_ruta', queryset=RutaParada.objects.select_related('despacho').order_by('orden')))
+    )
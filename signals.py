@@ -0,0 +1,125 @@
+from django.contrib.auth.models import Group, User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from oauth2_provider.models import AccessToken
+
+from .auth_decorators import invalidar_token
+from .models import AsignacionMotoMotorista, Despacho, Localfarmacia, Moto, Motorista, Usuario
+from .repositories import invalidar_despachos_activos, invalidar_metricas_dashboard
+from .roles import invalidar_rol_usuario
+from .services.busqueda_service import indexar_al_confirmar, renombrar_farmacia, renombrar_motorista
+from .services.geo_service import despacho_guardado_geo, invalidar_indice_geo
+from .services.rutas_service import ESTADOS_RUTA, replanificar_al_confirmar
+
+
+# Invalidación de cachés: roles/permisos y tokens (roles.py / auth_decorators.py)
+# y read models de despachos activos / conteos del inicio (repositories.py).
+# También mantienen el índice de consulta rápida (services/busqueda_service.py)
+# y los índices espaciales en memoria (services/geo_service.py), y replanifican
+# las rutas del motorista afectado (services/rutas_service.py).
+
+@receiver(m2m_changed, sender=User.groups.through)
+def grupos_usuario_cambiados(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # user.groups.add/remove/clear: instance es el User
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidar_rol_usuario(instance.pk)
+            instance.__dict__.pop('_rol_memo', None)
+        return
+    # group.user_set.add/remove/clear: instance es el Group
+    if action in ('post_add', 'post_remove') and pk_set:
+        invalidar_rol_usuario(*pk_set)
+    elif action == 'pre_clear':
+        invalidar_rol_usuario(*instance.user_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def usuario_guardado(sender, instance, **kwargs):
+    invalidar_rol_usuario(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def grupo_modificado(sender, instance, **kwargs):
+    # Renombrar o borrar un grupo cambia el rol de todos sus miembros
+    if instance.pk:
+        invalidar_rol_usuario(*instance.user_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=AccessToken)
+@receiver(post_delete, sender=AccessToken)
+def token_modificado(sender, instance, **kwargs):
+    invalidar_token(instance.token)
+
+
+@receiver(post_save, sender=Despacho)
+@receiver(post_delete, sender=Despacho)
+def despacho_modificado(sender, instance, **kwargs):
+    # registrar_movimiento, aplicar_correccion_estado, agregar/actualizar_despacho, admin...
+    invalidar_despachos_activos()
+
+
+@receiver(post_save, sender=Despacho)
+def despacho_guardado(sender, instance, created, **kwargs):
+    # Al borrar, la fila de busqueda_despacho cae por CASCADE
+    indexar_al_confirmar([instance.pk])
+    despacho_guardado_geo(instance.pk, instance.destino_lat, instance.destino_lng, instance.estado, created)
+    if not created or instance.estado in ESTADOS_RUTA:
+        replanificar_al_confirmar([instance.motorista_id])
+
+
+@receiver(post_delete, sender=Despacho)
+def despacho_borrado(sender, instance, **kwargs):
+    replanificar_al_confirmar([instance.motorista_id])
+
+
+def _toca(kwargs, campos):
+    update_fields = kwargs.get('update_fields')
+    return update_fields is None or bool(set(update_fields) & campos)
+
+
+@receiver(pre_save, sender=Localfarmacia)
+def farmacia_por_guardar(sender, instance, **kwargs):
+    # El índice de búsqueda guarda el local_id: si cambia, las filas siguen con el anterior
+    instance._local_id_anterior = None
+    if instance.pk and _toca(kwargs, {'local_id'}):
+        instance._local_id_anterior = Localfarmacia.objects.filter(pk=instance.pk).values_list('local_id', flat=True).first()
+
+
+@receiver(post_save, sender=Localfarmacia)
+def farmacia_guardada(sender, instance, created, **kwargs):
+    if created or not _toca(kwargs, {'local_nombre', 'local_id'}):
+        return
+    anterior = getattr(instance, '_local_id_anterior', None)
+    if anterior and anterior != instance.local_id:
+        # Filas que siguen con el id anterior: nombre nuevo; despachos que ya usan el id nuevo: reindexar
+        renombrar_farmacia(anterior, instance.local_nombre)
+        indexar_al_confirmar(Despacho.objects.filter(farmacia_origen_local_id=instance.local_id).values_list('id', flat=True))
+    renombrar_farmacia(instance.local_id, instance.local_nombre)
+
+
+@receiver(post_save, sender=Localfarmacia)
+@receiver(post_delete, sender=Localfarmacia)
+def farmacia_modificada_geo(sender, instance, **kwargs):
+    invalidar_indice_geo('farmacias')
+
+
+@receiver(post_save, sender=Usuario)
+def usuario_app_guardado(sender, instance, created, **kwargs):
+    if created or not _toca(kwargs, {'nombre', 'apellido'}):
+        return
+    motorista_id = Motorista.objects.filter(usuario_id=instance.pk).values_list('id', flat=True).first()
+    if motorista_id:
+        renombrar_motorista(motorista_id, f"{instance.nombre or ''} {instance.apellido or ''}".strip())
+
+
+@receiver(post_save, sender=Localfarmacia)
+@receiver(post_delete, sender=Localfarmacia)
+@receiver(post_save, sender=Motorista)
+@receiver(post_delete, sender=Motorista)
+@receiver(post_save, sender=Moto)
+@receiver(post_delete, sender=Moto)
+@receiver(post_save, sender=AsignacionMotoMotorista)
+@receiver(post_delete, sender=AsignacionMotoMotorista)
+def maestro_modificado(sender, instance, **kwargs):
+    invalidar_metricas_dashboard()
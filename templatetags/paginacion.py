@@ -0,0 +1,32 @@
+"""Tags para enlazar páginas de services/paginacion_service.py conservando los filtros de la URL.
+
+    {% load paginacion %}
+    <a href="{% url_pagina page_obj.next_page_number %}">Siguiente</a>
+    Página {{ page_obj.number }} de {{ page_obj.paginator|total_paginas }}
+"""
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def url_pagina(context, page):
+    """Query string actual con `page` reemplazado (número, token o 'last')."""
+    request = context.get('request')
+    if request is None:
+        return f'?page={page}'
+    params = request.GET.copy()
+    params['page'] = page
+    return '?' + params.urlencode()
+
+
+@register.filter
+def total_paginas(paginator):
+    """num_pages, con '~' cuando el total es una estimación."""
+    return f"~{paginator.num_pages}" if getattr(paginator, 'count_estimado', False) else paginator.num_pages
+
+
+@register.filter
+def total_filas(paginator):
+    """count, con '~' cuando el total es una estimación."""
+    return f"~{paginator.count}" if getattr(paginator, 'count_estimado', False) else paginator.count
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from appnproylogico.forms import RegistroForm, DespachoForm
 
 
@@ -43,3 +43,972 @@ class DespachoFormChoicesTest(TestCase):
         estados = [c[0] for c in form.fields['estado'].widget.choices]
         assert 'PREPARANDO' in estados
         assert 'PREPARADO' in estados
+
+
+def _crear_rol():
+    from django.utils import timezone
+    from appnproylogico.models import Rol
+    now = timezone.now()
+    return Rol.objects.create(codigo='motorista', nombre='Motorista', django_group_name='Motoristas', activo=True, fecha_creacion=now, fecha_modificacion=now)
+
+
+def _crear_motorista(rol, n):
+    import datetime
+    from django.utils import timezone
+    from appnproylogico.models import Motorista, Usuario
+    now = timezone.now()
+    u = Usuario.objects.create(rol=rol, django_user_id=1000 + n, tipo_documento='DNI', documento_identidad=f'MOT-{n}', nombre=f'Mot{n}', apellido='Test', activo=True, fecha_creacion=now, fecha_modificacion=now)
+    m = Motorista.objects.create(usuario=u, licencia_numero=f'L-{n}', licencia_clase='A', fecha_vencimiento_licencia=datetime.date(2030, 1, 1), emergencia_nombre='Contacto', emergencia_telefono='+56900000000', emergencia_parentesco='Otro', total_entregas_completadas=0, total_entregas_fallidas=0, activo=True, disponible_hoy=True, fecha_creacion=now, fecha_modificacion=now)
+    return u, m
+
+
+def _crear_farmacia(n, **extra):
+    import datetime
+    from django.utils import timezone
+    from appnproylogico.models import Localfarmacia
+    now = timezone.now()
+    datos = dict(local_id=f'LF-{n}', local_nombre=f'Farmacia {n}', local_direccion='Calle 1', comuna_nombre='Santiago', localidad_nombre='Santiago', funcionamiento_hora_apertura=datetime.time(9, 0), funcionamiento_hora_cierre=datetime.time(21, 0), funcionamiento_dia='lun-vie', geolocalizacion_validada=False, fecha=now.date(), activo=True, fecha_creacion=now, fecha_modificacion=now)
+    datos.update(extra)
+    return Localfarmacia.objects.create(**datos)
+
+
+def _crear_despacho(motorista, usuario, local_id, n, **extra):
+    from django.utils import timezone
+    from appnproylogico.models import Despacho
+    now = timezone.now()
+    datos = dict(codigo_despacho=f'DSP-T-{n:05d}', farmacia_origen_local_id=local_id, motorista=motorista, estado='PENDIENTE', tipo_despacho='DOMICILIO', prioridad='MEDIA', destino_direccion='Calle 2', destino_geolocalizacion_validada=False, tiene_receta_retenida=False, requiere_devolucion_receta=False, receta_devuelta_farmacia=False, descripcion_productos='Test', requiere_aprobacion_operadora=False, aprobado_por_operadora=False, fecha_registro=now, firma_digital=False, hubo_incidencia=False, usuario_registro=usuario, fecha_modificacion=now)
+    datos.update(extra)
+    return Despacho.objects.create(**datos)
+
+
+def _superusuario_con_perfil(usuario, username):
+    """Superusuario de Django enlazado a `usuario` (los movimientos exigen un Usuario)."""
+    from django.contrib.auth.models import User
+    admin = User.objects.create_superuser(username, f'{username}@example.com', 'x')
+    usuario.django_user_id = admin.id
+    usuario.save(update_fields=['django_user_id'])
+    return admin
+
+
+class DespachosActivosPaginaTest(TestCase):
+    def test_filtros_y_keyset_en_sql(self):
+        from unittest import mock
+        from appnproylogico import repositories
+        llamadas = []
+
+        def fetchall(sql, params=None):
+            llamadas.append((sql, list(params or [])))
+            if sql.startswith('SELECT COUNT'):
+                return [(7,)]
+            return [(i,) + (None,) * 20 for i in (9, 8, 6)]
+        with mock.patch.object(repositories, 'fetchall', fetchall):
+            rows, count, estimado, siguiente = repositories.get_despachos_activos_page(estado='pendiente', q='Centro', limit=2, cursor=10)
+        assert [r[0] for r in rows] == [9, 8] and siguiente == 8
+        assert (count, estimado) == (7, False)
+        sql, params = llamadas[0]
+        assert 'estado = %s' in sql and 'id < %s' in sql and sql.endswith('ORDER BY id DESC LIMIT %s')
+        assert params == ['%centro%'] * 4 + ['PENDIENTE', 10, 3]
+        # El total es exacto (sin LIMIT) y no depende del cursor
+        count_sql, count_params = llamadas[-1]
+        assert 'LIMIT' not in count_sql and count_params == ['%centro%'] * 4 + ['PENDIENTE']
+
+    def test_fallback_json_filtra_y_pagina(self):
+        import json, pathlib, tempfile
+        from unittest import mock
+        from appnproylogico import repositories
+        from appnproylogico.services import fixtures_estaticos as fx
+        filas = [
+            [i, f'DSP-{i:04d}', 'EN_CAMINO' if i % 2 else 'PENDIENTE', 'DOMICILIO', 'MEDIA', 'CV Centro' if i < 4 else 'CV Norte'] + [None] * 15
+            for i in range(1, 7)
+        ]
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(fx, 'DATA_DIR', pathlib.Path(tmp)), \
+                mock.patch.object(repositories, 'fetchall', lambda sql, params=None: []):
+            (pathlib.Path(tmp) / 'despachos_activos.json').write_text(json.dumps(filas))
+            rows, count, estimado, siguiente = repositories.get_despachos_activos_page(estado='EN_CAMINO', limit=2)
+            assert [r[0] for r in rows] == [5, 3] and (count, estimado, siguiente) == (3, False, 3)
+            rows, _, _, siguiente = repositories.get_despachos_activos_page(estado='EN_CAMINO', limit=2, cursor=3)
+            assert [r[0] for r in rows] == [1] and siguiente is None
+            rows, count, _, _ = repositories.get_despachos_activos_page(q='centro')
+            assert [r[0] for r in rows] == [3, 2, 1] and count == 3
+
+
+class ResumenAsignacionesMFQueryCountTest(TestCase):
+    def _poblar(self, n_asignaciones, offset=0):
+        from django.utils import timezone
+        from appnproylogico.models import AsignacionMotoristaFarmacia
+        rol = self.rol
+        for i in range(offset, offset + n_asignaciones):
+            u, m = _crear_motorista(rol, i)
+            f = _crear_farmacia(i)
+            AsignacionMotoristaFarmacia.objects.create(motorista=m, farmacia=f, fecha_asignacion=timezone.now(), activa=True)
+            _crear_despacho(m, u, f.local_id, i * 10, estado='ENTREGADO')
+            _crear_despacho(m, u, f.local_id, i * 10 + 1, estado='FALLIDO', tiene_receta_retenida=True)
+
+    def setUp(self):
+        self.rol = _crear_rol()
+
+    def test_query_count_is_constant(self):
+        from appnproylogico.repositories import get_resumen_asignaciones_mf
+        self._poblar(2)
+        with self.assertNumQueries(2):
+            rows = get_resumen_asignaciones_mf()
+        assert len(rows) == 2
+        self._poblar(10, offset=2)
+        with self.assertNumQueries(2):
+            rows = get_resumen_asignaciones_mf()
+        assert len(rows) == 12
+        for r in rows:
+            assert r[4:] == [2, 1, 1, 0, 0, 0, 1]
+
+
+class ReporteJobDedupeTest(TestCase):
+    def test_mismos_parametros_reutilizan_job(self):
+        from appnproylogico.models import ReporteJob
+        from appnproylogico.services.reportes_service import encolar_reporte, normalizar_parametros, tomar_jobs
+        params = normalizar_parametros({'tipo': 'Mensual', 'formato': 'PDF', 'anio': '2025', 'mes': ' 11 '})
+        job1, creado1 = encolar_reporte(params)
+        job2, creado2 = encolar_reporte(dict(params))
+        assert creado1 and not creado2
+        assert job1.id == job2.id
+        otro, creado3 = encolar_reporte(normalizar_parametros({'tipo': 'mensual', 'formato': 'xlsx', 'anio': '2025', 'mes': '11'}))
+        assert creado3 and otro.id != job1.id
+        assert tomar_jobs(5) == [job1.id, otro.id]
+        assert tomar_jobs(5) == []
+        assert ReporteJob.objects.filter(estado='PROCESANDO').count() == 2
+
+    def test_intentos_agotados_quedan_en_error(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from appnproylogico.models import ReporteJob
+        from appnproylogico.services.reportes_service import encolar_reporte, normalizar_parametros, tomar_jobs
+        job, _ = encolar_reporte(normalizar_parametros({'tipo': 'anual', 'formato': 'pdf', 'anio': '2024'}))
+        ReporteJob.objects.filter(pk=job.pk).update(estado='PROCESANDO', intentos=3, fecha_inicio=timezone.now() - timedelta(days=1))
+        assert tomar_jobs(5) == []
+        job.refresh_from_db()
+        assert job.estado == 'ERROR' and job.fecha_fin is not None
+
+    def test_job_solo_visible_para_quien_lo_encolo(self):
+        from django.contrib.auth.models import User
+        from django.http import Http404
+        from django.test import RequestFactory
+        from appnproylogico.services.reportes_service import encolar_reporte, normalizar_parametros
+        from appnproylogico.views import _reporte_job_del_usuario
+        u, _ = _crear_motorista(_crear_rol(), 1)
+        dueno = User.objects.create_user('dueno', 'd@example.com', 'x', id=u.django_user_id)
+        otro = User.objects.create_user('otro', 'o@example.com', 'x')
+        params = normalizar_parametros({'tipo': 'anual', 'formato': 'xlsx', 'anio': '2024'})
+        job, _ = encolar_reporte(params, u)
+        # La deduplicación no entrega el job de otro usuario
+        assert encolar_reporte(params)[0].id != job.id
+        request = RequestFactory().get('/')
+        request.user = dueno
+        assert _reporte_job_del_usuario(request, job.id) == job
+        request.user = otro
+        with self.assertRaises(Http404):
+            _reporte_job_del_usuario(request, job.id)
+
+    def test_worker_se_importa_sin_django_configurado(self):
+        import os, subprocess, sys
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        env.pop('DJANGO_SETTINGS_MODULE', None)
+        r = subprocess.run(
+            [sys.executable, '-c', 'import appnproylogico.services.reportes_worker'],
+            env=env, capture_output=True, text=True,
+        )
+        assert r.returncode == 0, r.stderr
+
+
+class PermisosCacheTest(TestCase):
+    @override_settings(CACHE_COMPARTIDA=True)
+    def test_rol_cacheado_e_invalidado_por_grupos(self):
+        from django.contrib.auth.models import Group, User
+        from appnproylogico.roles import obtener_permisos_usuario, obtener_rol_usuario
+        user = User.objects.create_user('cacheuser', 'c@example.com', 'x')
+        operadores = Group.objects.create(name='Operadores')
+        assert obtener_rol_usuario(User.objects.get(pk=user.pk)) == 'usuario'
+        user.groups.add(operadores)
+        fresco = User.objects.get(pk=user.pk)
+        assert obtener_rol_usuario(fresco) == 'operador'
+        with self.assertNumQueries(0):
+            assert obtener_rol_usuario(User(pk=user.pk)) == 'operador'
+            assert 'add' in obtener_permisos_usuario(fresco)['movimientos']
+        operadores.user_set.remove(user)
+        assert obtener_rol_usuario(User.objects.get(pk=user.pk)) == 'usuario'
+
+    @override_settings(CACHE_COMPARTIDA=True)
+    def test_token_cacheado_e_invalidado_al_revocar(self):
+        from datetime import timedelta
+        from django.contrib.auth.models import User
+        from django.utils import timezone
+        from oauth2_provider.models import AccessToken, Application
+        from appnproylogico.auth_decorators import _verify_oauth
+        user = User.objects.create_user('tokenuser', 't@example.com', 'x')
+        app = Application.objects.create(name='ProyLogico First-Party', client_type=Application.CLIENT_CONFIDENTIAL, authorization_grant_type=Application.GRANT_PASSWORD)
+        at = AccessToken.objects.create(user=user, application=app, token='tok-cache', expires=timezone.now() + timedelta(hours=1), scope='read write')
+        assert _verify_oauth('tok-cache', User.objects.get(pk=user.pk), 'GET')
+        with self.assertNumQueries(0):
+            assert _verify_oauth('tok-cache', User(pk=user.pk), 'POST')
+        at.delete()
+        assert not _verify_oauth('tok-cache', User.objects.get(pk=user.pk), 'GET')
+
+    def test_sin_cache_compartida_no_cachea_entre_requests(self):
+        from datetime import timedelta
+        from django.contrib.auth.models import User
+        from django.utils import timezone
+        from oauth2_provider.models import AccessToken, Application
+        from appnproylogico.auth_decorators import _verify_oauth
+        from appnproylogico.roles import cache_compartida
+        # La LocMemCache por defecto es de cada worker: una revocación en otro proceso no la invalidaría
+        assert not cache_compartida()
+        user = User.objects.create_user('localuser', 'l@example.com', 'x')
+        app = Application.objects.create(name='ProyLogico First-Party', client_type=Application.CLIENT_CONFIDENTIAL, authorization_grant_type=Application.GRANT_PASSWORD)
+        at = AccessToken.objects.create(user=user, application=app, token='tok-local', expires=timezone.now() + timedelta(hours=1), scope='read write')
+        assert _verify_oauth('tok-local', User.objects.get(pk=user.pk), 'GET')
+        # Cambio sin signals, como el que haría otro worker con su propia caché
+        AccessToken.objects.filter(pk=at.pk).update(expires=timezone.now() - timedelta(minutes=1))
+        assert not _verify_oauth('tok-local', User.objects.get(pk=user.pk), 'GET')
+
+
+class AnalisisIALoteTest(TestCase):
+    def test_lote_usa_cache_persistente(self):
+        from django.core.cache import cache
+        from appnproylogico.models import IaAnalisisCache
+        from appnproylogico.services.ia_service import AnalizadorDespachoIA, ClienteIALocal
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1)
+        despachos = [
+            _crear_despacho(m, u, f.local_id, i, hubo_incidencia=True, tipo_incidencia='CLIENTE_AUSENTE')
+            for i in range(5)
+        ]
+        cliente = ClienteIALocal()
+        analizador = AnalizadorDespachoIA(client=cliente, max_workers=3)
+        resultados = analizador.analizar_lote(despachos)
+        assert len(resultados) == 5
+        assert all(not r['error'] for r in resultados.values())
+        assert cliente.llamadas == 5
+        assert IaAnalisisCache.objects.count() == 5
+        cache.clear()
+        with self.assertNumQueries(2):
+            analizador.analizar_lote(despachos)
+        assert cliente.llamadas == 5
+
+
+class LoadSamplesBulkTest(TestCase):
+    def test_bulk_crea_y_actualiza_despachos(self):
+        import io
+        import json
+        import tempfile
+        from pathlib import Path
+        from django.core.management import call_command
+        from appnproylogico.models import Despacho, Localfarmacia, MovimientoDespacho
+        with tempfile.TemporaryDirectory() as tmp:
+            base = Path(tmp)
+            (base / 'farmacias.json').write_text(json.dumps([{'local_id': 'F900', 'local_nombre': 'Farmacia Bulk'}]), encoding='utf-8')
+            despachos = [
+                {'codigo_despacho': f'DSP-BULK-{i:04d}', 'farmacia_origen_local_id': 'F900', 'motorista': {'nombre': 'Ana', 'apellido': 'Bulk'}}
+                for i in range(25)
+            ]
+            (base / 'despachos.json').write_text(json.dumps(despachos), encoding='utf-8')
+            call_command('load_samples', '--bulk', '--batch-size', '10', '--dir', tmp, stdout=io.StringIO())
+            assert Localfarmacia.objects.filter(local_id='F900').exists()
+            assert Despacho.objects.filter(codigo_despacho__startswith='DSP-BULK-').count() == 25
+            despachos[0]['estado'] = 'entregado'
+            (base / 'despachos.json').write_text(json.dumps(despachos), encoding='utf-8')
+            primero = Despacho.objects.get(codigo_despacho='DSP-BULK-0000')
+            (base / 'movimientos.json').write_text(json.dumps([{'despacho_id': primero.id, 'estado_nuevo': 'ENTREGADO'}]), encoding='utf-8')
+            out = io.StringIO()
+            call_command('load_samples', '--bulk', '--dir', tmp, stdout=out)
+            assert Despacho.objects.filter(codigo_despacho__startswith='DSP-BULK-').count() == 25
+            assert Despacho.objects.get(codigo_despacho='DSP-BULK-0000').estado == 'ENTREGADO'
+            assert MovimientoDespacho.objects.filter(despacho=primero).count() == 1
+            assert 'filas/s' in out.getvalue()
+            # Sin post_save en bulk: el comando indexa explícitamente lo cargado
+            from appnproylogico.models import BusquedaDespacho
+            assert BusquedaDespacho.objects.filter(codigo_despacho__startswith='DSP-BULK-').count() == 25
+
+
+class IngestaNormalizacionStreamingTest(TestCase):
+    def test_csv_por_lotes_con_progreso(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from appnproylogico.models import NormalizacionDespacho
+        from appnproylogico.services.ingesta_service import ingestar_archivo
+        lineas = ['local_id\tcliente\tdireccion\testado'] + [f'F{i:03d}\tCliente {i}\tCalle {i}\tPENDIENTE' for i in range(25)]
+        fichero = SimpleUploadedFile('carga.csv', ('\n'.join(lineas) + '\n').encode('utf-8'), content_type='text/csv')
+        ingesta, mensajes = ingestar_archivo(fichero, 'excel', batch_size=10)
+        assert ingesta.filas_leidas == 25
+        assert ingesta.filas_insertadas == 25
+        assert ingesta.lotes == 3
+        assert ingesta.estado == 'COMPLETADA'
+        fila = NormalizacionDespacho.objects.get(cliente_nombre_raw='Cliente 7')
+        assert fila.farmacia_origen_local_id == 'F007'
+        assert fila.destino_direccion_raw == 'Calle 7'
+
+
+class DespachosActivosVersionTest(TestCase):
+    def test_version_sube_al_modificar_despacho(self):
+        from appnproylogico.repositories import version_despachos_activos
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1)
+        v1 = version_despachos_activos()
+        d = _crear_despacho(m, u, f.local_id, 1)
+        v2 = version_despachos_activos()
+        assert v2 != v1
+        assert version_despachos_activos() == v2
+        d.estado = 'ANULADO'
+        d.save()
+        assert version_despachos_activos() != v2
+
+    def test_api_pagina_en_sql_y_etag_por_filtros(self):
+        import json
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.test import RequestFactory
+        from appnproylogico import views
+        filas = [
+            (i, f'DSP-{i}', 'PENDIENTE', 'DOMICILIO', 'MEDIA', 'Farmacia', 'Mot', 'AB12', 'Cliente', '+56911111111', 'Calle', 0, 0, 0, None, None, None, 0, 0, None, None)
+            for i in (5, 3, 1)
+        ]
+        user = User.objects.create_user(username='poll', password='x')
+        rf = RequestFactory()
+
+        def pedir(etag='', **params):
+            req = rf.get('/api/despachos-activos/', params, HTTP_IF_NONE_MATCH=etag)
+            req.user = user
+            return views.api_despachos_activos(req)
+
+        with mock.patch.object(views, 'get_despachos_activos_page', return_value=(filas, 3, False, None)) as pagina:
+            r1 = pedir(estado='pendiente')
+            assert r1.status_code == 200
+            datos = json.loads(r1.content)
+            assert [i['id'] for i in datos['items']] == [5, 3, 1] and datos['count'] == 3
+            assert pagina.call_args.kwargs['estado'] == 'PENDIENTE'
+            # Misma versión y filtros: 304 sin consultar la vista
+            assert pedir(r1['ETag'], estado='pendiente').status_code == 304
+            assert pagina.call_count == 1
+            # Mismo ETag con otro filtro: no es la misma respuesta
+            assert pedir(r1['ETag'], estado='asignado').status_code == 200
+            assert pagina.call_count == 2
+
+
+class IndicesConsultasTest(TestCase):
+    def test_filtro_periodo_no_envuelve_la_columna(self):
+        from datetime import date
+        from appnproylogico.models import Despacho
+        from appnproylogico.repositories import filtro_periodo
+        for kwargs in ({'fecha': date(2025, 3, 4)}, {'anio': 2025, 'mes': 12}, {'anio': 2025}):
+            sql = str(Despacho.objects.filter(**filtro_periodo('fecha_registro', **kwargs)).query).upper()
+            assert 'DATE(' not in sql and 'EXTRACT(' not in sql
+        f = filtro_periodo('fecha_registro', anio=2025, mes=12)
+        assert f['fecha_registro__lt'].year == 2026
+
+    def test_explain_usa_indice_compuesto(self):
+        from datetime import date
+        from django.db import connection
+        from appnproylogico.models import Despacho
+        from appnproylogico.repositories import filtro_periodo
+        from datetime import datetime, timedelta, timezone as dt_timezone
+        if connection.vendor != 'mysql':
+            self.skipTest('EXPLAIN específico de MySQL/MariaDB')
+        # Un año de despachos: el día pedido es una fracción pequeña y el optimizador elige el índice
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        inicio = datetime(2025, 1, 1, 12, tzinfo=dt_timezone.utc)
+        for i in range(365):
+            _crear_despacho(m, u, f'LF-{i % 7}', i, fecha_registro=inicio + timedelta(days=i))
+        qs = Despacho.objects.filter(**filtro_periodo('fecha_registro', fecha=date(2025, 3, 4))).values('farmacia_origen_local_id')
+        sql, params = qs.query.sql_with_params()
+        with connection.cursor() as cur:
+            cur.execute('EXPLAIN ' + sql, params)
+            cols = [c[0] for c in cur.description]
+            plan = [dict(zip(cols, r)) for r in cur.fetchall()]
+        assert [p.get('key') for p in plan] == ['idx_despacho_fecha_farmacia']
+
+
+class AvisosLecturaTest(TestCase):
+    def test_marcar_leido_actualiza_contador(self):
+        from django.contrib.auth.models import User
+        from django.urls import reverse
+        from django.utils import timezone
+        from appnproylogico.models import AuditoriaGeneral, AvisoLectura
+        avisos = [
+            AuditoriaGeneral.objects.create(nombre_tabla='comunicacion', id_registro_afectado=f'DSP-{i}', tipo_operacion='AVISO_MOV', fecha_evento=timezone.now(), datos_nuevos={'codigo': f'DSP-{i}'})
+            for i in range(3)
+        ]
+        no_leidos = AuditoriaGeneral.objects.filter(tipo_operacion='AVISO_MOV', lectura__isnull=True)
+        assert no_leidos.count() == 3
+        admin = User.objects.create_superuser('avisos', 'a@example.com', 'x')
+        self.client.force_login(admin)
+        self.client.get(reverse('marcar_aviso_leido', args=[avisos[0].id]))
+        self.client.get(reverse('marcar_aviso_leido', args=[avisos[0].id]))
+        assert AvisoLectura.objects.count() == 1
+        assert AuditoriaGeneral.objects.filter(tipo_operacion='AVISO_MOV_LEIDO').count() == 1
+        with self.assertNumQueries(1):
+            assert no_leidos.count() == 2
+        r = self.client.get(reverse('feed_avisos_operadora') + '?no_leidos=1')
+        assert r.status_code == 200
+        assert {a.id for a in r.context['page_obj']} == {avisos[1].id, avisos[2].id}
+
+
+class EventosBusTest(TestCase):
+    def test_evento_sale_al_hacer_commit(self):
+        from appnproylogico.services.eventos_service import obtener_bus, publicar_evento
+        s = obtener_bus().suscribir()
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                publicar_evento({'tipo': 'aviso', 'codigo': 'DSP-1'})
+                assert s.siguiente_sync(0) is None
+            evento = s.siguiente_sync(1)
+            assert evento['tipo'] == 'aviso' and evento['id'] >= 1
+        finally:
+            s.cerrar()
+
+    def test_suscriptor_asincrono_recibe_desde_otro_hilo(self):
+        import asyncio
+        import threading
+        from appnproylogico.services.eventos_service import BusMemoria, formato_sse
+        bus = BusMemoria()
+
+        async def escuchar():
+            s = bus.suscribir(loop=asyncio.get_running_loop())
+            threading.Timer(0.05, bus.publicar, args=[{'tipo': 'despacho', 'estado': 'EN_CAMINO'}]).start()
+            evento = await s.siguiente(2)
+            s.cerrar()
+            return evento
+
+        evento = asyncio.run(escuchar())
+        assert evento['estado'] == 'EN_CAMINO'
+        assert formato_sse(evento).startswith('id: 1\nevent: despacho\n')
+        assert bus.suscriptores == 0
+
+
+class DespachoStateMachineTest(TestCase):
+    def test_lote_aplica_validos_y_reporta_errores(self):
+        from unittest import mock
+        from appnproylogico.models import AuditoriaGeneral, Despacho, MovimientoDespacho
+        from appnproylogico.repositories import version_despachos_activos
+        from appnproylogico.services.despacho_estado_service import DespachoStateMachine
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1)
+        d1 = _crear_despacho(m, u, f.local_id, 1, estado='PREPARADO')
+        d2 = _crear_despacho(m, u, f.local_id, 2, estado='PREPARADO')
+        d3 = _crear_despacho(m, u, f.local_id, 3, estado='PENDIENTE')
+        v = version_despachos_activos()
+        with self.captureOnCommitCallbacks(execute=True), mock.patch('appnproylogico.services.eventos_service.publicar_evento') as publicar:
+            res = DespachoStateMachine(u).apply_transitions([
+                (d1.codigo_despacho, 'EN_CAMINO'),
+                {'codigo': d2.codigo_despacho, 'estado': 'en_camino', 'mensaje': 'salida turno'},
+                (d3.codigo_despacho, 'ENTREGADO'),
+                ('NO-EXISTE', 'ANULADO'),
+                (d1.codigo_despacho, 'ENTREGADO'),
+            ])
+        assert [r['ok'] for r in res] == [True, True, False, False, True]
+        assert res[2]['error'] == 'Transición de estado no permitida'
+        assert res[3]['error'] == 'Despacho no encontrado'
+        assert Despacho.objects.get(pk=d1.pk).estado == 'ENTREGADO'
+        assert Despacho.objects.get(pk=d2.pk).estado == 'EN_CAMINO'
+        assert Despacho.objects.get(pk=d3.pk).estado == 'PENDIENTE'
+        assert MovimientoDespacho.objects.count() == 3
+        assert AuditoriaGeneral.objects.filter(tipo_operacion='MOV').count() == 3
+        assert version_despachos_activos() != v
+        # Un evento por despacho cambiado, con el estado previo al lote
+        eventos = {e.args[0]['codigo']: e.args[0] for e in publicar.call_args_list}
+        assert (eventos[d1.codigo_despacho]['estado_anterior'], eventos[d1.codigo_despacho]['estado']) == ('PREPARADO', 'ENTREGADO')
+        assert eventos[d2.codigo_despacho]['estado_anterior'] == 'PREPARADO'
+
+
+class MovimientosLoteTest(TestCase):
+    def test_endpoint_json_devuelve_resultado_por_item(self):
+        import json
+        from django.urls import reverse
+        from appnproylogico.models import Despacho
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1)
+        despachos = [_crear_despacho(m, u, f.local_id, n, estado='PREPARADO') for n in range(1, 6)]
+        self.client.force_login(_superusuario_con_perfil(u, 'lote'))
+        items = [{'codigo': d.codigo_despacho, 'estado': 'EN_CAMINO'} for d in despachos] + [{'codigo': despachos[0].codigo_despacho, 'estado': 'PENDIENTE'}]
+        r = self.client.post(reverse('registrar_movimientos_lote'), data=json.dumps({'items': items}), content_type='application/json')
+        assert r.status_code == 200
+        data = r.json()
+        assert data['aplicados'] == 5 and data['rechazados'] == 1
+        assert data['resultados'][-1]['error'] == 'Transición de estado no permitida'
+        assert Despacho.objects.filter(estado='EN_CAMINO').count() == 5
+
+    def test_items_mal_formados_fallan_solos(self):
+        import json
+        from django.urls import reverse
+        from appnproylogico.models import Despacho
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1)
+        d = _crear_despacho(m, u, f.local_id, 1, estado='PREPARADO')
+        self.client.force_login(_superusuario_con_perfil(u, 'lote'))
+        items = [[d.codigo_despacho], {'codigo': 123, 'estado': 'EN_CAMINO'}, 'texto', [d.codigo_despacho, 'EN_CAMINO']]
+        r = self.client.post(reverse('registrar_movimientos_lote'), data=json.dumps({'items': items}), content_type='application/json')
+        assert r.status_code == 200
+        data = r.json()
+        assert [x['ok'] for x in data['resultados']] == [False, False, False, True]
+        assert all(x['error'] for x in data['resultados'][:3])
+        assert Despacho.objects.get(pk=d.pk).estado == 'EN_CAMINO'
+
+    def test_sin_perfil_usuario_responde_403_sin_tocar_despachos(self):
+        import json
+        from django.contrib.auth.models import User
+        from django.urls import reverse
+        from appnproylogico.models import Despacho, MovimientoDespacho
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1)
+        d = _crear_despacho(m, u, f.local_id, 1, estado='PREPARADO')
+        self.client.force_login(User.objects.create_superuser('lote', 'l@example.com', 'x'))
+        r = self.client.post(reverse('registrar_movimientos_lote'), data=json.dumps({'items': [[d.codigo_despacho, 'EN_CAMINO']]}), content_type='application/json')
+        assert r.status_code == 403
+        assert Despacho.objects.get(pk=d.pk).estado == 'PREPARADO'
+        assert not MovimientoDespacho.objects.exists()
+
+    def test_formulario_get_y_post(self):
+        from django.urls import reverse
+        from appnproylogico.models import Despacho
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1)
+        d1 = _crear_despacho(m, u, f.local_id, 1, estado='PREPARADO')
+        d2 = _crear_despacho(m, u, f.local_id, 2, estado='PREPARADO')
+        self.client.force_login(_superusuario_con_perfil(u, 'lote'))
+        r = self.client.get(reverse('registrar_movimientos_lote'))
+        assert r.status_code == 200
+        assert 'movimientos/registrar-lote.html' in [t.name for t in r.templates]
+        r = self.client.post(reverse('registrar_movimientos_lote'), {'lineas': f'{d1.codigo_despacho} EN_CAMINO\n{d2.codigo_despacho} ENTREGADO'})
+        assert r.status_code == 200
+        assert r.context['aplicados'] == 1 and len(r.context['resultados']) == 2
+        assert Despacho.objects.get(pk=d1.pk).estado == 'EN_CAMINO'
+        assert Despacho.objects.get(pk=d2.pk).estado == 'PREPARADO'
+        assert 'Transición de estado no permitida' in r.content.decode()
+
+    def test_items_desde_formulario(self):
+        from django.http import QueryDict
+        from appnproylogico.views import _items_lote_desde_form
+        post = QueryDict(mutable=True)
+        post['lineas'] = 'DSP-1 ENTREGADO\nDSP-2,FALLIDO\n'
+        post['codigos'] = 'DSP-3, DSP-4'
+        post['estado'] = 'EN_CAMINO'
+        items = _items_lote_desde_form(post)
+        assert [(i['codigo'], i['estado']) for i in items] == [('DSP-1', 'ENTREGADO'), ('DSP-2', 'FALLIDO'), ('DSP-3', 'EN_CAMINO'), ('DSP-4', 'EN_CAMINO')]
+
+
+class CierreDiaIncrementalTest(TestCase):
+    def test_cierre_repetido_solo_agrega_nuevos(self):
+        import json
+        import tempfile
+        from django.test import override_settings
+        from django.utils import timezone
+        from appnproylogico.services.cierre_service import archivo_cierre, cerrar_dia
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1)
+        hoy = timezone.localdate()
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+            for n in range(1, 4):
+                _crear_despacho(m, u, f.local_id, n, estado='ENTREGADO' if n == 1 else 'PENDIENTE')
+            cierre, nuevas = cerrar_dia(hoy)
+            assert nuevas == 3 and cierre.total == 3 and cierre.entregados == 1
+            assert cierre.por_farmacia[f.local_id]['nombre'] == f.local_nombre
+            _crear_despacho(m, u, f.local_id, 4)
+            from django.db import connection
+            from django.test.utils import CaptureQueriesContext
+            with CaptureQueriesContext(connection) as ctx:
+                cierre, nuevas = cerrar_dia(hoy)
+            # + savepoint/release de la transacción que bloquea el cierre
+            assert len(ctx.captured_queries) <= 8
+            assert nuevas == 1 and cierre.filas_archivo == 4
+            with open(archivo_cierre(hoy), encoding='utf-8') as fh:
+                filas = json.load(fh)
+            assert [r[1] for r in filas] == [f'DSP-T-{n:05d}' for n in range(1, 5)]
+            cierre, nuevas = cerrar_dia(hoy, since=0)
+            assert nuevas == 4 and cierre.filas_archivo == 4
+
+    def test_fallo_a_mitad_no_deja_filas_ni_avanza_checkpoint(self):
+        import json
+        import tempfile
+        from unittest import mock
+        from django.test import override_settings
+        from django.utils import timezone
+        from appnproylogico.models import CierreDia
+        from appnproylogico.services import cierre_service
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1)
+        hoy = timezone.localdate()
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+            _crear_despacho(m, u, f.local_id, 1)
+            cierre_service.cerrar_dia(hoy)
+            path = cierre_service.archivo_cierre(hoy)
+            antes = path.read_bytes()
+            for n in range(2, 5):
+                _crear_despacho(m, u, f.local_id, n)
+            original = cierre_service._filas_despacho_detalle
+            llamadas = []
+
+            def falla_en_la_segunda(d):
+                llamadas.append(d.id)
+                if len(llamadas) == 2:
+                    raise RuntimeError('fallo de prueba')
+                return original(d)
+            with mock.patch.object(cierre_service, '_filas_despacho_detalle', falla_en_la_segunda):
+                with self.assertRaises(RuntimeError):
+                    cierre_service.cerrar_dia(hoy)
+            assert path.read_bytes() == antes
+            assert CierreDia.objects.get(fecha=hoy).filas_archivo == 1
+            cierre, nuevas = cierre_service.cerrar_dia(hoy)
+            assert nuevas == 3
+            with open(path, encoding='utf-8') as fh:
+                assert [r[1] for r in json.load(fh)] == [f'DSP-T-{n:05d}' for n in range(1, 5)]
+
+
+class GenerateLoadDatasetTest(TestCase):
+    def test_dataset_reproducible_por_semilla(self):
+        from datetime import date
+        from io import StringIO
+        from django.core.management import call_command
+        from appnproylogico.models import Despacho, MovimientoDespacho
+        call_command('generate_load_dataset', despachos=300, farmacias=5, motoristas=8, dias=10, seed=7, hasta='2025-06-30', prefijo='LTA', batch_size=100, stdout=StringIO())
+        call_command('generate_load_dataset', despachos=300, farmacias=5, motoristas=8, dias=10, seed=7, hasta='2025-06-30', prefijo='LTB', batch_size=100, stdout=StringIO())
+        campos = ('estado', 'tipo_despacho', 'prioridad', 'fecha_registro', 'fecha_completado')
+        a = list(Despacho.objects.filter(codigo_despacho__startswith='LTA-').order_by('id').values_list(*campos))
+        b = list(Despacho.objects.filter(codigo_despacho__startswith='LTB-').order_by('id').values_list(*campos))
+        assert len(a) == 300 and a == b
+        assert max(r[3] for r in a).date() <= date(2025, 6, 30)
+        # Cada despacho tiene su cadena de movimientos desde PENDIENTE
+        assert MovimientoDespacho.objects.filter(estado_anterior__isnull=True).count() == 600
+        assert not Despacho.objects.filter(estado='ENTREGADO', fecha_completado__isnull=True).exists()
+
+    def test_despachos_demo_cuenta_solo_insertados(self):
+        from django.utils import timezone
+        from appnproylogico import views
+        from appnproylogico.models import Despacho
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1)
+        ahora = timezone.now()
+        _crear_despacho(m, u, f.local_id, 1, codigo_despacho=f"DSP-{ahora.strftime('%Y%m%d')}-0002")
+        assert views._crear_despachos_demo(u, ahora, n=5, farms=[f], mots=[m]) == 4
+        assert views._crear_despachos_demo(u, ahora, n=5, farms=[f], mots=[m]) == 0
+        assert Despacho.objects.filter(codigo_despacho__startswith=f"DSP-{ahora.strftime('%Y%m%d')}-").count() == 5
+
+
+class MetricasDashboardTest(TestCase):
+    def test_snapshot_cacheado_e_invalidado(self):
+        from django.core.cache import cache
+        from appnproylogico.repositories import metricas_dashboard
+        cache.clear()
+        rol = _crear_rol()
+        _crear_motorista(rol, 1)
+        _crear_farmacia(1)
+        with self.assertNumQueries(1):
+            datos = metricas_dashboard()
+        assert datos['total_farmacias'] == 1 and datos['total_motoristas'] == 1
+        with self.assertNumQueries(0):
+            metricas_dashboard()
+        _crear_farmacia(2)
+        assert metricas_dashboard()['total_farmacias'] == 2
+
+    def test_home_no_escribe(self):
+        from django.contrib.auth.models import User
+        from appnproylogico.models import Moto
+        admin = User.objects.create_superuser('home', 'h@example.com', 'x')
+        self.client.force_login(admin)
+        self.client.get('/')
+        assert Moto.objects.count() == 0
+
+
+class FixturesEstaticosTest(TestCase):
+    def test_memo_por_mtime_y_registros_inmutables(self):
+        import json, os, pathlib, tempfile
+        from unittest import mock
+        from appnproylogico.services import fixtures_estaticos as fx
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(fx, 'DATA_DIR', pathlib.Path(tmp)):
+            path = pathlib.Path(tmp) / 'movimientos.json'
+            path.write_text(json.dumps([{'despacho_id': 7, 'estado_nuevo': 'ENTREGADO', 'fecha_movimiento': '2025-01-01'}]))
+            a = fx.registros('movimientos.json', fx.MovimientoFixture)
+            assert fx.registros('movimientos.json', fx.MovimientoFixture) is a
+            assert a[0].despacho.id == 7 and a[0].estado_nuevo == 'ENTREGADO'
+            with self.assertRaises(AttributeError):
+                a[0].estado_nuevo = 'FALLIDO'
+            with self.assertRaises(TypeError):
+                fx.cargar_lista('movimientos.json')[0]['estado_nuevo'] = 'FALLIDO'
+            path.write_text(json.dumps([]))
+            st = path.stat()
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+            assert fx.registros('movimientos.json', fx.MovimientoFixture) == ()
+            assert fx.registros('no_existe.json', fx.RecetaFixture) == ()
+            (pathlib.Path(tmp) / 'despachos_activos.json').write_text(json.dumps([[1, 'DSP-0001', 'PENDIENTE'], {'id': 2}]))
+            assert fx.cargar_filas('despachos_activos.json') == ((1, 'DSP-0001', 'PENDIENTE'),)
+
+
+class BusquedaConsultaRapidaTest(TestCase):
+    def test_indice_normalizado_y_keyset(self):
+        from appnproylogico.services.busqueda_service import buscar
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1, local_nombre='Farmacia Ñuñoa Centro')
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                _crear_despacho(m, u, f.local_id, i, cliente_nombre='José Pérez')
+            _crear_despacho(m, u, f.local_id, 9, cliente_nombre='Otra Persona')
+        filas, siguiente = buscar(local='nunoa', cliente='JOSE per', limite=3)
+        assert len(filas) == 3 and siguiente
+        resto, fin = buscar(local='nunoa', cliente='jose', despues=siguiente, limite=3)
+        assert len(resto) == 2 and fin is None
+        assert not {r.despacho_id for r in filas} & {r.despacho_id for r in resto}
+        with self.captureOnCommitCallbacks(execute=True):
+            u.apellido = 'Renombrado'
+            u.save()
+        assert len(buscar(motorista='renombrado')[0]) == 6
+
+    def test_cambio_de_local_id_actualiza_el_indice(self):
+        from appnproylogico.models import BusquedaDespacho, Despacho
+        from appnproylogico.services.busqueda_service import buscar
+        rol = _crear_rol()
+        u, m = _crear_motorista(rol, 1)
+        f = _crear_farmacia(1, local_nombre='Farmacia Vieja')
+        with self.captureOnCommitCallbacks(execute=True):
+            despachos = [_crear_despacho(m, u, f.local_id, i) for i in range(3)]
+        # Un despacho ya migrado al id nuevo (sin señales, como un UPDATE en la base)
+        Despacho.objects.filter(pk=despachos[0].pk).update(farmacia_origen_local_id='LF-NUEVO')
+        with self.captureOnCommitCallbacks(execute=True):
+            f.local_id = 'LF-NUEVO'
+            f.local_nombre = 'Farmacia Nueva'
+            f.save()
+        assert len(buscar(local='nueva')[0]) == 3
+        assert not buscar(local='vieja')[0]
+        assert BusquedaDespacho.objects.get(despacho=despachos[0]).local_id == 'LF-NUEVO'
+
+
+class ImportarFarmaciasBulkTest(TestCase):
+    def test_insercion_por_lotes_y_upsert(self):
+        import math
+        from appnproylogico.models import Localfarmacia
+        from appnproylogico.services.farmacias_import_service import importar_farmacias, iter_tablas
+        _crear_farmacia(0)
+        filas = ['local_id,nombre,direccion,comuna,lat,lng'] + [f'LF-{i},Local {i},Calle {i},Santiago,-33.4,-70.6' for i in range(200)]
+        texto = '\n'.join(filas + ['LF-5,Repetida,Calle,Santiago,,'])
+        # Lote chico para que ningún backend parta el INSERT por su límite de parámetros:
+        # 4 lecturas (local_id existentes, regiones, comunas, localidades) + un INSERT por lote
+        with self.assertNumQueries(4 + math.ceil(199 / 25)):
+            resumen = importar_farmacias(iter_tablas(csv_text=texto), batch_size=25)
+        # LF-0 ya existía y LF-5 viene dos veces en el archivo
+        assert resumen['creados'] == 199 and resumen['duplicados'] == 2
+        assert 'Duplicado en el archivo local_id=LF-5' in resumen['mensajes']
+        assert Localfarmacia.objects.count() == 200
+        texto = 'local_id,nombre,direccion,comuna\nLF-0,Farmacia Renombrada,Calle 1,Santiago\nLF-1,Local 1,Calle 1,Santiago'
+        resumen = importar_farmacias(iter_tablas(csv_text=texto), upsert=True)
+        assert resumen['actualizados'] == 2 and resumen['creados'] == 0
+        assert Localfarmacia.objects.get(local_id='LF-0').local_nombre == 'Farmacia Renombrada'
+
+
+class GeoIndiceTest(TestCase):
+    def test_grilla_equivale_a_fuerza_bruta(self):
+        import random
+        from appnproylogico.services.geo_service import IndiceGeo, haversine_km
+        rng = random.Random(7)
+        puntos = [(i, -33.45 + rng.uniform(-0.2, 0.2), -70.65 + rng.uniform(-0.2, 0.2)) for i in range(3000)]
+        indice = IndiceGeo()
+        for pk, lat, lng in puntos:
+            indice.agregar(pk, lat, lng)
+        q = (-33.44, -70.64)
+        bruto = sorted((haversine_km(*q, lat, lng), pk) for pk, lat, lng in puntos)
+        assert [pk for _, pk, _ in indice.cercanos(*q, 10)] == [pk for _, pk in bruto[:10]]
+        assert {pk for _, pk, _ in indice.en_radio(*q, 2.0)} == {pk for d, pk in bruto if d <= 2.0}
+
+    def test_consulta_lejana_no_recorre_celdas_vacias(self):
+        import random
+        from unittest import mock
+        from appnproylogico.services.geo_service import IndiceGeo, haversine_km
+        rng = random.Random(3)
+        puntos = [(i, -33.45 + rng.uniform(-0.1, 0.1), -70.65 + rng.uniform(-0.1, 0.1)) for i in range(1000)]
+        indice = IndiceGeo()
+        for pk, lat, lng in puntos:
+            indice.agregar(pk, lat, lng)
+        visitadas = []
+        evaluar = indice._evaluar
+
+        def contar(lat, lng, claves, *args, **kwargs):
+            claves = list(claves)
+            visitadas.append(len(claves))
+            return evaluar(lat, lng, claves, *args, **kwargs)
+        for q in ((-18.45, -70.65), (0.0, 0.0), (-33.45, 70.65)):
+            visitadas.clear()
+            with mock.patch.object(indice, '_evaluar', contar):
+                cercanos = indice.cercanos(*q, 5)
+                en_radio = indice.en_radio(*q, 2000)
+            bruto = sorted((haversine_km(*q, lat, lng), pk) for pk, lat, lng in puntos)
+            assert [pk for _, pk, _ in cercanos] == [pk for _, pk in bruto[:5]]
+            assert len(en_radio) == sum(1 for d, _ in bruto if d <= 2000)
+            assert sum(visitadas) <= 2 * len(indice.celdas)
+
+    def test_nearest_farmacias_se_invalida_al_guardar(self):
+        from appnproylogico.services.geo_service import nearest_farmacias
+        _crear_farmacia(1, local_lat=-33.40, local_lng=-70.60)
+        _crear_farmacia(2, local_lat=-33.50, local_lng=-70.70)
+        assert nearest_farmacias(-33.41, -70.61, k=1)[0]['local_id'] == 'LF-1'
+        _crear_farmacia(3, local_lat=-33.411, local_lng=-70.611)
+        assert nearest_farmacias(-33.41, -70.61, k=1)[0]['local_id'] == 'LF-3'
+
+
+class AutoAsignacionTest(TestCase):
+    def _motorista_con_moto(self, rol, n, farmacia):
+        import datetime
+        from django.utils import timezone
+        from appnproylogico.models import AsignacionMotoMotorista, AsignacionMotoristaFarmacia, Moto
+        now = timezone.now()
+        u, m = _crear_motorista(rol, n)
+        moto = Moto.objects.create(patente=f'AA{n:04d}', marca='HONDA', modelo='STD', propietario_nombre='LOGICO SPA', propietario_tipo_documento='RUT', propietario_documento=f'RUT-{n}', tipo_combustible='GASOLINA', numero_motor=f'MOT-{n}', numero_chasis=f'CHA-{n}', fecha_inscripcion=datetime.date(2020, 1, 1), estado='ACTIVO', kilometraje_actual=0, activo=True, fecha_creacion=now, fecha_modificacion=now)
+        AsignacionMotoMotorista.objects.create(motorista=m, moto=moto, fecha_asignacion=now, kilometraje_inicio=0, activa=True)
+        AsignacionMotoristaFarmacia.objects.create(motorista=m, farmacia=farmacia, fecha_asignacion=now, activa=True)
+        return u, m
+
+    def test_asigna_por_cercania_y_respeta_capacidad(self):
+        from appnproylogico.models import Despacho, MovimientoDespacho
+        from appnproylogico.services.asignacion_service import auto_asignar
+        rol = _crear_rol()
+        norte = _crear_farmacia(1, local_lat=-33.40, local_lng=-70.60)
+        sur = _crear_farmacia(2, local_lat=-33.50, local_lng=-70.60)
+        u1, m_norte = self._motorista_con_moto(rol, 1, norte)
+        _, m_sur = self._motorista_con_moto(rol, 2, sur)
+        pendientes = [_crear_despacho(m_norte, u1, sur.local_id, n) for n in range(1, 4)]
+        alta = _crear_despacho(m_norte, u1, norte.local_id, 9, prioridad='ALTA')
+        with self.settings(ASIGNACION_CAPACIDAD=2):
+            resumen = auto_asignar(usuario=u1)
+        assert resumen['metodo'] == 'hungaro' and resumen['aplicados'] == 4
+        assert Despacho.objects.get(pk=alta.pk).motorista_id == m_norte.id
+        por_motorista = {d.motorista_id for d in Despacho.objects.filter(pk__in=[d.pk for d in pendientes])}
+        assert por_motorista == {m_sur.id, m_norte.id}
+        assert Despacho.objects.filter(motorista=m_sur, estado='ASIGNADO').count() == 2
+        assert MovimientoDespacho.objects.filter(estado_nuevo='ASIGNADO').count() == 4
+
+    def test_comando_exige_usuario_para_aplicar(self):
+        from io import StringIO
+        from django.core.management import CommandError, call_command
+        from appnproylogico.models import Despacho
+        rol = _crear_rol()
+        norte = _crear_farmacia(1, local_lat=-33.40, local_lng=-70.60)
+        u1, m_norte = self._motorista_con_moto(rol, 1, norte)
+        d = _crear_despacho(m_norte, u1, norte.local_id, 1)
+        with self.settings(ASIGNACION_USUARIO_SISTEMA=''):
+            with self.assertRaises(CommandError):
+                call_command('auto_asignar', stdout=StringIO())
+            assert Despacho.objects.get(pk=d.pk).estado == 'PENDIENTE'
+            call_command('auto_asignar', usuario=u1.id, stdout=StringIO())
+        assert Despacho.objects.get(pk=d.pk).estado == 'ASIGNADO'
+
+    def test_post_aplica_la_vista_previa(self):
+        from django.urls import reverse
+        from appnproylogico.models import Despacho
+        rol = _crear_rol()
+        norte = _crear_farmacia(1, local_lat=-33.40, local_lng=-70.60)
+        u1, m_norte = self._motorista_con_moto(rol, 1, norte)
+        previos = [_crear_despacho(m_norte, u1, norte.local_id, n) for n in range(1, 3)]
+        self.client.force_login(_superusuario_con_perfil(u1, 'asigna'))
+        r = self.client.get(reverse('auto_asignar_despachos'))
+        assert r.status_code == 200
+        token = r.context['resumen']['token']
+        assert len(r.context['resumen']['propuestas']) == 2
+        # Llega otro PENDIENTE después de la vista previa: no estaba en lo aprobado
+        nuevo = _crear_despacho(m_norte, u1, norte.local_id, 3)
+        r = self.client.post(reverse('auto_asignar_despachos'), {'token': token})
+        assert r.status_code == 302
+        assert set(Despacho.objects.filter(estado='ASIGNADO').values_list('id', flat=True)) == {d.pk for d in previos}
+        assert Despacho.objects.get(pk=nuevo.pk).estado == 'PENDIENTE'
+        r = self.client.post(reverse('auto_asignar_despachos'), data='{"token": "alterado"}', content_type='application/json')
+        assert r.status_code == 400
+
+
+class RutasPlanificacionTest(TestCase):
+    def test_ordena_paradas_y_replanifica_al_reasignar(self):
+        from decimal import Decimal
+        from appnproylogico.models import Despacho, Ruta, RutaParada
+        rol = _crear_rol()
+        u1, m1 = _crear_motorista(rol, 1)
+        _, m2 = _crear_motorista(rol, 2)
+        farmacia = _crear_farmacia(1, local_lat=Decimal('-33.40'), local_lng=Decimal('-70.60'))
+        with self.captureOnCommitCallbacks(execute=True):
+            # Creados en desorden de distancia: lejos, cerca, medio
+            lejos = _crear_despacho(m1, u1, farmacia.local_id, 1, estado='ASIGNADO', destino_lat=Decimal('-33.43'), destino_lng=Decimal('-70.60'))
+            cerca = _crear_despacho(m1, u1, farmacia.local_id, 2, estado='ASIGNADO', destino_lat=Decimal('-33.41'), destino_lng=Decimal('-70.60'))
+            medio = _crear_despacho(m1, u1, farmacia.local_id, 3, estado='ASIGNADO', destino_lat=Decimal('-33.42'), destino_lng=Decimal('-70.60'))
+            _crear_despacho(m1, u1, farmacia.local_id, 4)
+        ruta = Ruta.objects.get(motorista=m1)
+        assert ruta.paradas == 3 and ruta.farmacia_origen_local_id == farmacia.local_id
+        orden = list(RutaParada.objects.filter(ruta=ruta).order_by('orden').values_list('despacho_id', flat=True))
+        assert orden == [cerca.pk, medio.pk, lejos.pk]
+        assert abs(float(ruta.distancia_km) - 3.34) < 0.05
+        with self.captureOnCommitCallbacks(execute=True):
+            Despacho.objects.filter(pk=medio.pk).update(motorista=m2)
+            Despacho.objects.get(pk=medio.pk).save()
+        assert list(RutaParada.objects.filter(ruta__motorista=m1).order_by('orden').values_list('despacho_id', flat=True)) == [cerca.pk, lejos.pk]
+        assert RutaParada.objects.get(despacho=medio).ruta.motorista_id == m2.id
+
+
+class PaginacionKeysetTest(TestCase):
+    def _recorrer(self, qs, orden, por_pagina):
+        from appnproylogico.services.paginacion_service import paginar
+        paginas = [paginar(qs, None, orden, por_pagina)]
+        while paginas[-1].has_next():
+            paginas.append(paginar(qs, paginas[-1].next_page_number(), orden, por_pagina))
+        return paginas
+
+    def test_recorre_igual_que_offset_y_vuelve_atras(self):
+        from appnproylogico.models import Localfarmacia
+        from appnproylogico.services.paginacion_service import paginar
+        for n in range(1, 26):
+            _crear_farmacia(n)
+        qs = Localfarmacia.objects.all()
+        # Orden con empates (misma comuna): el id desempata
+        for orden in ('local_nombre', '-comuna_nombre'):
+            paginas = self._recorrer(qs, orden, 10)
+            esperado = list(qs.order_by(orden, '-id' if orden.startswith('-') else 'id').values_list('id', flat=True))
+            assert [p.number for p in paginas] == [1, 2, 3]
+            assert [f.id for p in paginas for f in p] == esperado
+            assert paginas[0].paginator.count == 25 and paginas[0].paginator.num_pages == 3
+            atras = paginar(qs, paginas[2].previous_page_number(), orden, 10)
+            assert atras.number == 2 and [f.id for f in atras] == [f.id for f in paginas[1]]
+            assert paginas[1].previous_page_number() == 1
+        # Enlaces viejos con número: primera página, sin OFFSET; 'last' sigue disponible
+        primera = self._recorrer(qs, 'local_nombre', 10)[0]
+        assert [f.id for f in paginar(qs, '2', 'local_nombre', 10)] == [f.id for f in primera]
+        ultima = paginar(qs, 'last', 'local_nombre', 10)
+        assert ultima.number == 3 and not ultima.has_next() and ultima.has_previous()
+        assert paginar(qs, 'basura', 'local_nombre', 10).number == 1
+
+    def test_solo_la_primera_pagina_cuenta(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from appnproylogico.models import Localfarmacia
+        from appnproylogico.services.paginacion_service import paginar
+        for n in range(1, 26):
+            _crear_farmacia(n)
+        qs = Localfarmacia.objects.filter(activo=True)
+        with CaptureQueriesContext(connection) as primera:
+            pagina = paginar(qs, None, 'local_nombre', 10)
+        assert any('COUNT(' in q['sql'] for q in primera.captured_queries)
+        with CaptureQueriesContext(connection) as siguientes:
+            segunda = paginar(qs, pagina.next_page_number(), 'local_nombre', 10)
+            paginar(qs, segunda.next_page_number(), 'local_nombre', 10)
+        assert len(siguientes.captured_queries) == 2
+        assert not any('COUNT(' in q['sql'] for q in siguientes.captured_queries)
+        assert segunda.paginator.count == 25 and segunda.number == 2
+        with CaptureQueriesContext(connection) as numerica:
+            assert paginar(qs, '3', 'local_nombre', 10).number == 1
+        assert not any('OFFSET' in q['sql'] for q in numerica.captured_queries)
+
+    def test_conteo_estimado_sobre_umbral(self):
+        from appnproylogico.models import Localfarmacia
+        from appnproylogico.services.paginacion_service import contar
+        for n in range(1, 6):
+            _crear_farmacia(n)
+        assert contar(Localfarmacia.objects.all(), exacto_max=10) == (5, False)
+        total, estimado = contar(Localfarmacia.objects.all(), exacto_max=3)
+        assert estimado and total >= 4
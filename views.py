@@ -18,39 +18,31 @@ except Exception:
         return _wrap
 from .auth_decorators import permiso_requerido, rol_requerido, solo_admin
 from .roles import obtener_permisos_usuario, obtener_rol_usuario
+import csv
 import datetime
-from django.http import HttpResponse
-from django.db import connection
-from .repositories import get_despachos_activos, get_resumen_operativo_hoy, get_resumen_operativo_mes, get_resumen_operativo_anual
-from .repositories import normalize_from_normalizacion
+import json
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.db import connection, transaction
+from .repositories import get_despachos_activos_page, get_despachos_activos_snapshot, version_despachos_activos, get_resumen_operativo_hoy, get_resumen_operativo_mes, get_resumen_operativo_anual
+from .repositories import filtro_periodo, metricas_dashboard
+from .services.eventos_service import evento_despacho, publicar_evento, stream_sse, stream_sse_sync
+from .services.paginacion_service import PAGINACION_CONTEO_EXACTO_MAX, paginar
+from .services.reportes_service import FORMATOS_ASYNC, construir_export, encolar_reporte, media_root, normalizar_parametros, render_archivo
 from django.utils import timezone
 from django.db.models import Q
 from django.conf import settings
 import logging
 log = logging.getLogger('appnproylogico')
 
-def _cliente_normalizado(nombre: str):
-    s = (nombre or '').strip()
-    import re
-    m = re.match(r'(?i)^cliente\s+(\d+)$', s)
-    if not m:
-        return s or 'Cliente Uno'
-    n = int(m.group(1))
-    mapa = {
-        0: 'cero', 1: 'uno', 2: 'dos', 3: 'tres', 4: 'cuatro', 5: 'cinco', 6: 'seis', 7: 'siete', 8: 'ocho', 9: 'nueve',
-        10: 'diez', 11: 'once', 12: 'doce', 13: 'trece', 14: 'catorce', 15: 'quince', 16: 'dieciséis', 17: 'diecisiete', 18: 'dieciocho', 19: 'diecinueve', 20: 'veinte'
-    }
-    return f"Cliente {mapa.get(n, 'uno')}"
-
 def _ingestar_motos_json():
     try:
         from .models import Moto
-        import json, pathlib, random
-        base = pathlib.Path(__file__).resolve().parents[1] / 'static' / 'data' / 'motos.json'
-        if not base.exists():
+        import random
+        from .services.fixtures_estaticos import cargar_lista
+        raw = cargar_lista('motos.json')
+        if not raw:
             return 0
-        with open(base, 'r', encoding='utf-8') as f:
-            raw = json.load(f) or []
         nuevos = []
         from django.utils import timezone as _tz
         now_dt = _tz.now()
@@ -146,133 +138,15 @@ def _sintetizar_motos_objetivo():
         return 0
 
 def _can_transition(estado_actual: str, nuevo: str, tipo_despacho: str, receta_retenida: bool, receta_devuelta: bool):
-    ea = (estado_actual or '').strip().upper()
-    nv = (nuevo or '').strip().upper()
-    td = (tipo_despacho or '').strip().upper()
-    mapa = {
-        'PENDIENTE': {'ASIGNADO', 'ANULADO'},
-        'ASIGNADO': {'PREPARANDO', 'ANULADO'},
-        'PREPARANDO': {'PREPARADO', 'ANULADO'},
-        'PREPARADO': {'EN_CAMINO', 'ANULADO'},
-        'EN_CAMINO': {'ENTREGADO', 'FALLIDO'},
-    }
-    permitidos = mapa.get(ea, set())
-    if nv not in permitidos:
-        return False, 'Transición de estado no permitida'
-    if td == 'REENVIO_RECETA' and nv == 'PREPARADO':
-        if not (receta_retenida and receta_devuelta):
-            return False, 'Receta retenida requiere devolución antes de PREPARADO'
-    return True, ''
+    from .services.despacho_estado_service import validar_transicion
+    return validar_transicion(estado_actual, nuevo, tipo_despacho, receta_retenida, receta_devuelta)
 
 # ===== AUTENTICACIÓN =====
 def home(request):
     """Vista de home/dashboard"""
     if request.user.is_authenticated:
-        try:
-            tf = Farmacia.objects.filter(activo=True).count()
-        except Exception:
-            tf = 0
-        try:
-            tm = Motorista.objects.filter(activo=True).count()
-        except Exception:
-            tm = 0
-        try:
-            to_total = Moto.objects.count()
-            if to_total < 56:
-                from django.utils import timezone as _tz
-                now_dt = _tz.now()
-                current_inactive = Moto.objects.filter(activo=False).count()
-                need_inactive = max(3 - current_inactive, 0)
-                need_total = 56 - to_total
-                need_active = max(need_total - need_inactive, 0)
-                created = 0
-                idx_seed = to_total
-                # Crear activas primero
-                for i in range(need_active):
-                    idx_seed += 1
-                    pat = f"PX{idx_seed:04d}" if idx_seed <= 9999 else f"PX{idx_seed}"
-                    if Moto.objects.filter(patente=pat).exists():
-                        continue
-                    m = Moto(
-                        patente=pat,
-                        marca='GENERICA', modelo='STD', tipo_combustible='GASOLINA',
-                        fecha_inscripcion=datetime.date(2020,1,1), kilometraje_actual=0, activo=True,
-                        numero_motor=f'MOTOR-{pat}', numero_chasis=f'CHASIS-{pat}',
-                        propietario_nombre='LOGICO SPA', propietario_tipo_documento='RUT', propietario_documento=f'RUT-{pat}',
-                        anio=2020, cilindrada_cc=150, color='NEGRO', fecha_creacion=now_dt, fecha_modificacion=now_dt,
-                        usuario_modificacion=None,
-                    )
-                    try:
-                        m.save(); created += 1
-                    except Exception:
-                        pass
-                # Crear inactivas restantes
-                for i in range(need_inactive):
-                    idx_seed += 1
-                    pat = f"PX{idx_seed:04d}" if idx_seed <= 9999 else f"PX{idx_seed}"
-                    if Moto.objects.filter(patente=pat).exists():
-                        continue
-                    m = Moto(
-                        patente=pat,
-                        marca='GENERICA', modelo='STD', tipo_combustible='GASOLINA',
-                        fecha_inscripcion=datetime.date(2020,1,1), kilometraje_actual=0, activo=False,
-                        numero_motor=f'MOTOR-{pat}', numero_chasis=f'CHASIS-{pat}',
-                        propietario_nombre='LOGICO SPA', propietario_tipo_documento='RUT', propietario_documento=f'RUT-{pat}',
-                        anio=2020, cilindrada_cc=150, color='NEGRO', fecha_creacion=now_dt, fecha_modificacion=now_dt,
-                        usuario_modificacion=None,
-                    )
-                    try:
-                        m.save(); created += 1
-                    except Exception:
-                        pass
-            to = Moto.objects.count()
-        except Exception:
-            to = 0
-        try:
-            ta = AsignacionMotoMotorista.objects.filter(activa=True).count()
-        except Exception:
-            ta = 0
-        if tf == 0:
-            try:
-                import json, pathlib
-                p = pathlib.Path(__file__).resolve().parents[1] / 'static' / 'data' / 'farmacias.json'
-                with open(p, 'r', encoding='utf-8') as f:
-                    tf = len(json.load(f) or [])
-            except Exception as e:
-                messages.error(request, 'Ocurrió un error al guardar documentos de la moto.')
-                log.error('Error al guardar documentos de moto id=%s error=%s', Moto.pk, e)
-        if tm == 0:
-            try:
-                import json, pathlib
-                p = pathlib.Path(__file__).resolve().parents[1] / 'static' / 'data' / 'motoristas.json'
-                with open(p, 'r', encoding='utf-8') as f:
-                    tm = len(json.load(f) or [])
-            except Exception as e:
-                messages.error(request, 'Ocurrió un error al actualizar documentos de la moto.')
-                log.error('Error al actualizar documentos de moto id=%s error=%s', Moto.pk, e)
-        if to == 0:
-            try:
-                import json, pathlib
-                p = pathlib.Path(__file__).resolve().parents[1] / 'static' / 'data' / 'motos.json'
-                with open(p, 'r', encoding='utf-8') as f:
-                    to = len(json.load(f) or [])
-            except Exception:
-                pass
-        if ta == 0:
-            try:
-                import json, pathlib
-                p = pathlib.Path(__file__).resolve().parents[1] / 'static' / 'data' / 'asignaciones_moto_motorista.json'
-                with open(p, 'r', encoding='utf-8') as f:
-                    ta = sum(1 for a in (json.load(f) or []) if a.get('activa'))
-            except Exception:
-                pass
-        context = {
-            'total_farmacias': tf,
-            'total_motoristas': tm,
-            'total_motos': to,
-            'asignaciones_activas': ta,
-        }
-        return render(request, 'admin/panel-admin.html', context)
+        # Conteos desde el snapshot cacheado (repositories.metricas_dashboard): sin escrituras en GET
+        return render(request, 'admin/panel-admin.html', dict(metricas_dashboard()))
     return redirect('admin:login')
 
 
@@ -374,31 +248,18 @@ def listado_farmacias(request):
             Q(comuna_nombre__icontains=search_query)
         )
 
-    farmacias = farmacias.order_by('local_nombre')
     orden = request.GET.get('orden', '').strip()
     direccion = request.GET.get('dir', 'asc').strip()
+    field = 'local_nombre'
     if orden in ['local_nombre','comuna_nombre','funcionamiento_hora_apertura','funcionamiento_hora_cierre']:
         field = orden if direccion == 'asc' else f'-{orden}'
-        farmacias = farmacias.order_by(field)
 
-    paginator = Paginator(farmacias, 10)
-    page_number = request.GET.get('page')
-    try:
-        page_obj = paginator.page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
-    except EmptyPage:
-        page_obj = paginator.page(paginator.num_pages)
+    page_obj = paginar(farmacias, request.GET.get('page'), field)
 
     samples = []
-    if farmacias.count() == 0:
-        try:
-            import json, pathlib
-            data_path = pathlib.Path(__file__).resolve().parent.parent / 'static' / 'data' / 'farmacias.json'
-            with open(data_path, 'r', encoding='utf-8') as f:
-                samples = json.load(f)
-        except Exception:
-            samples = []
+    if page_obj.paginator.count == 0:
+        from .services.fixtures_estaticos import cargar_lista
+        samples = cargar_lista('farmacias.json')
     context = {
         'page_obj': page_obj,
         'search_query': search_query,
@@ -575,26 +436,12 @@ def listado_motoristas(request):
             Q(emergencia_telefono__icontains=search_query)
         )
 
-    motoristas = motoristas.order_by('usuario__nombre')
-
-    paginator = Paginator(motoristas, 10)
-    page_number = request.GET.get('page')
-    try:
-        page_obj = paginator.page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
-    except EmptyPage:
-        page_obj = paginator.page(paginator.num_pages)
+    page_obj = paginar(motoristas, request.GET.get('page'), 'usuario__nombre')
 
     samples = []
-    if motoristas.count() == 0:
-        try:
-            import json, pathlib
-            data_path = pathlib.Path(__file__).resolve().parent.parent / 'static' / 'data' / 'motoristas.json'
-            with open(data_path, 'r', encoding='utf-8') as f:
-                samples = json.load(f)
-        except Exception:
-            samples = []
+    if page_obj.paginator.count == 0:
+        from .services.fixtures_estaticos import cargar_lista
+        samples = cargar_lista('motoristas.json')
     context = {
         'page_obj': page_obj,
         'search_query': search_query,
@@ -761,11 +608,13 @@ def detalle_motorista(request, pk):
             'activa': 1,
         })
 
+    from .services.rutas_service import rutas_motorista
     context = {
         'motorista': motorista,
         'asignaciones': asignaciones,
         'asignaciones_activas': asignaciones_activas,
         'asignacion_mf_form': asignacion_mf_form,
+        'rutas': rutas_motorista(motorista.pk),
     }
 
     return render(request, 'motoristas/detalle-motorista.html', context)
@@ -808,26 +657,12 @@ def listado_motos(request):
             Q(propietario_nombre__icontains=search_query)
         )
 
-    motos = motos.order_by('patente')
-
-    paginator = Paginator(motos, 10)
-    page_number = request.GET.get('page')
-    try:
-        page_obj = paginator.page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
-    except EmptyPage:
-        page_obj = paginator.page(paginator.num_pages)
+    page_obj = paginar(motos, request.GET.get('page'), 'patente')
 
     samples = []
-    if motos.count() == 0:
-        try:
-            import json, pathlib
-            data_path = pathlib.Path(__file__).resolve().parent.parent / 'static' / 'data' / 'motos.json'
-            with open(data_path, 'r', encoding='utf-8') as f:
-                samples = json.load(f)
-        except Exception:
-            samples = []
+    if page_obj.paginator.count == 0:
+        from .services.fixtures_estaticos import cargar_lista
+        samples = cargar_lista('motos.json')
     context = {
         'page_obj': page_obj,
         'search_query': search_query,
@@ -1050,26 +885,12 @@ def listado_asignaciones(request):
     elif filtro_estado == 'inactiva':
         asignaciones = asignaciones.filter(activa=0)
 
-    asignaciones = asignaciones.order_by('-fecha_asignacion')
-
-    paginator = Paginator(asignaciones, 10)
-    page_number = request.GET.get('page')
-    try:
-        page_obj = paginator.page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
-    except EmptyPage:
-        page_obj = paginator.page(paginator.num_pages)
+    page_obj = paginar(asignaciones, request.GET.get('page'), '-fecha_asignacion')
 
     samples = []
     if page_obj.paginator.count == 0:
-        try:
-            import json, pathlib
-            data_path = pathlib.Path(__file__).resolve().parent.parent / 'static' / 'data' / 'asignaciones_motorista_farmacia.json'
-            with open(data_path, 'r', encoding='utf-8') as f:
-                samples = json.load(f)
-        except Exception:
-            samples = []
+        from .services.fixtures_estaticos import cargar_lista
+        samples = cargar_lista('asignaciones_motorista_farmacia.json')
     context = {
         'page_obj': page_obj,
         'search_query': search_query,
@@ -1171,7 +992,7 @@ def reporte_movimientos(request):
         if tipo == 'diario':
             template = 'reportes/reporte-diario.html'
             if fecha:
-                movimientos = movimientos.filter(fecha_movimiento__date=fecha)
+                movimientos = movimientos.filter(**filtro_periodo('fecha_movimiento', fecha=fecha))
             try:
                 from .repositories import get_resumen_operativo_hoy
                 resumen = get_resumen_operativo_hoy()
@@ -1180,39 +1001,24 @@ def reporte_movimientos(request):
         elif tipo == 'mensual':
             template = 'reportes/reporte-mensual.html'
             if mes:
-                movimientos = movimientos.filter(fecha_movimiento__year=mes.year, fecha_movimiento__month=mes.month)
+                movimientos = movimientos.filter(**filtro_periodo('fecha_movimiento', anio=mes.year, mes=mes.month))
             resumen = get_resumen_operativo_mes(anio=mes.year if mes else None, mes=mes.month if mes else None)
         elif tipo == 'anual':
             template = 'reportes/reporte-anual.html'
             if anio:
-                movimientos = movimientos.filter(fecha_movimiento__year=anio)
+                movimientos = movimientos.filter(**filtro_periodo('fecha_movimiento', anio=anio))
             resumen = get_resumen_operativo_anual(anio=anio)
 
     # Fallback con datos de ejemplo si no hay datos
     mov_list = None
     try:
-        if movimientos.count() == 0:
-            import json, pathlib
-            data_path = pathlib.Path(__file__).resolve().parent.parent / 'static' / 'data' / 'movimientos.json'
-            with open(data_path, 'r', encoding='utf-8') as f:
-                raw = json.load(f)
-            class M:
-                def __init__(self, d):
-                    self.despacho = type('D', (), {'id': d.get('despacho_id')})
-                    self.estado_nuevo = d.get('estado_nuevo')
-                    self.fecha_movimiento = d.get('fecha_movimiento')
-            mov_list = [M(d) for d in raw]
+        if not movimientos.exists():
+            from .services.fixtures_estaticos import MovimientoFixture, registros
+            mov_list = registros('movimientos.json', MovimientoFixture)
     except Exception:
         mov_list = None
 
-    paginator = Paginator((mov_list or movimientos.order_by('-fecha_movimiento')), 10)
-    page_number = request.GET.get('page')
-    try:
-        page_obj = paginator.page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
-    except EmptyPage:
-        page_obj = paginator.page(paginator.num_pages)
+    page_obj = paginar(mov_list or movimientos, request.GET.get('page'), '-fecha_movimiento')
 
     contexto = {
         'form': form,
@@ -1226,254 +1032,72 @@ def reporte_movimientos(request):
 
 @solo_admin
 def importar_farmacias(request):
+    from .services.farmacias_import_service import FORMATOS_IMPORTACION, importar_farmacias as importar, iter_tablas
     mensajes = []
     creados = 0
+    resumen = None
     if request.method == 'POST':
         csv_text = request.POST.get('csv_text', '').strip()
         fichero = request.FILES.get('csv_file')
-        rows = []
-        try:
-            if csv_text:
-                import csv, io
-                sep = '\t' if '\t' in csv_text else ','
-                reader = csv.DictReader(io.StringIO(csv_text), delimiter=sep)
-                rows = list(reader)
-            elif fichero:
-                name = fichero.name.lower()
-                if name.endswith('.csv') or name.endswith('.tsv'):
-                    import csv, io
-                    data = fichero.read().decode('utf-8', errors='ignore')
-                    sep = '\t' if ('\t' in data or name.endswith('.tsv')) else ','
-                    reader = csv.DictReader(io.StringIO(data), delimiter=sep)
-                    rows = list(reader)
-                elif name.endswith('.xlsx'):
-                    import openpyxl
-                    wb = openpyxl.load_workbook(fichero, data_only=True)
-                    for sheet in wb.worksheets:
-                        values = list(sheet.values)
-                        if not values:
-                            continue
-                        headers = [str(h).strip() if h else '' for h in values[0]]
-                        for row in values[1:]:
-                            d = {}
-                            for i, v in enumerate(row):
-                                key = headers[i] if i < len(headers) else f'col_{i}'
-                                d[key] = v if v is not None else ''
-                            rows.append(d)
-                elif name.endswith('.xls'):
-                    import xlrd
-                    book = xlrd.open_workbook(file_contents=fichero.read())
-                    for sh in book.sheets():
-                        if sh.nrows == 0:
-                            continue
-                        headers = [str(sh.cell_value(0, c)).strip() for c in range(sh.ncols)]
-                        for r in range(1, sh.nrows):
-                            d = {}
-                            for c in range(sh.ncols):
-                                d[headers[c]] = sh.cell_value(r, c)
-                            rows.append(d)
-                else:
-                    mensajes.append('Formato no soportado. Usa CSV/TSV/XLSX/XLS.')
-            else:
-                mensajes.append('Debes pegar datos o subir un archivo CSV.')
-            from .models import Localfarmacia, Usuario
+        upsert = request.POST.get('upsert') in ('1', 'true', 'on')
+        if not csv_text and not fichero:
+            mensajes.append('Debes pegar datos o subir un archivo CSV.')
+        elif fichero and not csv_text and not fichero.name.lower().endswith(FORMATOS_IMPORTACION):
+            mensajes.append('Formato no soportado. Usa CSV/TSV/XLSX/XLS.')
+        else:
+            from .models import Usuario
             usuario = Usuario.objects.filter(django_user_id=request.user.id).first()
-            required = {'local_id','local_nombre','local_direccion','comuna_nombre'}
-            for r in rows:
-                def get(*keys):
-                    for k in keys:
-                        if k in r and r[k] is not None:
-                            val = str(r[k]).strip()
-                            if val != '':
-                                return val
-                    return None
-                try:
-                    missing = [k for k in required if not get(k, k.capitalize(), k.title())]
-                    if missing:
-                        mensajes.append(f'Fila inválida: faltan {", ".join(missing)}')
-                        continue
-                    # duplicados por local_id
-                    lid = get('local_id','ID','id') or ''
-                    if Localfarmacia.objects.filter(local_id=lid).exists():
-                        mensajes.append(f'Duplicado saltado local_id={lid}')
-                        continue
-                    apertura = get('funcionamiento_hora_apertura','apertura') or '09:00:00'
-                    cierre = get('funcionamiento_hora_cierre','cierre') or '21:00:00'
-                    from datetime import datetime as dt
-                    def parse_time(s):
-                        for fmt in ('%H:%M:%S','%H:%M'):
-                            try:
-                                return dt.strptime(s, fmt).time()
-                            except:
-                                pass
-                        return dt.strptime('09:00:00','%H:%M:%S').time()
-                    hora_ap = parse_time(apertura)
-                    hora_ci = parse_time(cierre)
-                    fecha_str = get('fecha_actualizacion','fecha','Fecha')
-                    if fecha_str:
-                        try:
-                            fecha = dt.strptime(fecha_str, '%d-%m-%y').date()
-                        except:
-                            fecha = dt.strptime(fecha_str, '%Y-%m-%d').date()
-                    else:
-                        fecha = dt.today().date()
-                    lat = get('local_lat','lat','Lat')
-                    lng = get('local_lng','lng','Lng')
-                    try:
-                        lat = float(lat) if lat else None
-                    except:
-                        lat = None
-                    try:
-                        lng = float(lng) if lng else None
-                    except:
-                        lng = None
-                    tel_raw = get('local_telefono','telefono','Teléfono') or ''
-                    import re
-                    tel_clean = re.sub(r'[^0-9+]', '', tel_raw)
-                    if tel_clean == '+56' or len(re.sub(r'[^0-9]', '', tel_clean)) < 7:
-                        tel_clean = None
-                    # FKs por ID si vienen en Excel
-                    rid = get('fk_region','region_id','id_region')
-                    cid = get('fk_comuna','comuna_id','id_comuna')
-                    lid = get('fk_localidad','localidad_id','id_localidad')
-                    fk_region = None
-                    fk_comuna = None
-                    fk_localidad = None
-                    try:
-                        if rid:
-                            from .models import Region
-                            fk_region = Region.objects.filter(id=int(float(rid))).first()
-                    except Exception:
-                        fk_region = None
-                    try:
-                        if cid:
-                            from .models import Comuna
-                            fk_comuna = Comuna.objects.filter(id=int(float(cid))).first()
-                    except Exception:
-                        fk_comuna = None
-                    try:
-                        if lid:
-                            from .models import Localidad
-                            fk_localidad = Localidad.objects.filter(id=int(float(lid))).first()
-                    except Exception:
-                        fk_localidad = None
-                    obj = Localfarmacia(
-                        local_id=lid,
-                        local_nombre=get('local_nombre','nombre','Nombre') or '',
-                        local_direccion=get('local_direccion','direccion','Dirección') or '',
-                        comuna_nombre=get('comuna_nombre','comuna','Comuna') or '',
-                        localidad_nombre=get('localidad_nombre','localidad','Localidad') or '',
-                        fk_region=fk_region,
-                        fk_comuna=fk_comuna,
-                        fk_localidad=fk_localidad,
-                        funcionamiento_hora_apertura=hora_ap,
-                        funcionamiento_hora_cierre=hora_ci,
-                        funcionamiento_dia=get('funcionamiento_dia','dia','Día') or 'lunes',
-                        local_telefono=tel_clean,
-                        local_lat=lat,
-                        local_lng=lng,
-                        geolocalizacion_validada=True if (lat is not None and lng is not None) else False,
-                        fecha=fecha,
-                        activo=True,
-                        fecha_creacion=dt.now(),
-                        fecha_modificacion=dt.now(),
-                        usuario_modificacion=usuario,
-                    )
-                    obj.save()
-                    creados += 1
-                except Exception as e:
-                    mensajes.append(f'Fila con error: {e}')
-        except Exception as e:
-            mensajes.append(f'Error al procesar: {e}')
-    context = {'mensajes': mensajes, 'creados': creados}
+            resumen = importar(iter_tablas(csv_text=csv_text, fichero=fichero), usuario=usuario, upsert=upsert)
+            creados = resumen['creados']
+            mensajes = resumen['mensajes']
+    context = {'mensajes': mensajes, 'creados': creados, 'resumen': resumen}
     return render(request, 'localfarmacia/importar-farmacias.html', context)
 
 
 @permiso_requerido('movimientos', 'add')
 @ratelimit(key='ip', rate='20/m', block=True)
 def ingestar_normalizacion(request):
-    from .models import NormalizacionDespacho
+    from .services.ingesta_service import FORMATOS_INGESTA, ingestar_archivo
     mensajes = []
     creados = 0
     procesados = 0
+    ingesta = None
     if request.method == 'POST':
         fichero = request.FILES.get('csv_file')
         fuente = (request.POST.get('fuente') or 'excel').strip().lower()
-        rows = []
-        try:
-            if fichero:
-                name = fichero.name.lower()
-                if name.endswith('.csv') or name.endswith('.tsv'):
-                    import csv, io
-                    data = fichero.read().decode('utf-8', errors='ignore')
-                    sep = '\t' if ('\t' in data or name.endswith('.tsv')) else ','
-                    reader = csv.DictReader(io.StringIO(data), delimiter=sep)
-                    rows = list(reader)
-                elif name.endswith('.xlsx'):
-                    import openpyxl
-                    wb = openpyxl.load_workbook(fichero, data_only=True)
-                    for sheet in wb.worksheets:
-                        values = list(sheet.values)
-                        if not values:
-                            continue
-                        headers = [str(h).strip() if h else '' for h in values[0]]
-                        for row in values[1:]:
-                            d = {}
-                            for i, v in enumerate(row):
-                                key = headers[i] if i < len(headers) else f'col_{i}'
-                                d[key] = v if v is not None else ''
-                            rows.append(d)
-                else:
-                    mensajes.append('Formato no soportado. Usa CSV/TSV/XLSX.')
-            else:
-                mensajes.append('Debes subir un archivo CSV/XLSX.')
-            for r in rows:
-                def get(*keys):
-                    for k in keys:
-                        if k in r and r[k] is not None:
-                            val = str(r[k]).strip()
-                            if val != '':
-                                return val
-                    return None
-                try:
-                    obj = NormalizacionDespacho(
-                        fuente=fuente,
-                        farmacia_origen_local_id=get('farmacia_origen_local_id','local_id','farmacia'),
-                        motorista_documento=get('motorista_documento','motorista','rut_motorista','dni_motorista'),
-                        cliente_nombre_raw=get('cliente_nombre','cliente'),
-                        cliente_telefono_raw=get('cliente_telefono','telefono','fono'),
-                        destino_direccion_raw=get('destino_direccion','direccion','calle'),
-                        destino_lat_raw=get('destino_lat','lat'),
-                        destino_lng_raw=get('destino_lng','lng'),
-                        estado_raw=get('estado','estado_raw'),
-                        tipo_despacho_raw=get('tipo_despacho','tipo'),
-                        prioridad_raw=get('prioridad','prio'),
-                        numero_receta_raw=get('numero_receta','receta'),
-                        observaciones_raw=get('observaciones','obs'),
-                        fecha_registro_raw=get('fecha','fecha_registro'),
-                        procesado=False,
-                        error_normalizacion=None,
-                        fecha_creacion=timezone.now(),
-                    )
-                    obj.save()
-                    creados += 1
-                except Exception as e:
-                    mensajes.append(f'Fila staging con error: {e}')
-            try:
-                normalize_from_normalizacion(limit=500)
-                procesados = 1
-            except Exception as e:
-                mensajes.append(f'Error en normalización: {e}')
-        except Exception as e:
-            mensajes.append(f'Error al procesar: {e}')
-    context = {'mensajes': mensajes, 'creados': creados, 'procesados': procesados}
+        if not fichero:
+            mensajes.append('Debes subir un archivo CSV/XLSX.')
+        elif not fichero.name.lower().endswith(FORMATOS_INGESTA):
+            mensajes.append('Formato no soportado. Usa CSV/TSV/XLSX.')
+        else:
+            # Lectura incremental + bulk_create por lotes; el avance queda en ingesta_normalizacion
+            usuario = Usuario.objects.filter(django_user_id=request.user.id).first()
+            ingesta, errores = ingestar_archivo(fichero, fuente, usuario=usuario)
+            mensajes.extend(errores)
+            creados = ingesta.filas_insertadas
+            procesados = 1 if ingesta.vueltas_normalizacion else 0
+            if ingesta.filas_error:
+                mensajes.append(f'Filas con error: {ingesta.filas_error}')
+    context = {'mensajes': mensajes, 'creados': creados, 'procesados': procesados, 'ingesta': ingesta}
     return render(request, 'movimientos/ingestar-staging.html', context)
 
 
+@permiso_requerido('movimientos', 'view')
+def api_ingestas_normalizacion(request):
+    from .models import IngestaNormalizacion
+    campos = ('id', 'fuente', 'archivo_nombre', 'estado', 'filas_leidas', 'filas_insertadas', 'filas_error', 'lotes', 'vueltas_normalizacion', 'ultimo_error', 'fecha_inicio', 'fecha_actualizacion', 'fecha_fin')
+    qs = IngestaNormalizacion.objects.order_by('-id')
+    if (request.GET.get('id') or '').isdigit():
+        qs = qs.filter(pk=int(request.GET.get('id')))
+    items = list(qs.values(*campos)[:20])
+    return JsonResponse({'items': items})
+
+
 @permiso_requerido('movimientos', 'add')
 @ratelimit(key='ip', rate='20/m', block=True)
 def registrar_movimiento(request):
-    from .models import Despacho, MovimientoDespacho, Usuario
+    from .models import Usuario
+    from .services.despacho_estado_service import DespachoStateMachine
     feedback = None
     import logging
     log = logging.getLogger('appnproylogico')
@@ -1484,85 +1108,16 @@ def registrar_movimiento(request):
         estado = request.POST.get('estado','').strip()
         mensaje = request.POST.get('mensaje','').strip()
         try:
-            despacho = Despacho.objects.filter(codigo_despacho=codigo).first()
-            if not despacho:
-                feedback = 'Despacho no encontrado'
-                log.info('Movimiento rechazado: despacho no encontrado codigo=%s ip=%s', codigo, request.META.get('REMOTE_ADDR'))
+            usuario = Usuario.objects.filter(django_user_id=request.user.id).first()
+            observacion = (f'modo={metodo}; tipo={tipo_mov or ""}; ' + (mensaje or '')).strip()
+            res = DespachoStateMachine(usuario).aplicar(codigo, estado, observacion=observacion, mensaje=mensaje)
+            if not res['ok']:
+                feedback = res['error']
+                log.info('Movimiento rechazado codigo=%s de=%s a=%s motivo=%s ip=%s', codigo, res['estado_anterior'], res['estado'], feedback, request.META.get('REMOTE_ADDR'))
+                messages.error(request, feedback)
             else:
-                from django.utils import timezone
-                usuario = Usuario.objects.filter(django_user_id=request.user.id).first()
-                estado_norm = (despacho.estado or '').strip().upper()
-                nuevo = (estado or '').strip().upper()
-                tipo_d = (despacho.tipo_despacho or '').strip().upper()
-                mapa = {
-                    'PENDIENTE': {'ASIGNADO','ANULADO'},
-                    'ASIGNADO': {'PREPARANDO','ANULADO'},
-                    'PREPARANDO': {'PREPARADO','ANULADO'},
-                    'PREPARADO': {'EN_CAMINO','ANULADO'},
-                    'EN_CAMINO': {'ENTREGADO','FALLIDO'},
-                }
-                permitidos = mapa.get(estado_norm, set())
-                if nuevo not in permitidos:
-                    feedback = 'Transición de estado no permitida'
-                    log.info('Transición inválida codigo=%s de=%s a=%s', codigo, estado_norm, nuevo)
-                    messages.error(request, feedback)
-                    context = {'feedback': feedback}
-                    return render(request, 'movimientos/registrar-mov.html', context)
-                if tipo_d == 'REENVIO_RECETA' and nuevo == 'PREPARADO':
-                    if not (despacho.tiene_receta_retenida and despacho.receta_devuelta_farmacia):
-                        feedback = 'Receta retenida requiere devolución antes de PREPARADO'
-                        log.info('Bloqueado PREPARADO por receta no devuelta codigo=%s', codigo)
-                        messages.error(request, feedback)
-                        context = {'feedback': feedback}
-                        return render(request, 'movimientos/registrar-mov.html', context)
-                nuevo = (estado or '').strip().upper()
-                tipo_d = (despacho.tipo_despacho or '').strip().upper()
-                mapa = {
-                    'PENDIENTE': {'ASIGNADO','ANULADO'},
-                    'ASIGNADO': {'PREPARANDO','ANULADO'},
-                    'PREPARANDO': {'PREPARADO','ANULADO'},
-                    'PREPARADO': {'EN_CAMINO','ANULADO'},
-                    'EN_CAMINO': {'ENTREGADO','FALLIDO'},
-                }
-                permitidos = mapa.get(estado_norm, set())
-                if nuevo not in permitidos:
-                    feedback = 'Transición de estado no permitida'
-                    log.info('Transición inválida codigo=%s de=%s a=%s', codigo, estado_norm, nuevo)
-                else:
-                    if nuevo == 'PREPARADO' and tipo_d == 'REENVIO_RECETA':
-                        if not (despacho.tiene_receta_retenida and despacho.receta_devuelta_farmacia):
-                            feedback = 'Receta retenida requiere devolución antes de PREPARADO'
-                            log.info('Bloqueado PREPARADO por receta no devuelta codigo=%s', codigo)
-                            context = {'feedback': feedback}
-                            return render(request, 'movimientos/registrar-mov.html', context)
-                    MovimientoDespacho.objects.create(
-                        despacho=despacho,
-                        estado_anterior=despacho.estado,
-                        estado_nuevo=nuevo,
-                        fecha_movimiento=timezone.now(),
-                        usuario=usuario,
-                        observacion=(f'modo={metodo}; tipo={tipo_mov or ""}; ' + (mensaje or '')).strip()
-                    )
-                    despacho.estado = nuevo
-                despacho.usuario_modificacion = usuario
-                despacho.fecha_modificacion = timezone.now()
-                despacho.save()
-                # Auditoría movimiento
-                try:
-                    from .models import AuditoriaGeneral
-                    AuditoriaGeneral.objects.create(
-                        nombre_tabla='movimiento_despacho',
-                        id_registro_afectado=str(despacho.id),
-                        tipo_operacion='MOV',
-                        usuario=usuario,
-                        fecha_evento=timezone.now(),
-                        datos_antiguos={'estado': estado_norm},
-                        datos_nuevos={'estado': estado, 'mensaje': mensaje}
-                    )
-                except Exception:
-                    pass
-                feedback = feedback or 'Movimiento registrado'
-                log.info('Movimiento registrado codigo=%s estado=%s usuario=%s ip=%s', codigo, (nuevo or estado), request.user.username, request.META.get('REMOTE_ADDR'))
+                feedback = 'Movimiento registrado'
+                log.info('Movimiento registrado codigo=%s estado=%s usuario=%s ip=%s', codigo, res['estado'], request.user.username, request.META.get('REMOTE_ADDR'))
         except Exception as e:
             feedback = f'Error: {e}'
             log.error('Error movimiento codigo=%s error=%s', codigo, e)
@@ -1570,273 +1125,195 @@ def registrar_movimiento(request):
     return render(request, 'movimientos/registrar-mov.html', context)
 
 
+MOVIMIENTOS_LOTE_MAX = 200
+USUARIO_REQUERIDO = 'Tu cuenta no tiene un Usuario asociado para registrar movimientos'
+
+
+def _items_lote_desde_form(post):
+    """Pares (codigo, estado) del formulario: 'lineas' con 'CODIGO ESTADO' por línea, o 'codigos' + un 'estado' común."""
+    import re
+    items = []
+    for linea in (post.get('lineas') or '').splitlines():
+        partes = [p for p in re.split(r'[\s,;]+', linea.strip()) if p]
+        if len(partes) >= 2:
+            items.append({'codigo': partes[0], 'estado': partes[1]})
+    estado = (post.get('estado') or '').strip()
+    if estado:
+        codigos = post.getlist('codigos') if len(post.getlist('codigos')) > 1 else re.split(r'[\s,;]+', post.get('codigos') or '')
+        items.extend({'codigo': c.strip(), 'estado': estado} for c in codigos if c and c.strip())
+    return items
+
+
+@permiso_requerido('movimientos', 'add')
+@ratelimit(key='ip', rate='20/m', block=True)
+def registrar_movimientos_lote(request):
+    """Transiciones masivas (inicio/cierre de turno) en una sola transacción; formulario o JSON."""
+    from .models import Usuario
+    from .services.despacho_estado_service import TRANSICIONES, DespachoStateMachine
+    es_json = (request.content_type or '').startswith('application/json')
+    resultados = []
+    error = None
+    if request.method == 'POST':
+        items = []
+        if es_json:
+            try:
+                payload = json.loads(request.body or b'{}')
+                items = payload.get('items') if isinstance(payload, dict) else payload
+                # Los ítems mal formados se reportan uno a uno en los resultados
+                items = items if isinstance(items, list) else []
+            except ValueError:
+                error = 'JSON inválido'
+        else:
+            items = _items_lote_desde_form(request.POST)
+        usuario = Usuario.objects.filter(django_user_id=request.user.id).first()
+        if not error and usuario is None:
+            # Staff/superusuarios sin perfil Usuario: el movimiento exige usuario_id
+            if es_json:
+                return JsonResponse({'error': USUARIO_REQUERIDO}, status=403)
+            error = USUARIO_REQUERIDO
+        if not error and not items:
+            error = 'Sin movimientos para aplicar'
+        elif not error and len(items) > MOVIMIENTOS_LOTE_MAX:
+            error = f'Máximo {MOVIMIENTOS_LOTE_MAX} movimientos por lote'
+        if not error:
+            try:
+                resultados = DespachoStateMachine(usuario).apply_transitions(items)
+            except Exception as e:
+                log.exception('Error en movimientos por lote')
+                error = f'Error: {e}'
+    aplicados = sum(1 for r in resultados if r['ok'])
+    if es_json:
+        if request.method != 'POST':
+            return JsonResponse({'error': 'Método no permitido'}, status=405)
+        if error:
+            return JsonResponse({'error': error}, status=400)
+        return JsonResponse({'aplicados': aplicados, 'rechazados': len(resultados) - aplicados, 'resultados': resultados})
+    if error:
+        messages.error(request, error)
+    elif resultados:
+        messages.success(request, f'Movimientos aplicados: {aplicados} de {len(resultados)}')
+    estados = sorted(set().union(*TRANSICIONES.values()))
+    context = {'resultados': resultados, 'aplicados': aplicados, 'max_items': MOVIMIENTOS_LOTE_MAX, 'estados': estados}
+    return render(request, 'movimientos/registrar-lote.html', context)
+
+
 @permiso_requerido('movimientos', 'view')
 def resumen_operativo_hoy(request):
     rows = get_resumen_operativo_hoy()
     return render(request, 'reportes/resumen-operativo.html', {'rows': rows})
 
 
+class _Echo:
+    """Pseudo-buffer para csv.writer: devuelve la línea en vez de almacenarla."""
+    def write(self, value):
+        return value
+
+
+def _stream_csv(headers, rows, audit=None):
+    w = csv.writer(_Echo())
+    yield w.writerow(headers)
+    for r in rows:
+        yield w.writerow(list(r))
+    if audit:
+        yield w.writerow([audit])
+
+
+def _stream_json(headers, rows, ndjson=False):
+    # NDJSON: un objeto por línea; JSON: el mismo arreglo de siempre, emitido por partes
+    if ndjson:
+        for r in rows:
+            yield json.dumps(dict(zip(headers, r)), ensure_ascii=False, default=str) + '\n'
+        return
+    yield '['
+    sep = ''
+    for r in rows:
+        yield sep + json.dumps(dict(zip(headers, r)), ensure_ascii=False, default=str)
+        sep = ', '
+    yield ']'
+
+
 @permiso_requerido('movimientos', 'view')
 def export_resumen_operativo(request):
-    tipo = (request.GET.get('tipo') or 'diario').strip().lower()
-    formato = (request.GET.get('formato') or 'csv').strip().lower()
-    detalle = (request.GET.get('detalle') or '').strip() == '1'
-    anio = request.GET.get('anio')
-    mes = request.GET.get('mes')
-    display_title = ''
-    if tipo == 'diario' and not detalle:
-        rows = get_resumen_operativo_hoy()
-        headers = ['Farmacia','Comuna','Total despachos','Entregados','Fallidos','Directo','Reenvío receta','Intercambio','Error despacho','Con receta','Con incidencias']
-        filename = 'resumen_diario'
-        rows = [[r[1], r[2], r[3], r[4], r[5], r[13], r[14], r[15], r[16], r[9], r[10]] for r in rows]
-    elif tipo == 'mensual' and not detalle:
-        rows = get_resumen_operativo_mes(anio=anio, mes=mes)
-        headers = ['Año','Mes','Farmacia','Comuna','Total despachos','Entregados','Fallidos','Directo','Reenvío receta','Intercambio','Error despacho','Con receta','Con incidencias']
-        filename = f'resumen_mensual_{anio or "todos"}_{mes or "todos"}'
-        rows = [[r[0], r[1], r[3], r[4], r[5], r[6], r[7], r[15], r[16], r[17], r[18], r[11], r[12]] for r in rows]
-    elif tipo == 'asignaciones_mf':
+    params = normalizar_parametros(request.GET)
+    tipo = params['tipo']
+    formato = params['formato']
+    if formato in FORMATOS_ASYNC and (request.GET.get('async') == '1' or getattr(settings, 'REPORTES_ASYNC', False)):
+        # PDF/XLSX pesados: se encolan y el worker `procesar_reportes` los genera
+        job, creado = encolar_reporte(params, Usuario.objects.filter(django_user_id=request.user.id).first())
+        return JsonResponse({
+            'job_id': job.id,
+            'estado': job.estado,
+            'creado': creado,
+            'estado_url': reverse('estado_reporte_job', args=[job.id]),
+        }, status=202)
+    headers, rows, filename, display_title = construir_export(params)
+
+    if formato in FORMATOS_ASYNC:
+        rows = list(rows)
         try:
-            from .models import AsignacionMotoristaFarmacia, Despacho, Localfarmacia
-            asignaciones = AsignacionMotoristaFarmacia.objects.select_related('motorista__usuario','farmacia').all().order_by('-fecha_asignacion')
-            headers = ['Motorista','Farmacia','Activa','Fecha asignación','Despachos totales','Entregados','Fallidos','En camino','Pendientes','Anulados','Con receta retenida']
-            filename = 'asignaciones_motorista_farmacia'
-            rows = []
-            for a in asignaciones:
-                try:
-                    lid = getattr(a.farmacia, 'local_id', None)
-                    qs = Despacho.objects.filter(motorista=a.motorista)
-                    if lid:
-                        qs = qs.filter(farmacia_origen_local_id=lid)
-                    total = qs.count()
-                    entregados = qs.filter(estado='ENTREGADO').count()
-                    fallidos = qs.filter(estado='FALLIDO').count()
-                    en_camino = qs.filter(estado='EN_CAMINO').count()
-                    pendientes = qs.filter(estado='PENDIENTE').count()
-                    anulados = qs.filter(estado='ANULADO').count()
-                    con_receta = qs.filter(tiene_receta_retenida=True).count()
-                    rows.append([
-                        f"{a.motorista.usuario.nombre} {a.motorista.usuario.apellido}",
-                        f"{a.farmacia.local_nombre}",
-                        'Sí' if a.activa else 'No',
-                        a.fecha_asignacion.strftime('%Y-%m-%d %H:%M'),
-                        total, entregados, fallidos, en_camino, pendientes, anulados, con_receta,
-                    ])
-                except Exception:
-                    continue
-        except Exception:
-            rows = []
-    elif tipo == 'despachos_activos':
-        headers = ['Local','Despacho','Estado','Tipo','Prioridad','Motorista','Cliente','Dirección','Con receta','Incidencia','Fecha']
-        fecha_arg = (request.GET.get('fecha') or timezone.now().strftime('%Y-%m-%d'))
-        filename = f'reporte_diario_despachos_{fecha_arg}'
-        display_title = 'Reporte diario de despachos'
-        try:
-            import json, pathlib
-            base = pathlib.Path(getattr(settings, 'MEDIA_ROOT', None) or (pathlib.Path(settings.BASE_DIR) / 'media')) / 'reportes'
-            rows = []
-            file = base / f'cierre_{fecha_arg}.json'
-            if file.exists():
-                with open(file, 'r', encoding='utf-8') as f:
-                    rows = json.load(f) or []
-            else:
-                # Fallback: construir desde BD de la fecha
-                from .models import Despacho, Localfarmacia
-                try:
-                    y, m, d = [int(x) for x in fecha_arg.split('-')]
-                except Exception:
-                    y, m, d = timezone.now().year, timezone.now().month, timezone.now().day
-                qs = Despacho.objects.filter(fecha_registro__year=y, fecha_registro__month=m, fecha_registro__day=d).order_by('fecha_registro')
-                for obj in qs:
-                    try:
-                        farm = Localfarmacia.objects.filter(local_id=obj.farmacia_origen_local_id).first()
-                        u = getattr(obj.motorista, 'usuario', None)
-                        mot_name = f"{getattr(u,'nombre','')} {getattr(u,'apellido','')}".strip()
-                        rows.append([
-                            getattr(farm,'local_id', obj.farmacia_origen_local_id) or '',
-                            obj.codigo_despacho or obj.id,
-                            obj.estado or '',
-                            obj.tipo_despacho or '',
-                            obj.prioridad or '',
-                            mot_name,
-                            _cliente_normalizado(obj.cliente_nombre),
-                            obj.destino_direccion or '',
-                            'Sí' if obj.tiene_receta_retenida else 'No',
-                            'Sí' if obj.hubo_incidencia else 'No',
-                            obj.fecha_registro.strftime('%Y-%m-%d %H:%M') if obj.fecha_registro else '',
-                        ])
-                    except Exception:
-                        continue
-        except Exception:
-            rows = []
-    elif tipo == 'diario' and detalle:
-        from .models import Despacho
-        from django.utils import timezone
-        hoy = timezone.now().date()
-        qs = Despacho.objects.filter(fecha_registro__date=hoy).order_by('-fecha_registro')
-        headers = ['Local','Despacho','Estado','Fecha']
-        filename = 'movimientos_diario'
-        rows = [[d.farmacia_origen_local_id, d.codigo_despacho or d.id, d.estado, d.fecha_registro.strftime('%Y-%m-%d %H:%M')] for d in qs]
-    elif tipo == 'mensual' and detalle:
-        from .models import Despacho
-        y = int(anio) if anio else None
-        m = int(mes) if mes else None
-        qs = Despacho.objects.all().order_by('-fecha_registro')
-        if y: qs = qs.filter(fecha_registro__year=y)
-        if m: qs = qs.filter(fecha_registro__month=m)
-        headers = ['Local','Despacho','Estado','Fecha']
-        filename = f'movimientos_mensual_{anio or "todos"}_{mes or "todos"}'
-        rows = [[d.farmacia_origen_local_id, d.codigo_despacho or d.id, d.estado, d.fecha_registro.strftime('%Y-%m-%d %H:%M')] for d in qs]
-    else:
-        rows = get_resumen_operativo_anual(anio=anio)
-        headers = ['Año','Farmacia','Comuna','Total despachos','Entregados','Fallidos','Directo','Reenvío receta','Intercambio','Error despacho','Con receta','Con incidencias']
-        filename = f'resumen_anual_{anio or "todos"}'
-        rows = [[r[0], r[2], r[3], r[4], r[5], r[13], r[14], r[15], r[16], r[10], r[11]] for r in rows]
-
-    if not rows and tipo != 'despachos_activos':
-        try:
-            from django.db.models import Count, Q, Avg, Sum
-            from .models import Despacho, Localfarmacia
-            from django.utils import timezone
-            hoy = timezone.now().date()
-            qs = Despacho.objects.all()
-            if tipo == 'diario':
-                qs = qs.filter(fecha_registro__date=hoy)
-            elif tipo == 'mensual':
-                y = int(anio) if anio else hoy.year
-                m = int(mes) if mes else hoy.month
-                qs = qs.filter(fecha_registro__year=y, fecha_registro__month=m)
-            else:
-                y = int(anio) if anio else hoy.year
-                qs = qs.filter(fecha_registro__year=y)
-            agg = qs.values('farmacia_origen_local_id').annotate(
-                total=Count('id'),
-                entregados=Count('id', filter=Q(estado='ENTREGADO')),
-                fallidos=Count('id', filter=Q(estado='FALLIDO')),
-                directo=Count('id', filter=Q(tipo_despacho='DOMICILIO')),
-                reenvio=Count('id', filter=Q(tipo_despacho='REENVIO_RECETA')),
-                intercambio=Count('id', filter=Q(tipo_despacho='INTERCAMBIO')),
-                error=Count('id', filter=Q(tipo_despacho='ERROR_DESPACHO')),
-                con_receta=Count('id', filter=Q(tiene_receta_retenida=True)),
-                con_incidencias=Count('id', filter=Q(hubo_incidencia=True)),
-            )
-            mapa_nombres = {lf.local_id: lf.local_nombre for lf in Localfarmacia.objects.all()}
-            mapa_comunas = {lf.local_id: lf.comuna_nombre for lf in Localfarmacia.objects.all()}
-            if tipo == 'diario':
-                rows = [
-                    (mapa_nombres.get(r['farmacia_origen_local_id']), mapa_comunas.get(r['farmacia_origen_local_id']), r['total'], r['entregados'], r['fallidos'], r['directo'], r['reenvio'], r['intercambio'], r['error'], r['con_receta'], r['con_incidencias'])
-                    for r in agg
-                ]
-            elif tipo == 'mensual':
-                rows = [
-                    (y, m, mapa_nombres.get(r['farmacia_origen_local_id']), mapa_comunas.get(r['farmacia_origen_local_id']), r['total'], r['entregados'], r['fallidos'], r['directo'], r['reenvio'], r['intercambio'], r['error'], r['con_receta'], r['con_incidencias'])
-                    for r in agg
-                ]
-            else:
-                rows = [
-                    (y, mapa_nombres.get(r['farmacia_origen_local_id']), mapa_comunas.get(r['farmacia_origen_local_id']), r['total'], r['entregados'], r['fallidos'], r['directo'], r['reenvio'], r['intercambio'], r['error'], r['con_receta'], r['con_incidencias'])
-                    for r in agg
-                ]
-        except Exception:
-            rows = []
-
-    if formato == 'json':
-        import json
-        from django.http import HttpResponse
-        data = [dict(zip(headers, r)) for r in rows]
-        return HttpResponse(json.dumps(data, ensure_ascii=False), content_type='application/json')
-    elif formato == 'xlsx':
-        from django.http import HttpResponse
-        try:
-            import openpyxl
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = 'Resumen'
-            ws.append(headers)
-            for r in rows:
-                ws.append(list(r))
-            resp = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            resp['Content-Disposition'] = f'attachment; filename={filename}.xlsx'
-            import io
-            buf = io.BytesIO()
-            wb.save(buf)
-            resp.write(buf.getvalue())
-            return resp
-        except Exception:
-            formato = 'csv'
-    elif formato == 'pdf':
-        from django.http import HttpResponse
-        try:
-            import io
-            from reportlab.lib.pagesizes import A4, landscape
-            from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-            from reportlab.lib import colors
-            from reportlab.lib.styles import getSampleStyleSheet
-            from reportlab.lib.units import mm
-            try:
-                from reportlab.lib.pdfencrypt import StandardEncryption
-                pwd = (settings.PDF_PASSWORD or '000').strip()
-                enc = StandardEncryption(pwd, pwd, canPrint=1, canModify=0, canCopy=0, canAnnotate=0)
-            except Exception:
-                enc = None
-            buf = io.BytesIO()
-            doc = SimpleDocTemplate(
-                buf,
-                pagesize=landscape(A4),
-                leftMargin=15*mm,
-                rightMargin=15*mm,
-                topMargin=15*mm,
-                bottomMargin=15*mm,
-                encrypt=enc
-            )
-            styles = getSampleStyleSheet()
-            elems = []
-            elems.append(Paragraph((display_title or filename.replace('_',' ').title()), styles['Title']))
-            elems.append(Spacer(1, 6*mm))
-            data_rows = [list(r) for r in rows]
-            if not data_rows:
-                data_rows = [["Sin datos"] + [""] * (len(headers) - 1)]
-            data = [headers] + data_rows
-            table = Table(data, repeatRows=1)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-                ('TEXTCOLOR', (0,0), (-1,0), colors.black),
-                ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0,0), (-1,-1), 8),
-                ('ALIGN', (0,0), (-1,0), 'CENTER'),
-                ('ALIGN', (0,1), (-1,-1), 'LEFT'),
-                ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
-                ('ROWBACKGROUNDS', (0,1), (-1,-1), [colors.whitesmoke, colors.white]),
-            ]))
-            elems.append(table)
-            doc.build(elems)
-            pdf = buf.getvalue()
-            resp = HttpResponse(pdf, content_type='application/pdf')
-            resp['Content-Disposition'] = f'attachment; filename={filename}.pdf'
+            contenido = render_archivo(formato, headers, rows, filename, display_title)
+            ctype = 'application/pdf' if formato == 'pdf' else 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            resp = HttpResponse(contenido, content_type=ctype)
+            resp['Content-Disposition'] = f'attachment; filename={filename}.{formato}'
             return resp
         except Exception:
             formato = 'csv'
+    if formato in ('json', 'ndjson'):
+        resp = StreamingHttpResponse(_stream_json(headers, rows, ndjson=(formato == 'ndjson')), content_type=('application/x-ndjson' if formato == 'ndjson' else 'application/json'))
+        if formato == 'ndjson':
+            resp['Content-Disposition'] = f'attachment; filename={filename}.ndjson'
+        return resp
     # CSV fallback
-    from django.http import HttpResponse
-    import csv, io
-    buf = io.StringIO()
-    w = csv.writer(buf)
-    w.writerow(headers)
-    for r in rows:
-        w.writerow(list(r))
     audit = f'Generado: {timezone.now().isoformat()} tipo={tipo}'
-    w.writerow([audit])
-    resp = HttpResponse(buf.getvalue(), content_type='text/csv; charset=utf-8')
+    resp = StreamingHttpResponse(_stream_csv(headers, rows, audit), content_type='text/csv; charset=utf-8')
     resp['Content-Disposition'] = f'attachment; filename={filename}.csv'
     return resp
 
 
+def _reporte_job_del_usuario(request, job_id, **filtros):
+    """Job `job_id` si lo encoló el usuario del request (staff ve todos); 404 si no."""
+    from .models import ReporteJob
+    qs = ReporteJob.objects.filter(pk=job_id, **filtros)
+    if not (request.user.is_superuser or request.user.is_staff):
+        qs = qs.filter(usuario__django_user_id=request.user.id)
+    return get_object_or_404(qs)
+
+
+@permiso_requerido('movimientos', 'view')
+def estado_reporte_job(request, job_id):
+    job = _reporte_job_del_usuario(request, job_id)
+    data = {
+        'job_id': job.id,
+        'tipo': job.tipo,
+        'formato': job.formato,
+        'estado': job.estado,
+        'creado': job.fecha_creacion.isoformat() if job.fecha_creacion else None,
+        'inicio': job.fecha_inicio.isoformat() if job.fecha_inicio else None,
+        'fin': job.fecha_fin.isoformat() if job.fecha_fin else None,
+        'error': job.error if job.estado == 'ERROR' else None,
+        'descarga_url': reverse('descargar_reporte_job', args=[job.id]) if job.estado == 'LISTO' else None,
+    }
+    return JsonResponse(data)
+
+
+@permiso_requerido('movimientos', 'view')
+def descargar_reporte_job(request, job_id):
+    from django.http import FileResponse, Http404
+    job = _reporte_job_del_usuario(request, job_id, estado='LISTO')
+    ruta = media_root() / (job.archivo or '')
+    if not job.archivo or not ruta.is_file():
+        raise Http404('Archivo de reporte no disponible')
+    return FileResponse(open(ruta, 'rb'), as_attachment=True, filename=ruta.name.split('_', 1)[-1])
+
+
+
 @permiso_requerido('movimientos', 'view')
 def despachos_activos(request):
     prioridad = request.GET.get('prioridad', '').strip()
     receta = request.GET.get('receta', '').strip()
     incidencia = request.GET.get('incidencia', '').strip()
 
-    rows = get_despachos_activos()
+    _, rows = get_despachos_activos_snapshot()
 
     def match_filters(r):
         if prioridad and str(r[4]).strip().upper() != prioridad.upper():
@@ -1882,23 +1359,79 @@ def recetas_pendientes_devolucion(request):
 
 @permiso_requerido('movimientos', 'view')
 def consulta_rapida(request):
-    local = request.GET.get('local', '').strip()
-    motorista = request.GET.get('motorista', '').strip()
-    cliente = request.GET.get('cliente', '').strip()
+    from .services.busqueda_service import buscar
     def _clamp(s):
         s = (s or '').strip()
         return s[:100]
-    local = _clamp(local)
-    motorista = _clamp(motorista)
-    cliente = _clamp(cliente)
-    results = []
-    with connection.cursor() as cur:
-        cur.execute(
-            "SELECT d.codigo_despacho, lf.local_nombre, CONCAT(u.nombre,' ',u.apellido) AS motorista, d.cliente_nombre, d.estado, d.tipo_despacho, d.prioridad, d.fecha_registro FROM despacho d JOIN localfarmacia lf ON d.farmacia_origen_local_id = lf.local_id JOIN motorista mot ON d.motorista_id = mot.id JOIN usuario u ON mot.usuario_id = u.id WHERE (lf.local_nombre LIKE %s OR %s = '') AND (CONCAT(u.nombre,' ',u.apellido) LIKE %s OR %s = '') AND (d.cliente_nombre LIKE %s OR %s = '') ORDER BY d.fecha_registro DESC LIMIT 200",
-            [f"%{local}%", local, f"%{motorista}%", motorista, f"%{cliente}%", cliente]
+    local = _clamp(request.GET.get('local', ''))
+    motorista = _clamp(request.GET.get('motorista', ''))
+    cliente = _clamp(request.GET.get('cliente', ''))
+    despues = request.GET.get('despues', '').strip() or None
+    filas, siguiente = buscar(local=local, motorista=motorista, cliente=cliente, despues=despues)
+    # Misma forma de tupla que la consulta anterior: la plantilla no cambia
+    results = [
+        (f.codigo_despacho, f.local_nombre, f.motorista_nombre, f.cliente_nombre, f.estado, f.tipo_despacho, f.prioridad, f.fecha_registro)
+        for f in filas
+    ]
+    return render(request, 'reportes/consulta-rapida.html', {
+        'results': results,
+        'local': local,
+        'motorista': motorista,
+        'cliente': cliente,
+        'despues': despues,
+        'siguiente': siguiente,
+    })
+
+
+@permiso_requerido('movimientos', 'add')
+def auto_asignar_despachos(request):
+    """
+    GET: propuesta de asignación de los PENDIENTE con su token; POST (token): aplica esa misma propuesta
+
+    JSON si se pide con Accept/Content-Type JSON.
+    """
+    from .models import Usuario
+    from .services.asignacion_service import aplicar_vista_previa, auto_asignar, firmar_propuestas
+    es_json = 'application/json' in (request.headers.get('Accept') or '') or (request.content_type or '').startswith('application/json')
+    aplicar = request.method == 'POST'
+    usuario = Usuario.objects.filter(django_user_id=request.user.id).first()
+    if aplicar and usuario is None:
+        if es_json:
+            return JsonResponse({'error': USUARIO_REQUERIDO}, status=403)
+        messages.error(request, USUARIO_REQUERIDO)
+        return redirect('auto_asignar_despachos')
+    try:
+        if aplicar:
+            if (request.content_type or '').startswith('application/json'):
+                payload = json.loads(request.body or b'{}')
+                token = payload.get('token') if isinstance(payload, dict) else None
+            else:
+                token = request.POST.get('token')
+            resumen = aplicar_vista_previa(token, usuario=usuario)
+        else:
+            resumen = auto_asignar(usuario=usuario, aplicar=False)
+            resumen['token'] = firmar_propuestas(resumen['propuestas'])
+    except ValueError as e:
+        # Token ausente, alterado o vencido, o cuerpo JSON inválido
+        if es_json:
+            return JsonResponse({'error': str(e)}, status=400)
+        messages.error(request, str(e))
+        return redirect('auto_asignar_despachos')
+    except Exception as e:
+        log.exception('Error en asignación automática')
+        if es_json:
+            return JsonResponse({'error': str(e)}, status=500)
+        messages.error(request, f'Error en asignación automática: {e}')
+        return redirect('despachos_activos')
+    if es_json:
+        return JsonResponse(resumen)
+    if aplicar:
+        messages.success(
+            request,
+            f"Asignados {resumen['aplicados']} de {resumen['propuestas']} despachos propuestos ({resumen['omitidos']} ya no estaban disponibles)",
         )
-        results = cur.fetchall()
-    return render(request, 'reportes/consulta-rapida.html', {'results': results, 'local': local, 'motorista': motorista, 'cliente': cliente})
+        return redirect('despachos_activos')
+    return render(request, 'operadora/auto-asignar.html', {'resumen': resumen})
 
 
 @permiso_requerido('movimientos', 'view')
@@ -1936,112 +1469,149 @@ def panel_operadora(request):
     return render(request, 'operadora/panel-operadora.html')
 
 
+def _crear_despachos_demo(usuario, base_dt, n=100, farms=None, mots=None):
+    """Crea hasta `n` despachos demo del día con un solo bulk_create; omite los códigos ya existentes."""
+    import random
+    farms = list(Farmacia.objects.all()) if farms is None else farms
+    mots = list(Motorista.objects.all()) if mots is None else mots
+    if not mots:
+        return 0
+    tipos = ['DOMICILIO','REENVIO_RECETA','INTERCAMBIO','ERROR_DESPACHO']
+    estados = ['PENDIENTE','ASIGNADO','EN_CAMINO','ENTREGADO','FALLIDO']
+    prioridades = ['ALTA','MEDIA','BAJA']
+    codigos = [f"DSP-{base_dt.strftime('%Y%m%d')}-{i:04d}" for i in range(n)]
+    existentes = set(Despacho.objects.filter(codigo_despacho__in=codigos).values_list('codigo_despacho', flat=True))
+    nuevos = []
+    for i, codigo in enumerate(codigos):
+        if codigo in existentes:
+            continue
+        f = random.choice(farms) if farms else None
+        t = tipos[i % len(tipos)]
+        e = estados[(i*3) % len(estados)]
+        nuevos.append(Despacho(
+            codigo_despacho=codigo,
+            numero_orden_farmacia=f"ORD-{i:05d}",
+            farmacia_origen_local_id=(f.local_id if f else 'F001'),
+            farmacia_destino_local_id=(random.choice(farms).local_id if (t=='INTERCAMBIO' and farms) else None),
+            motorista=random.choice(mots),
+            estado=e,
+            tipo_despacho=t,
+            prioridad=prioridades[(i*5) % len(prioridades)],
+            cliente_nombre="Cliente Uno",
+            cliente_telefono='+56900000000',
+            destino_direccion=f"Calle {i} #123",
+            destino_referencia='Frente a plaza',
+            destino_geolocalizacion_validada=False,
+            tiene_receta_retenida=(t=='REENVIO_RECETA'),
+            numero_receta=(f"REC-{i:05d}" if t=='REENVIO_RECETA' else None),
+            requiere_devolucion_receta=(t=='REENVIO_RECETA'),
+            receta_devuelta_farmacia=False,
+            observaciones_receta=None,
+            descripcion_productos='Demo productos',
+            valor_declarado=10000 + (i * 100),
+            requiere_aprobacion_operadora=False,
+            aprobado_por_operadora=False,
+            firma_digital=(e=='ENTREGADO'),
+            hubo_incidencia=(t=='ERROR_DESPACHO'),
+            usuario_aprobador=None,
+            fecha_aprobacion=None,
+            fecha_registro=base_dt,
+            fecha_asignacion=base_dt,
+            fecha_salida_farmacia=None,
+            fecha_modificacion=base_dt,
+            usuario_registro=usuario,
+            usuario_modificacion=usuario,
+        ))
+    if not nuevos:
+        return 0
+    Despacho.objects.bulk_create(nuevos, ignore_conflicts=True)
+    # bulk_create no emite post_save (y en MySQL no devuelve los ids)
+    from .repositories import invalidar_despachos_activos
+    from .services.busqueda_service import indexar_al_confirmar
+    from .services.geo_service import invalidar_indice_geo
+    invalidar_despachos_activos()
+    invalidar_indice_geo('despachos')
+    indexar_al_confirmar(Despacho.objects.filter(codigo_despacho__in=[d.codigo_despacho for d in nuevos]).values_list('id', flat=True))
+    # ignore_conflicts omite en silencio las filas que chocan (otra carga en paralelo): contar lo que quedó
+    return Despacho.objects.filter(codigo_despacho__in=codigos).count() - len(existentes)
+
+
 @permiso_requerido('movimientos', 'add')
 def cerrar_dia_operadora(request):
+    from .services.cierre_service import cerrar_dia
     try:
-        import json, pathlib
         hoy = timezone.now().date()
-        qs = Despacho.objects.filter(fecha_registro__date=hoy).order_by('fecha_registro')
-        rows = []
-        if qs.count() == 0:
-            tipos = ['DOMICILIO','REENVIO_RECETA','INTERCAMBIO','ERROR_DESPACHO']
-            estados = ['PENDIENTE','ASIGNADO','EN_CAMINO','ENTREGADO','FALLIDO']
-            prioridades = ['ALTA','MEDIA','BAJA']
-            farms = list(Farmacia.objects.all())
-            mots = list(Motorista.objects.all())
+        if not Despacho.objects.filter(**filtro_periodo('fecha_registro', fecha=hoy)).exists():
             usuario_reg = Usuario.objects.filter(django_user_id=request.user.id).first() or Usuario.objects.first()
-            base_dt = timezone.now()
-            for i in range(100):
-                try:
-                    f = farms[i % len(farms)] if farms else None
-                    m = mots[i % len(mots)] if mots else None
-                    t = tipos[i % len(tipos)]
-                    e = estados[(i*3) % len(estados)]
-                    p = prioridades[(i*5) % len(prioridades)]
-                    codigo = f"DSP-{base_dt.strftime('%Y%m%d')}-{i:04d}"
-                    if Despacho.objects.filter(codigo_despacho=codigo).exists():
-                        continue
-                    obj = Despacho(
-                        codigo_despacho=codigo,
-                        numero_orden_farmacia=f"ORD-{i:05d}",
-                        farmacia_origen_local_id=(getattr(f, 'local_id', None) if f else None),
-                        farmacia_destino_local_id=(random.choice(farms).local_id if (t=='INTERCAMBIO' and farms) else None),
-                        motorista=m,
-                        estado=e,
-                        tipo_despacho=t,
-                        prioridad=p,
-                        cliente_nombre="Cliente Uno",
-                        cliente_telefono='+56900000000',
-                        destino_direccion=f"Calle {i} #123",
-                        destino_referencia='Frente a plaza',
-                        destino_geolocalizacion_validada=False,
-                        tiene_receta_retenida=(t=='REENVIO_RECETA'),
-                        numero_receta=(f"REC-{i:05d}" if t=='REENVIO_RECETA' else None),
-                        requiere_devolucion_receta=(t=='REENVIO_RECETA'),
-                        receta_devuelta_farmacia=False,
-                        observaciones_receta=None,
-                        descripcion_productos='Demo productos',
-                        valor_declarado=10000 + (i * 100),
-                        requiere_aprobacion_operadora=False,
-                        aprobado_por_operadora=False,
-                        firma_digital=(e=='ENTREGADO'),
-                        hubo_incidencia=(t=='ERROR_DESPACHO'),
-                        usuario_aprobador=None,
-                        fecha_aprobacion=None,
-                        fecha_registro=base_dt,
-                        fecha_asignacion=base_dt,
-                        fecha_salida_farmacia=None,
-                        fecha_modificacion=base_dt,
-                        usuario_registro=usuario_reg,
-                        usuario_modificacion=usuario_reg,
-                    )
-                    obj.save()
-                except Exception:
-                    continue
-            qs = Despacho.objects.filter(fecha_registro__date=hoy).order_by('fecha_registro')
-        else:
-            # Asignar código si falta para garantizar consistencia del cierre
-            seq = 0
-            for d in qs:
-                try:
-                    u = getattr(d.motorista, 'usuario', None)
-                    mot_name = f"{getattr(u,'nombre','')} {getattr(u,'apellido','')}".strip()
-                    if not (d.codigo_despacho or '').strip():
-                        d.codigo_despacho = f"DSP-{hoy.strftime('%Y%m%d')}-{seq:04d}"
-                        seq += 1
-                        d.save()
-                    from .models import Localfarmacia
-                    farm = Localfarmacia.objects.filter(local_id=d.farmacia_origen_local_id).first()
-                    rows.append([
-                        d.farmacia_origen_local_id or '',
-                        d.codigo_despacho or d.id,
-                        d.estado or '',
-                        d.tipo_despacho or '',
-                        d.prioridad or '',
-                        mot_name,
-                        _cliente_normalizado(d.cliente_nombre),
-                        d.destino_direccion or '',
-                        'Sí' if d.tiene_receta_retenida else 'No',
-                        'Sí' if d.hubo_incidencia else 'No',
-                        d.fecha_registro.strftime('%Y-%m-%d %H:%M') if d.fecha_registro else '',
-                    ])
-                except Exception:
-                    continue
-        base_dir = pathlib.Path(getattr(settings, 'MEDIA_ROOT', None) or (pathlib.Path(settings.BASE_DIR) / 'media')) / 'reportes'
-        base_dir.mkdir(parents=True, exist_ok=True)
-        cierre_file = base_dir / f"cierre_{hoy.strftime('%Y-%m-%d')}.json"
-        with open(cierre_file, 'w', encoding='utf-8') as f:
-            json.dump(rows, f, ensure_ascii=False)
-        messages.success(request, f'Reporte de cierre generado: {cierre_file.name}')
+            _crear_despachos_demo(usuario_reg, timezone.now())
+        since = (request.POST.get('since') or request.GET.get('since') or '').strip()
+        usuario = Usuario.objects.filter(django_user_id=request.user.id).first()
+        cierre, nuevas = cerrar_dia(hoy, usuario=usuario, since=int(since) if since.isdigit() else None)
+        messages.success(request, f'Reporte de cierre generado: {cierre.archivo} ({nuevas} despachos nuevos, {cierre.total} en el día)')
     except Exception as e:
         messages.error(request, f'Error generando cierre: {e}')
     return redirect('despachos_activos')
 
+@permiso_requerido('movimientos', 'view')
+def api_cierres_dia(request):
+    """Resumen guardado de los últimos cierres (o de ?fecha=YYYY-MM-DD) sin recalcular."""
+    from .models import CierreDia
+    campos = ('fecha', 'total', 'entregados', 'fallidos', 'en_camino', 'pendientes', 'anulados', 'con_receta', 'con_incidencias', 'por_farmacia', 'filas_archivo', 'archivo', 'fecha_actualizacion')
+    qs = CierreDia.objects.order_by('-fecha')
+    fecha = (request.GET.get('fecha') or '').strip()
+    if fecha:
+        try:
+            qs = qs.filter(fecha=datetime.date.fromisoformat(fecha))
+        except ValueError:
+            return JsonResponse({'error': 'Fecha inválida'}, status=400)
+    return JsonResponse({'items': list(qs.values(*campos)[:31])})
+
+
+def _coordenadas_get(request):
+    """(lat, lng) de la query string o None si faltan o están fuera de rango."""
+    try:
+        lat = float(request.GET.get('lat', ''))
+        lng = float(request.GET.get('lng', ''))
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+@permiso_requerido('movimientos', 'view')
+def api_farmacias_cercanas(request):
+    """Farmacias activas más cercanas a ?lat=&lng= (k<=50; ?abiertas=1 filtra por horario)."""
+    from .services.geo_service import nearest_farmacias
+    punto = _coordenadas_get(request)
+    if not punto:
+        return JsonResponse({'error': 'Coordenadas inválidas'}, status=400)
+    try:
+        k = min(max(int(request.GET.get('k') or 5), 1), 50)
+    except ValueError:
+        k = 5
+    abiertas = request.GET.get('abiertas') in ('1', 'true')
+    return JsonResponse({'items': nearest_farmacias(*punto, k=k, abiertas=abiertas)})
+
+
+@permiso_requerido('movimientos', 'view')
+def api_despachos_en_radio(request):
+    """Despachos no finalizados con destino a ?radio_km= (máx. 20) de ?lat=&lng=."""
+    from .services.geo_service import despachos_en_radio
+    punto = _coordenadas_get(request)
+    if not punto:
+        return JsonResponse({'error': 'Coordenadas inválidas'}, status=400)
+    try:
+        radio = min(max(float(request.GET.get('radio_km') or 2), 0.05), 20.0)
+    except ValueError:
+        radio = 2.0
+    return JsonResponse({'items': despachos_en_radio(*punto, radio_km=radio), 'radio_km': radio})
+
+
 @permiso_requerido('movimientos', 'add')
 def generar_despachos_demo(request):
     try:
-        from .models import Despacho, Localfarmacia, Motorista, Usuario
-        import random, pathlib, json
+        from .models import Localfarmacia, Motorista, Usuario
         hoy_dt = timezone.now()
         farms = list(Localfarmacia.objects.all())
         mots = list(Motorista.objects.all())
@@ -2051,85 +1621,11 @@ def generar_despachos_demo(request):
         if not mots:
             messages.error(request, 'No hay motoristas disponibles para generar demo')
             return redirect('despachos_activos')
-        tipos = ['DOMICILIO','REENVIO_RECETA','INTERCAMBIO','ERROR_DESPACHO']
-        estados = ['PENDIENTE','ASIGNADO','EN_CAMINO','ENTREGADO','FALLIDO']
-        prioridades = ['ALTA','MEDIA','BAJA']
-        created = 0
-        for i in range(100):
-            try:
-                f = random.choice(farms)
-                m = random.choice(mots)
-                t = tipos[i % len(tipos)]
-                e = estados[(i*3) % len(estados)]
-                p = prioridades[(i*5) % len(prioridades)]
-                codigo = f"DSP-{hoy_dt.strftime('%Y%m%d')}-{i:04d}"
-                if Despacho.objects.filter(codigo_despacho=codigo).exists():
-                    continue
-                obj = Despacho(
-                    codigo_despacho=codigo,
-                    numero_orden_farmacia=f"ORD-{i:05d}",
-                    farmacia_origen_local_id=f.local_id,
-                    farmacia_destino_local_id=(random.choice(farms).local_id if t=='INTERCAMBIO' else None),
-                    motorista=m,
-                    estado=e,
-                    tipo_despacho=t,
-                    prioridad=p,
-                    cliente_nombre="Cliente Uno",
-                    cliente_telefono='+56900000000',
-                    destino_direccion=f"Calle {i} #123",
-                    destino_referencia='Frente a plaza',
-                    destino_geolocalizacion_validada=False,
-                    tiene_receta_retenida=(t=='REENVIO_RECETA'),
-                    numero_receta=(f"REC-{i:05d}" if t=='REENVIO_RECETA' else None),
-                    requiere_devolucion_receta=(t=='REENVIO_RECETA'),
-                    receta_devuelta_farmacia=False,
-                    observaciones_receta=None,
-                    descripcion_productos='Demo productos',
-                    valor_declarado=10000 + (i * 100),
-                    requiere_aprobacion_operadora=False,
-                    aprobado_por_operadora=False,
-                    firma_digital=(e=='ENTREGADO'),
-                    hubo_incidencia=(t=='ERROR_DESPACHO'),
-                    usuario_aprobador=None,
-                    fecha_aprobacion=None,
-                    fecha_registro=hoy_dt,
-                    fecha_asignacion=hoy_dt,
-                    fecha_salida_farmacia=None,
-                    fecha_modificacion=hoy_dt,
-                    usuario_registro=Usuario.objects.filter(django_user_id=request.user.id).first(),
-                    usuario_modificacion=Usuario.objects.filter(django_user_id=request.user.id).first(),
-                )
-                obj.save()
-                created += 1
-            except Exception:
-                continue
-        base_dir = pathlib.Path(getattr(settings, 'MEDIA_ROOT', None) or (pathlib.Path(settings.BASE_DIR) / 'media')) / 'reportes'
-        base_dir.mkdir(parents=True, exist_ok=True)
-        cierre_file = base_dir / f"cierre_{hoy_dt.strftime('%Y-%m-%d')}.json"
-        rows = []
-        qs = Despacho.objects.filter(fecha_registro__date=hoy_dt.date()).order_by('fecha_registro')
-        for d in qs:
-            try:
-                u = getattr(d.motorista, 'usuario', None)
-                mot_name = f"{getattr(u,'nombre','')} {getattr(u,'apellido','')}".strip()
-                rows.append([
-                    d.farmacia_origen_local_id or '',
-                    d.codigo_despacho or d.id,
-                    d.estado or '',
-                    d.tipo_despacho or '',
-                    d.prioridad or '',
-                    mot_name,
-                    (d.cliente_nombre or 'Cliente Uno'),
-                    d.destino_direccion or '',
-                    'Sí' if d.tiene_receta_retenida else 'No',
-                    'Sí' if d.hubo_incidencia else 'No',
-                    d.fecha_registro.strftime('%Y-%m-%d %H:%M') if d.fecha_registro else '',
-                ])
-            except Exception:
-                continue
-        with open(cierre_file, 'w', encoding='utf-8') as f:
-            json.dump(rows, f, ensure_ascii=False)
-        messages.success(request, f'Despachos demo creados: {created}. Cierre del día generado: {cierre_file.name}')
+        usuario = Usuario.objects.filter(django_user_id=request.user.id).first()
+        created = _crear_despachos_demo(usuario, hoy_dt, farms=farms, mots=mots)
+        from .services.cierre_service import cerrar_dia
+        cierre, _ = cerrar_dia(hoy_dt.date(), usuario=usuario)
+        messages.success(request, f'Despachos demo creados: {created}. Cierre del día generado: {cierre.archivo}')
     except Exception as e:
         messages.error(request, f'Error generando despachos demo: {e}')
     return redirect('despachos_activos')
@@ -2147,22 +1643,8 @@ def recetas_retencion_panel(request):
         receta_devuelta_farmacia=False
     ).select_related('motorista')
     if not recetas.exists():
-        try:
-            import json, pathlib
-            data_path = pathlib.Path(__file__).resolve().parent.parent / 'static' / 'data' / 'recetas_retencion.json'
-            with open(data_path, 'r', encoding='utf-8') as f:
-                raw = json.load(f)
-            class D:
-                def __init__(self, d):
-                    self.codigo_despacho = d.get('codigo_despacho')
-                    self.farmacia_origen_local_id = d.get('farmacia_origen_local_id')
-                    self.motorista = type('Mot', (), {'usuario': type('U', (), {'nombre': d.get('motorista', {}).get('nombre'), 'apellido': d.get('motorista', {}).get('apellido')})})
-                    self.cliente_nombre = d.get('cliente_nombre')
-                    self.estado = d.get('estado')
-                    self.fecha_registro = d.get('fecha_registro')
-            recetas = [D(d) for d in raw]
-        except Exception:
-            pass
+        from .services.fixtures_estaticos import RecetaFixture, registros
+        recetas = registros('recetas_retencion.json', RecetaFixture) or recetas
 
     historico = Despacho.objects.filter(
         tiene_receta_retenida=True,
@@ -2208,6 +1690,7 @@ def receta_marcar_devuelta(request, despacho_id):
     d.usuario_modificacion = usuario
     d.fecha_modificacion = timezone.now()
     d.save()
+    publicar_evento(evento_despacho(d, tipo='receta'))
     messages.success(request, 'Receta marcada como devuelta')
     return redirect('recetas_retencion_panel')
 # ===== DESPACHOS =====
@@ -2216,7 +1699,7 @@ def listado_despachos(request):
     search = request.GET.get('search','').strip()
     receta = request.GET.get('receta','').strip()
     requiere = request.GET.get('requiere','').strip()
-    qs = Despacho.objects.all().order_by('-fecha_registro')
+    qs = Despacho.objects.all()
     if search:
         qs = qs.filter(Q(codigo_despacho__icontains=search) | Q(cliente_nombre__icontains=search) | Q(farmacia_origen_local_id__icontains=search))
     if receta == 'si':
@@ -2227,14 +1710,7 @@ def listado_despachos(request):
         qs = qs.filter(requiere_devolucion_receta=True)
     elif requiere == 'no':
         qs = qs.filter(requiere_devolucion_receta=False)
-    paginator = Paginator(qs, 10)
-    page = request.GET.get('page')
-    try:
-        page_obj = paginator.page(page)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
-    except EmptyPage:
-        page_obj = paginator.page(paginator.num_pages)
+    page_obj = paginar(qs, request.GET.get('page'), '-fecha_registro')
     return render(request, 'despachos/listado-despachos.html', {
         'page_obj': page_obj,
         'search': search,
@@ -2470,6 +1946,7 @@ def aplicar_correccion_estado(request, pk):
             datos_antiguos={'estado': estado_actual},
             datos_nuevos={'estado': objetivo, 'motivo': (corr.datos_nuevos or {}).get('motivo')}
         )
+        publicar_evento(evento_despacho(d, tipo='correccion', estado_anterior=estado_actual))
         messages.success(request, 'Corrección aplicada')
     except Exception as e:
         messages.error(request, f'Error al aplicar corrección: {e}')
@@ -2491,7 +1968,7 @@ def avisar_movimiento_motorista(request):
             return redirect('avisar_movimiento_motorista')
         u = Usuario.objects.filter(django_user_id=request.user.id).first()
         try:
-            AuditoriaGeneral.objects.create(
+            aviso = AuditoriaGeneral.objects.create(
                 nombre_tabla='comunicacion',
                 id_registro_afectado=codigo,
                 tipo_operacion='AVISO_MOV',
@@ -2505,6 +1982,7 @@ def avisar_movimiento_motorista(request):
                     'mensaje': texto,
                 }
             )
+            publicar_evento({'tipo': 'aviso', 'aviso_id': aviso.id, 'codigo': codigo, 'tipo_mov': tipo, 'metodo': metodo})
             messages.success(request, 'Aviso enviado a Operadora')
         except Exception as e:
             messages.error(request, f'Error: {e}')
@@ -2517,39 +1995,69 @@ def feed_avisos_operadora(request):
     from .models import AuditoriaGeneral
     codigo = (request.GET.get('codigo','') or '').strip()
     motorista = (request.GET.get('motorista','') or '').strip()
-    avisos = AuditoriaGeneral.objects.filter(tipo_operacion='AVISO_MOV')
+    no_leidos = (request.GET.get('no_leidos','') or '').strip() in ('1','true','on')
+    avisos = AuditoriaGeneral.objects.filter(tipo_operacion='AVISO_MOV').select_related('lectura', 'usuario')
+    if no_leidos:
+        avisos = avisos.filter(lectura__isnull=True)
     if codigo:
         avisos = avisos.filter(datos_nuevos__codigo__icontains=codigo)
     if motorista:
         avisos = avisos.filter(Q(usuario__nombre__icontains=motorista) | Q(usuario__apellido__icontains=motorista))
-    avisos = avisos.order_by('-fecha_evento')
-    paginator = Paginator(avisos, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return render(request, 'operadora/avisos.html', {'page_obj': page_obj, 'codigo': codigo, 'motorista': motorista})
+    page_obj = paginar(avisos, request.GET.get('page'), '-fecha_evento')
+    return render(request, 'operadora/avisos.html', {'page_obj': page_obj, 'codigo': codigo, 'motorista': motorista, 'no_leidos': no_leidos})
 
 
 @permiso_requerido('movimientos', 'change')
 def marcar_aviso_leido(request, audit_id):
-    from .models import AuditoriaGeneral, Usuario
+    from .models import AuditoriaGeneral, AvisoLectura, Usuario
     a = AuditoriaGeneral.objects.filter(id=audit_id, tipo_operacion='AVISO_MOV').first()
     if not a:
         messages.error(request, 'Aviso no encontrado')
         return redirect('feed_avisos_operadora')
     try:
-        AuditoriaGeneral.objects.create(
-            nombre_tabla='comunicacion',
-            id_registro_afectado=str(a.id),
-            tipo_operacion='AVISO_MOV_LEIDO',
-            usuario=Usuario.objects.filter(django_user_id=request.user.id).first(),
-            fecha_evento=timezone.now(),
-            datos_antiguos=None,
-            datos_nuevos={'codigo': (a.datos_nuevos or {}).get('codigo'), 'leido': 1}
-        )
+        u = Usuario.objects.filter(django_user_id=request.user.id).first()
+        with transaction.atomic():
+            _, creado = AvisoLectura.objects.get_or_create(aviso=a, defaults={'usuario': u, 'leido_en': timezone.now()})
+            if not creado:
+                messages.info(request, 'El aviso ya estaba marcado como leído')
+                return redirect('feed_avisos_operadora')
+            AuditoriaGeneral.objects.create(
+                nombre_tabla='comunicacion',
+                id_registro_afectado=str(a.id),
+                tipo_operacion='AVISO_MOV_LEIDO',
+                usuario=u,
+                fecha_evento=timezone.now(),
+                datos_antiguos=None,
+                datos_nuevos={'codigo': (a.datos_nuevos or {}).get('codigo'), 'leido': 1}
+            )
         messages.success(request, 'Aviso marcado como leído')
     except Exception as e:
         messages.error(request, f'Error: {e}')
     return redirect('feed_avisos_operadora')
+
+
+@permiso_requerido('movimientos', 'view')
+def stream_eventos(request):
+    """Server-Sent Events con los cambios de despachos/avisos; reemplaza el polling de los paneles.
+
+    ?tipos=despacho,aviso,receta,correccion limita los eventos enviados. Bajo
+    WSGI la conexión retiene un hilo del servidor, así que se corta a los
+    EVENTOS_SSE_SYNC_MAX_SECONDS (30 s) en vez de EVENTOS_SSE_MAX_SECONDS.
+    """
+    from django.core.handlers.asgi import ASGIRequest
+    tipos = {t.strip() for t in (request.GET.get('tipos','') or '').split(',') if t.strip()}
+    keepalive = getattr(settings, 'EVENTOS_KEEPALIVE_SECONDS', 15)
+    if isinstance(request, ASGIRequest):
+        stream = stream_sse(tipos, keepalive, getattr(settings, 'EVENTOS_SSE_MAX_SECONDS', 300))
+    else:
+        duracion = getattr(settings, 'EVENTOS_SSE_SYNC_MAX_SECONDS', 30)
+        stream = stream_sse_sync(tipos, min(keepalive, duracion), duracion)
+    resp = StreamingHttpResponse(stream, content_type='text/event-stream')
+    resp['Cache-Control'] = 'no-cache'
+    resp['X-Accel-Buffering'] = 'no'
+    return resp
+
+
 @login_required(login_url='admin:login')
 def react_despachos_activos(request):
     return render(request, 'react/despachos-activos.html', {})
@@ -2557,14 +2065,41 @@ def react_despachos_activos(request):
 
 @login_required(login_url='admin:login')
 def api_despachos_activos(request):
-    rows = get_despachos_activos()
-    rol = obtener_rol_usuario(request.user)
     q = (request.GET.get('q') or '').strip().lower()
     estado = (request.GET.get('estado') or '').strip().upper()
     prioridad = (request.GET.get('prioridad') or '').strip().upper()
     tipo = (request.GET.get('tipo') or '').strip().upper()
+    try:
+        limit = min(max(int(request.GET.get('limit') or 100), 1), 500)
+    except (TypeError, ValueError):
+        limit = 100
+    try:
+        cursor = int(request.GET.get('cursor')) if request.GET.get('cursor') else None
+    except (TypeError, ValueError):
+        cursor = None
+    # Polling: si la versión del read model y los filtros no cambiaron, 304 sin consultar la vista
+    import hashlib
+    firma = hashlib.sha1(f'{q}|{estado}|{prioridad}|{tipo}|{limit}|{cursor}'.encode()).hexdigest()[:12]
+    version = f'{version_despachos_activos()}-{firma}'
+    if request.GET.get('version') == version or request.headers.get('If-None-Match') == f'"da-{version}"':
+        resp = HttpResponse(status=304)
+        resp['ETag'] = f'"da-{version}"'
+        return resp
+    rol = obtener_rol_usuario(request.user)
+    # Filtros y keyset en SQL; la versión (leída antes) solo alimenta el ETag
+    rows, count, count_estimado, next_cursor = get_despachos_activos_page(
+        q=q, estado=estado, prioridad=prioridad, tipo=tipo, limit=limit, cursor=cursor,
+        count_cap=getattr(settings, 'PAGINACION_CONTEO_EXACTO_MAX', PAGINACION_CONTEO_EXACTO_MAX),
+    )
+    # Secuencia de ruta (services/rutas_service.py) de los despachos de la página
+    from .models import RutaParada
+    paradas = {
+        did: (rid, orden)
+        for did, rid, orden in RutaParada.objects.filter(despacho_id__in=[r[0] for r in rows]).values_list('despacho_id', 'ruta_id', 'orden')
+    } if rows else {}
     data = []
     for r in rows:
+        ruta_id, orden_ruta = paradas.get(r[0], (None, None))
         item = {
             'id': r[0],
             'codigo_despacho': r[1],
@@ -2587,19 +2122,14 @@ def api_despachos_activos(request):
             'hubo_incidencia': bool(r[18]),
             'tipo_incidencia': r[19],
             'coordenadas_destino': r[20],
+            'ruta_id': ruta_id,
+            'orden_ruta': orden_ruta,
         }
         if rol != 'admin':
             tel = item['cliente_telefono']
             s = str(tel or '').strip()
             item['cliente_telefono'] = '***' if not s else ('***' + s[-3:] if len(s) > 3 else '***')
         data.append(item)
-    if q:
-        data = [d for d in data if q in (d['codigo_despacho'] or '').lower() or q in (d['farmacia_origen'] or '').lower() or q in (d['motorista'] or '').lower() or q in (d['destino_direccion'] or '').lower()]
-    if estado:
-        data = [d for d in data if d['estado'] == estado]
-    if prioridad:
-        data = [d for d in data if d['prioridad'] == prioridad]
-    if tipo:
-        data = [d for d in data if d['tipo_despacho'] == tipo]
-    from django.http import JsonResponse
-    return JsonResponse({'items': data, 'count': len(data)})
+    resp = JsonResponse({'items': data, 'count': count, 'count_estimado': count_estimado, 'next_cursor': next_cursor, 'version': version})
+    resp['ETag'] = f'"da-{version}"'
+    return resp
@@ -96,9 +96,22 @@ def registro_view(request):
 def logout_view(request):
     """Vista para cerrar sesión"""
     nombre_usuario = request.user.username
+    access_token = request.COOKIES.get('access_token')
+    refresh_token = request.COOKIES.get('refresh_token')
     logout(request)
+    # Revocar tokens: el post_delete de AccessToken limpia su entrada en caché
+    try:
+        if refresh_token:
+            RefreshToken.objects.filter(token=refresh_token).delete()
+        if access_token:
+            AccessToken.objects.filter(token=access_token).delete()
+    except Exception:
+        pass
     messages.success(request, 'Cerraste tu sesión. Gracias por usar la plataforma.')
-    return redirect('login')
+    resp = redirect('login')
+    resp.delete_cookie('access_token')
+    resp.delete_cookie('refresh_token')
+    return resp
 
 
 def acceso_denegado(request):
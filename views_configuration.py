@@ -186,8 +186,7 @@ def panel_supervisor(request):
         total_motos = 0
     # Fallback con JSON si la BD está vacía
     try:
-        import json, pathlib
-        data_path = pathlib.Path(__file__).resolve().parent.parent / 'static' / 'data'
+        from .services.fixtures_estaticos import contar
         if total_farmacias == 0 or total_motos < 56 or total_motoristas == 0 or total_asignaciones == 0:
             try:
                 call_command('load_samples')
@@ -199,27 +198,17 @@ def panel_supervisor(request):
                 total_motos = Moto.objects.count()
             except Exception:
                 pass
-            if total_farmacias == 0:
-                with open(data_path / 'farmacias.json', 'r', encoding='utf-8') as f:
-                    total_farmacias = len(json.load(f))
-            if total_motos == 0:
-                with open(data_path / 'motos.json', 'r', encoding='utf-8') as f:
-                    total_motos = len(json.load(f))
-            if total_motoristas == 0:
-                with open(data_path / 'motoristas.json', 'r', encoding='utf-8') as f:
-                    total_motoristas = len(json.load(f))
-            if total_asignaciones == 0:
-                with open(data_path / 'asignaciones_motorista_farmacia.json', 'r', encoding='utf-8') as f:
-                    total_asignaciones = len(json.load(f))
+            total_farmacias = total_farmacias or contar('farmacias.json')
+            total_motos = total_motos or contar('motos.json')
+            total_motoristas = total_motoristas or contar('motoristas.json')
+            total_asignaciones = total_asignaciones or contar('asignaciones_motorista_farmacia.json')
     except Exception:
         pass
-    # Incidencias no leídas (AVISO_MOV sin AVISO_MOV_LEIDO asociado)
+    # Incidencias no leídas (AVISO_MOV sin fila en aviso_lectura)
     avisos_no_leidos = 0
     try:
         from .models import AuditoriaGeneral
-        avisos = AuditoriaGeneral.objects.filter(tipo_operacion='AVISO_MOV').values('id')
-        leidos = set(AuditoriaGeneral.objects.filter(tipo_operacion='AVISO_MOV_LEIDO').values_list('id_registro_afectado', flat=True))
-        avisos_no_leidos = sum(1 for a in avisos if str(a['id']) not in leidos)
+        avisos_no_leidos = AuditoriaGeneral.objects.filter(tipo_operacion='AVISO_MOV', lectura__isnull=True).count()
     except Exception:
         avisos_no_leidos = 0
 
@@ -285,13 +274,8 @@ def asignaciones_motorista_farmacia(request):
 
     samples = []
     if page_obj.paginator.count == 0:
-        try:
-            import json, pathlib
-            data_path = pathlib.Path(__file__).resolve().parent.parent / 'static' / 'data' / 'asignaciones_motorista_farmacia.json'
-            with open(data_path, 'r', encoding='utf-8') as f:
-                samples = json.load(f)
-        except Exception:
-            samples = []
+        from .services.fixtures_estaticos import cargar_lista
+        samples = cargar_lista('asignaciones_motorista_farmacia.json')
     incidencias = []
     try:
         from django.db import connection
@@ -301,14 +285,8 @@ def asignaciones_motorista_farmacia(request):
     except Exception:
         incidencias = []
     if not incidencias:
-        try:
-            import json, pathlib
-            data_path = pathlib.Path(__file__).resolve().parent.parent / 'static' / 'data' / 'incidencias.json'
-            with open(data_path, 'r', encoding='utf-8') as f:
-                raw = json.load(f)
-            incidencias = [(d.get('codigo_despacho'), d.get('motorista'), d.get('tipo_incidencia'), d.get('fecha_registro')) for d in raw]
-        except Exception:
-            incidencias = []
+        from .services.fixtures_estaticos import cargar_lista
+        incidencias = [(d.get('codigo_despacho'), d.get('motorista'), d.get('tipo_incidencia'), d.get('fecha_registro')) for d in cargar_lista('incidencias.json')]
     context = {
         'page_obj': page_obj,
         'search_query': search_query,